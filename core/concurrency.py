@@ -0,0 +1,37 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, connection
+
+
+def _on_own_connection(query):
+    def run():
+        # Worker threads keep their connection between queries the way
+        # request threads do, within CONN_MAX_AGE
+        close_old_connections()
+        try:
+            return query()
+        finally:
+            close_old_connections()
+    return run
+
+
+def _in_transaction():
+    return connection.in_atomic_block
+
+
+async def run_queries(*queries):
+    """
+    Run independent read-only queries (callables without arguments) and return their results in order.
+
+    The async ORM methods (aaggregate, acount...) all run in the one thread
+    that owns the request's connection, so gathering them still runs them
+    one after another. Here each query gets a worker thread, and so a
+    database connection, of its own. Inside a transaction (ATOMIC_REQUESTS,
+    tests) other connections cannot see its uncommitted rows, so the queries
+    run in order on its connection instead.
+    """
+    if await sync_to_async(_in_transaction)():
+        return [await sync_to_async(query)() for query in queries]
+    return await asyncio.gather(*(
+        sync_to_async(_on_own_connection(query), thread_sensitive=False)() for query in queries
+    ))
@@ -0,0 +1,38 @@
+import csv
+import io
+from django.http import StreamingHttpResponse
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+def _csv_chunks(header, rows, rows_per_chunk):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # The BOM makes Excel read the file as UTF-8
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    # The header goes out before the query runs, so the download starts at once
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def csv_response(filename, header, rows, rows_per_chunk=500):
+    """
+    Stream rows as a CSV download.
+
+    rows is consumed lazily, normally a values_list(...).iterator(chunk_size=...)
+    queryset, possibly mapped through a generator, so only one chunk of rows
+    is in memory at a time however large the export is.
+    """
+    response = StreamingHttpResponse(_csv_chunks(header, rows, rows_per_chunk), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,35 @@
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+
+
+def row_response(request, template_name=None, context=None, *, insert_into=None, position='beforeend',
+                 delete_row=None, close_modal=False):
+    """
+    HTMX response for a change to a single table row, plus the flash messages.
+
+    The row is sent as an out-of-band swap so the rest of the table is left
+    alone. template_name renders one <tr id="..."> that replaces the row with
+    the same id or, with insert_into, is inserted into that tbody at
+    position. delete_row is the id of a row to remove. close_modal fires the
+    close-modal event the list pages listen to.
+    """
+    parts = []
+    if template_name:
+        row_html = render_to_string(template_name, {**(context or {}), 'oob': insert_into is None}, request=request)
+        if insert_into:
+            row_html = f'<tbody hx-swap-oob="{position}:#{insert_into}">{row_html}</tbody>'
+        parts.append(row_html)
+    if delete_row:
+        parts.append(f'<tr id="{delete_row}" hx-swap-oob="delete"></tr>')
+    parts.append(render_to_string('partials/messages.html', {}, request=request))
+
+    response = HttpResponse(''.join(parts))
+    if close_modal:
+        response['HX-Trigger'] = 'close-modal'
+    return response
+
+
+def partial_response(request, template_name, context=None):
+    """HTMX response with a rendered partial for the request target followed by the flash messages."""
+    html = render_to_string(template_name, context, request=request)
+    return HttpResponse(html + render_to_string('partials/messages.html', {}, request=request))
@@ -0,0 +1,9 @@
+from django.db import models
+
+class DataVersion(models.Model):
+    """Version of the rows of a model, shared by every process (see core.versions)."""
+    label = models.CharField(max_length=100, primary_key=True, verbose_name="Modelo")  # app_label.model_name
+    version = models.BigIntegerField(verbose_name="Versão")
+
+    def __str__(self):
+        return f"{self.label}: {self.version}"
@@ -11,6 +11,7 @@ urlpatterns = [
     path('inventory/', include('inventory.urls')), # Inventory management
     path('sales/', include('sales.urls')), # Sales management
     path('finance/', include('finance.urls')), # Finance management
+    path('jobs/', include('jobs.urls')), # Background job status
     path('', include('dashboard.urls')), # Dashboard as the home page
 ]
 
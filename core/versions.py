@@ -0,0 +1,197 @@
+import hashlib
+import threading
+import time
+from functools import wraps
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from .models import DataVersion
+
+
+def _label(model):
+    return model._meta.label_lower
+
+
+# Versions bumped by the open transaction of each thread, which the
+# database only records when it commits
+_pending = threading.local()
+
+
+def _pending_versions():
+    versions = _pending.__dict__.setdefault('versions', {})
+    if versions and not transaction.get_connection().in_atomic_block:
+        # Whatever the transaction wrote is committed, and stored, or rolled back
+        versions.clear()
+    return versions
+
+
+# Versions read from the database by this process: {label: (version, read at)}
+_read = {}
+_read_lock = threading.Lock()
+
+
+def forget_data_versions(*models):
+    """Drop the versions this process read of models (all of them by default), so the next lookup reads the database."""
+    with _read_lock:
+        if models:
+            for model in models:
+                _read.pop(_label(model), None)
+        else:
+            _read.clear()
+
+
+def _stored_versions(labels):
+    # {label: version} from the DataVersion table, creating missing rows
+    stored = dict(DataVersion.objects.filter(label__in=labels).values_list('label', 'version'))
+    missing = [label for label in labels if label not in stored]
+    if missing:
+        now = time.time_ns()
+        DataVersion.objects.bulk_create([DataVersion(label=label, version=now) for label in missing], ignore_conflicts=True)
+        stored.update(DataVersion.objects.filter(label__in=missing).values_list('label', 'version'))
+    return stored
+
+
+def data_versions(*models):
+    """
+    Version of each model: the time in nanoseconds of its last recorded write.
+
+    Versions live in the DataVersion table, so every process sees the
+    writes of the others. Each process reuses what it read for
+    DATA_VERSIONS_TTL seconds, so a lookup is usually free and another
+    process' write shows within that delay; writes of this process show at
+    once. One that is missing (first use) starts at the current time, so a
+    version never goes back to a value an old cache entry or ETag was built
+    from. Inside a transaction that wrote to a model, its version is already
+    the one the commit will store.
+    """
+    labels = [_label(model) for model in models]
+    now = time.monotonic()
+    with _read_lock:
+        stored = {
+            label: _read[label][0]
+            for label in labels
+            if label in _read and now - _read[label][1] < settings.DATA_VERSIONS_TTL
+        }
+    stale = [label for label in labels if label not in stored]
+    if stale:
+        fresh = _stored_versions(stale)
+        with _read_lock:
+            _read.update((label, (version, now)) for label, version in fresh.items())
+        stored.update(fresh)
+    pending = _pending_versions()
+    return [max(stored.get(label, 0), pending.get(label, 0)) for label in labels]
+
+
+def _store(labels, floor):
+    # Move the stored versions past floor, and past their current value
+    bumped = {'version': Greatest(F('version') + 1, Value(floor))}
+    if DataVersion.objects.filter(label__in=labels).update(**bumped) < len(labels):
+        DataVersion.objects.bulk_create([DataVersion(label=label, version=floor) for label in labels], ignore_conflicts=True)
+        DataVersion.objects.filter(label__in=labels, version__lt=floor).update(**bumped)
+    with _read_lock:
+        for label in labels:
+            _read.pop(label, None)
+
+
+def invalidate(*models):
+    """
+    Record a write to models when the current transaction commits.
+
+    Until then the new versions are only visible to the writing
+    transaction, so it does not read back the old data from a cache, and
+    no other transaction queues on the version rows. Call it after writes
+    that send no signals (queryset updates, bulk_create); track_writes
+    covers the rest.
+    """
+    labels = [_label(model) for model in models]
+    floor = time.time_ns()
+    if transaction.get_connection().in_atomic_block:
+        pending = _pending_versions()
+        for label in labels:
+            pending[label] = max(floor, pending.get(label, 0) + 1)
+        # The stored versions must end up past those the transaction used
+        floor = max(pending[label] for label in labels) + 1
+    transaction.on_commit(lambda: _store(labels, max(floor, time.time_ns())))
+
+
+def track_writes(model, *also):
+    """Invalidate model, and the models in also, whenever one of its rows is saved or deleted."""
+    def changed(sender, **kwargs):
+        invalidate(model, *also)
+
+    label = model._meta.label_lower
+    post_save.connect(changed, sender=model, weak=False, dispatch_uid=f'track_writes_saved_{label}')
+    post_delete.connect(changed, sender=model, weak=False, dispatch_uid=f'track_writes_deleted_{label}')
+
+
+def _stamp(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+
+
+def _revalidate(response):
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['HX-Request'])
+    return response
+
+
+def conditional_on(*models, key=None, when=None):
+    """
+    View decorator answering 304 Not Modified from the versions of models, before the view runs.
+
+    The ETag covers the versions, the URL, the user, whether it is an HTMX
+    request and key(request), for whatever else the response depends on;
+    Last-Modified is the latest write. Browsers are told to revalidate on
+    every use. Only GET requests for which when(request) holds are handled,
+    and never one with flash messages waiting, so they are not lost. Works
+    on sync and async views.
+    """
+    def validators(request):
+        # (etag, last_modified) of a request to handle, None otherwise
+        if request.method not in ('GET', 'HEAD') or (when and not when(request)) or get_messages(request):
+            return None
+
+        versions = data_versions(*models)
+        parts = [request.get_full_path(), str(request.user.pk), str(bool(getattr(request, 'htmx', False))), *map(str, versions)]
+        if key:
+            parts.append(str(key(request)))
+        etag = f'"{hashlib.md5("|".join(parts).encode(), usedforsecurity=False).hexdigest()}"'
+        return etag, max(versions) // 10**9
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                # The session, user and versions are read in a thread, like the rest of the sync code
+                checked = await sync_to_async(validators)(request)
+                if checked is None:
+                    return await view(request, *args, **kwargs)
+                response = get_conditional_response(request, *checked)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                    if response.status_code != 200:
+                        return response
+                    _stamp(response, *checked)
+                return _revalidate(response)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            checked = validators(request)
+            if checked is None:
+                return view(request, *args, **kwargs)
+            response = get_conditional_response(request, *checked)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                _stamp(response, *checked)
+            return _revalidate(response)
+        return wrapper
+    return decorator
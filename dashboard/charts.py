@@ -0,0 +1,89 @@
+import datetime
+from functools import partial
+from django.db.models import Sum
+from core.concurrency import run_queries
+from inventory.models import Product
+from .models import DailySalesRollup, MonthlyCashRollup, ProductSalesRollup
+
+# Every chart reads the rollups maintained by dashboard.rollups, never the
+# sales or transactions themselves; product names come along with the top
+# products
+CHART_MODELS = (DailySalesRollup, MonthlyCashRollup, ProductSalesRollup, Product)
+
+
+def _sales_last_30_days(today):
+    # Vendas Últimos 30 Dias: vendas finalizadas por dia
+    return list(DailySalesRollup.objects.filter(
+        day__gte=today - datetime.timedelta(days=30)
+    ).values('day').annotate(
+        total=Sum('total')
+    ).order_by('day'))
+
+
+def _monthly_cash(today):
+    # Fluxo de Caixa Mensal: Receitas vs Despesas pagas por mês (últimos 6 meses)
+    first_month = (today - datetime.timedelta(days=180)).replace(day=1)
+    return list(MonthlyCashRollup.objects.filter(
+        month__gte=first_month
+    ).values('month').annotate(
+        income=Sum('income'),
+        expense=Sum('expense'),
+    ).order_by('month'))
+
+
+def _top_products():
+    # Top 5 Produtos: Produtos mais vendidos (quantidade)
+    return list(ProductSalesRollup.objects.values(
+        'product__name'
+    ).annotate(
+        total_qty=Sum('quantity')
+    ).filter(total_qty__gt=0).order_by('-total_qty')[:5])
+
+
+def _sales_mix():
+    # Mix de Vendas: Proporção entre Produtos vs Serviços vendidos
+    return DailySalesRollup.objects.aggregate(
+        products=Sum('product_quantity', default=0),
+        services=Sum('service_quantity', default=0),
+    )
+
+
+def _queries(today):
+    return (
+        partial(_sales_last_30_days, today),
+        partial(_monthly_cash, today),
+        _top_products,
+        _sales_mix,
+    )
+
+
+def _chart_data(sales, monthly_cash, top_products, mix):
+    return {
+        'sales_chart': {
+            'labels': [item['day'].strftime('%d/%m') for item in sales],
+            'data': [float(item['total']) for item in sales],
+        },
+        'cash_flow_chart': {
+            'labels': [item['month'].strftime('%b/%Y') for item in monthly_cash],
+            'income': [float(item['income']) for item in monthly_cash],
+            'expense': [float(item['expense']) for item in monthly_cash],
+        },
+        'top_products_chart': {
+            'labels': [item['product__name'] for item in top_products],
+            'data': [item['total_qty'] for item in top_products],
+        },
+        'mix_chart': {
+            'labels': ['Produtos', 'Serviços'],
+            'data': [mix['products'], mix['services']],
+        },
+    }
+
+
+def dashboard_charts(today):
+    """Data of the four dashboard charts, one query each."""
+    return _chart_data(*(query() for query in _queries(today)))
+
+
+async def adashboard_charts(today):
+    """dashboard_charts with its four queries running concurrently (see core.concurrency)."""
+    return _chart_data(*await run_queries(*_queries(today)))
@@ -1,4 +1,6 @@
+from django.utils.functional import SimpleLazyObject
 from .models import Organization
 
 def organization(request):
-    return {'organization': Organization.load()}
+    # Loaded on first use, so partials that never show it skip the lookup
+    return {'organization': SimpleLazyObject(Organization.load)}
@@ -0,0 +1,100 @@
+import datetime
+from functools import partial
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.utils import timezone
+from core.concurrency import run_queries
+from core.versions import data_versions
+from finance.models import Transaction
+from inventory.models import Product
+from sales.models import Sale
+
+DASHBOARD_KPI_CACHE_TIMEOUT = 60
+
+# Models whose writes change the figures
+KPI_MODELS = (Sale, Transaction, Product)
+
+
+def _money(expression, condition):
+    return Sum(expression, filter=condition, default=0, output_field=DecimalField(max_digits=14, decimal_places=2))
+
+
+def _sales_figures(today):
+    sold_today = Q(created_at__date=today)
+    return Sale.objects.filter(sold_today | Q(status='PENDING')).aggregate(
+        sales_today_amount=_money('total', sold_today),
+        sales_today_count=Count('pk', filter=sold_today),
+        pending_orders_count=Count('pk', filter=Q(status='PENDING')),
+    )
+
+
+def _finance_figures(today):
+    due_soon = Q(status='PENDING', due_date__range=[today, today + datetime.timedelta(days=7)])
+    return Transaction.objects.filter(Q(status='PAID') | due_soon).aggregate(
+        income=_money('amount', Q(type='INCOME', status='PAID')),
+        expenses=_money('amount', Q(type='EXPENSE', status='PAID')),
+        receivables=_money('amount', Q(type='INCOME') & due_soon),
+        payables=_money('amount', Q(type='EXPENSE') & due_soon),
+    )
+
+
+def _stock_figures():
+    return Product.objects.with_on_hand().aggregate(
+        low_stock_count=Count('pk', filter=Q(on_hand__lte=F('min_stock'))),
+        stock_value=_money(F('price') * F('on_hand'), None),
+    )
+
+
+def _kpis(sales, finance, stock):
+    count = sales['sales_today_count']
+    return {
+        'sales_today_amount': sales['sales_today_amount'],
+        'pending_orders_count': sales['pending_orders_count'],
+        'cash_flow': finance['income'] - finance['expenses'],
+        'low_stock_count': stock['low_stock_count'],
+        'average_ticket': sales['sales_today_amount'] / count if count > 0 else 0,
+        'receivables': finance['receivables'],
+        'payables': finance['payables'],
+        'stock_value': stock['stock_value'],
+    }
+
+
+def compute_dashboard_kpis(today):
+    """The dashboard figures in three conditional-aggregation queries: sales, transactions and stock."""
+    return _kpis(_sales_figures(today), _finance_figures(today), _stock_figures())
+
+
+async def acompute_dashboard_kpis(today):
+    """compute_dashboard_kpis with its three queries running concurrently (see core.concurrency)."""
+    return _kpis(*await run_queries(partial(_sales_figures, today), partial(_finance_figures, today), _stock_figures))
+
+
+def _cache_key(today):
+    versions = '-'.join(map(str, data_versions(*KPI_MODELS)))
+    return f'dashboard:kpis:{versions}:{today.isoformat()}'
+
+
+def dashboard_kpis(today=None):
+    """
+    The dashboard figures, cached for DASHBOARD_KPI_CACHE_TIMEOUT seconds or
+    until a sale, transaction or product is written (see core.versions).
+    """
+    today = today or timezone.now().date()
+    key = _cache_key(today)
+    kpis = cache.get(key)
+    if kpis is None:
+        kpis = compute_dashboard_kpis(today)
+        cache.set(key, kpis, DASHBOARD_KPI_CACHE_TIMEOUT)
+    return kpis
+
+
+async def adashboard_kpis(today=None):
+    """dashboard_kpis for async views, computed with acompute_dashboard_kpis on a miss."""
+    today = today or timezone.now().date()
+    key = await sync_to_async(_cache_key)(today)
+    kpis = await cache.aget(key)
+    if kpis is None:
+        kpis = await acompute_dashboard_kpis(today)
+        await cache.aset(key, kpis, DASHBOARD_KPI_CACHE_TIMEOUT)
+    return kpis
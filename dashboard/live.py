@@ -0,0 +1,142 @@
+import asyncio
+import json
+import logging
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from core.versions import data_versions
+from .kpis import KPI_MODELS, adashboard_kpis
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the KPI data versions, which catch writes made
+# by other processes, and between keepalives of an idle event stream
+POLL_INTERVAL = 5
+KEEPALIVE_INTERVAL = 15
+
+# Figures the dashboard only shows to administrators
+ADMIN_KPIS = frozenset({'cash_flow', 'receivables', 'payables', 'stock_value'})
+
+
+class Subscriber:
+    """An open live dashboard: the figures it must not see and those changed since it last read."""
+
+    def __init__(self, hidden=()):
+        self.hidden = frozenset(hidden)
+        self.pending = {}
+        self.ready = asyncio.Event()
+
+    def push(self, changes):
+        changes = {name: value for name, value in changes.items() if name not in self.hidden}
+        if changes:
+            # A dashboard that reads slowly gets the latest values, not a backlog
+            self.pending.update(changes)
+            self.ready.set()
+
+    async def changes(self, timeout):
+        """The figures changed since the last call, or {} when none changed within timeout seconds."""
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        self.ready.clear()
+        changes, self.pending = self.pending, {}
+        return changes
+
+
+class KpiBroadcaster:
+    """
+    Pushes the dashboard figures to every live dashboard of this process.
+
+    A single pump task keeps one snapshot of the figures and sends each
+    subscriber what changed, so any number of open dashboards cost one
+    computation per change. notify() wakes it as soon as a transaction is
+    paid (which includes every finalized sale). Writes made by other
+    processes (the other workers, the WSGI container, the job workers) are
+    caught by comparing the KPI data versions every POLL_INTERVAL seconds:
+    core.versions stores them in the database, so no shared cache or
+    cross-worker channel is needed.
+    """
+
+    def __init__(self):
+        self._reset(None)
+
+    def _reset(self, loop):
+        self._loop = loop
+        self._subscribers = set()
+        self._wakeup = asyncio.Event()
+        self._starting = asyncio.Lock()
+        self._pump_task = None
+        self._state = None
+        self._snapshot = {}
+
+    async def subscribe(self, hidden=()):
+        """A new Subscriber, handed the current figures."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # First use in this process, or the previous event loop is gone
+            self._reset(loop)
+        async with self._starting:
+            if self._pump_task is None or self._pump_task.done():
+                # Nobody kept the snapshot current while no dashboard was open
+                await self._refresh()
+                self._pump_task = loop.create_task(self._pump())
+        subscriber = Subscriber(hidden)
+        subscriber.push(self._snapshot)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.discard(subscriber)
+        if not self._subscribers:
+            # Let the pump see there is no one left
+            self._wakeup.set()
+
+    def notify(self):
+        """Refresh the live dashboards now rather than at the next poll. Safe from any thread."""
+        loop = self._loop
+        if loop is not None and self._subscribers and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _refresh(self):
+        # Recompute the figures if their date or data changed; returns the changed ones
+        state = (timezone.now().date(), await sync_to_async(data_versions)(*KPI_MODELS))
+        if state == self._state:
+            return {}
+        kpis = await adashboard_kpis(state[0])
+        changes = {name: value for name, value in kpis.items() if self._snapshot.get(name) != value}
+        self._state, self._snapshot = state, kpis
+        return changes
+
+    async def _pump(self):
+        while self._subscribers:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                changes = await self._refresh()
+            except Exception:
+                logger.exception('Could not refresh the live dashboard figures')
+                continue
+            for subscriber in list(self._subscribers):
+                subscriber.push(changes)
+
+
+kpi_broadcaster = KpiBroadcaster()
+
+
+async def kpi_events(hidden=()):
+    """Server-Sent Events of the dashboard figures: all of them first, then those that change."""
+    subscriber = await kpi_broadcaster.subscribe(hidden)
+    try:
+        while True:
+            changes = await subscriber.changes(KEEPALIVE_INTERVAL)
+            if changes:
+                yield f'event: kpis\ndata: {json.dumps(changes, cls=DjangoJSONEncoder)}\n\n'
+            else:
+                # A comment line, so proxies do not drop an idle connection
+                yield ': keepalive\n\n'
+    finally:
+        kpi_broadcaster.unsubscribe(subscriber)
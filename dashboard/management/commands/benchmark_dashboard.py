@@ -0,0 +1,62 @@
+import asyncio
+import statistics
+import time
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from dashboard.charts import adashboard_charts, dashboard_charts
+from dashboard.kpis import acompute_dashboard_kpis, compute_dashboard_kpis
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares p50/p99 latency of the dashboard queries as the sync views and the async views '
+        '(concurrent KPI and chart queries) run them. Read-only, uncached; run it against a copy of production data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Measured runs of each path')
+        parser.add_argument('--warmup', type=int, default=10, help='Unmeasured runs before measuring')
+
+    def measure_sync(self, compute, options):
+        for _ in range(options['warmup']):
+            compute()
+        samples = []
+        for _ in range(options['requests']):
+            started = time.perf_counter()
+            compute()
+            samples.append(time.perf_counter() - started)
+        return samples
+
+    async def measure_async(self, compute, options):
+        for _ in range(options['warmup']):
+            await compute()
+        samples = []
+        for _ in range(options['requests']):
+            started = time.perf_counter()
+            await compute()
+            samples.append(time.perf_counter() - started)
+        return samples
+
+    def report(self, label, samples):
+        percentiles = statistics.quantiles(samples, n=100)
+        self.stdout.write(f'{label:<14} p50 {percentiles[49] * 1000:8.2f} ms   p99 {percentiles[98] * 1000:8.2f} ms')
+        return percentiles[49]
+
+    def handle(self, *args, **options):
+        if options['requests'] < 2:
+            raise CommandError('--requests must be at least 2')
+        today = timezone.now().date()
+        paths = {
+            'KPIs': (lambda: compute_dashboard_kpis(today), lambda: acompute_dashboard_kpis(today)),
+            'Charts': (lambda: dashboard_charts(today), lambda: adashboard_charts(today)),
+        }
+
+        async def main():
+            # Sync runs go through the same thread an async view hands sync code to
+            for name, (sync_compute, async_compute) in paths.items():
+                sync_p50 = self.report(f'{name} sync', await sync_to_async(self.measure_sync)(sync_compute, options))
+                async_p50 = self.report(f'{name} async', await self.measure_async(async_compute, options))
+                self.stdout.write(self.style.SUCCESS(f'{name}: p50 {sync_p50 / async_p50:.1f}x'))
+
+        asyncio.run(main())
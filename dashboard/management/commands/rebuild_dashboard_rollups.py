@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from dashboard.rollups import rebuild_rollups
+
+class Command(BaseCommand):
+    help = 'Rebuilds the dashboard chart rollups from the completed sales and paid transactions'
+
+    def handle(self, *args, **options):
+        counts = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rollups rebuilt: {counts['days']} day(s), {counts['products']} product(s), {counts['months']} month(s)"
+        ))
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0004_alter_organization_logo_alter_organization_name_and_more'),
+        ('inventory', '0009_purchase_orders'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Dia')),
+                ('slot', models.PositiveSmallIntegerField(default=0)),
+                ('sales_count', models.IntegerField(default=0, verbose_name='Vendas')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Total')),
+                ('product_quantity', models.IntegerField(default=0, verbose_name='Produtos Vendidos')),
+                ('service_quantity', models.IntegerField(default=0, verbose_name='Serviços Vendidos')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'slot'), name='daily_sales_rollup_day_slot')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlyCashRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Mês')),
+                ('slot', models.PositiveSmallIntegerField(default=0)),
+                ('income', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Receitas')),
+                ('expense', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Despesas')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('month', 'slot'), name='monthly_cash_rollup_month_slot')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveSmallIntegerField(default=0)),
+                ('quantity', models.IntegerField(default=0, verbose_name='Quantidade')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.product', verbose_name='Produto')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('product', 'slot'), name='product_sales_rollup_product_slot')],
+            },
+        ),
+    ]
@@ -1,6 +1,9 @@
+import copy
+from django.core.cache import cache
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.models import BaseUserManager
+from core.versions import data_versions, invalidate
 
 #Classe para que o Django reconheça o email como campo de login
 class UserManager(BaseUserManager):
@@ -34,6 +37,11 @@ class User(AbstractUser):
     REQUIRED_FIELDS = []  
     objects = UserManager()
 
+ORGANIZATION_CACHE_TIMEOUT = 60 * 60 * 24
+
+# {version: Organization} of this process, holding only the latest version seen
+_organization_cache = {}
+
 class Organization(models.Model):
     name = models.CharField(max_length=200, default="Atena", verbose_name="Nome da Organização")
     logo = models.ImageField(upload_to='company_logo/', null=True, blank=True, verbose_name="Logotipo")
@@ -47,14 +55,81 @@ class Organization(models.Model):
     def save(self, *args, **kwargs):
         self.pk = 1
         super(Organization, self).save(*args, **kwargs)
+        invalidate(Organization)
 
     def delete(self, *args, **kwargs):
         pass
 
     @classmethod
     def load(cls):
-        obj, created = cls.objects.get_or_create(pk=1)
-        return obj
+        """
+        The organization settings, from this process' memory, then the cache,
+        then the database. Both caches are keyed by the Organization data
+        version, which save() bumps in the database (core.versions), so
+        every process, the job workers included, sees a change within
+        DATA_VERSIONS_TTL seconds. A warm load runs no queries. Returns a
+        copy the caller may modify.
+        """
+        version = data_versions(cls)[0]
+        obj = _organization_cache.get(version)
+        if obj is None:
+            key = f'organization:{version}'
+            obj = cache.get(key)
+            if obj is None:
+                obj, created = cls.objects.get_or_create(pk=1)
+                if created:
+                    # Creating it went through save(), which moved the version on
+                    version = data_versions(cls)[0]
+                    key = f'organization:{version}'
+                cache.set(key, obj, ORGANIZATION_CACHE_TIMEOUT)
+            _organization_cache.clear()
+            _organization_cache[version] = obj
+        return copy.copy(obj)
 
     def __str__(self):
         return self.name
+
+# Dashboard chart rollups. Each key is spread over up to ROLLUP_SLOTS rows
+# that writers pick at random, so concurrent checkouts do not queue on the
+# row of the day; readers sum the slots.
+ROLLUP_SLOTS = 8
+
+class DailySalesRollup(models.Model):
+    """Completed sales per day of creation."""
+    day = models.DateField(verbose_name="Dia")
+    slot = models.PositiveSmallIntegerField(default=0)
+    sales_count = models.IntegerField(default=0, verbose_name="Vendas")
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Total")
+    product_quantity = models.IntegerField(default=0, verbose_name="Produtos Vendidos")
+    service_quantity = models.IntegerField(default=0, verbose_name="Serviços Vendidos")
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['day', 'slot'], name='daily_sales_rollup_day_slot')]
+
+    def __str__(self):
+        return f"{self.day} #{self.slot}: {self.total}"
+
+class ProductSalesRollup(models.Model):
+    """Quantity of each product in completed sales."""
+    product = models.ForeignKey('inventory.Product', on_delete=models.CASCADE, related_name='+', verbose_name="Produto")
+    slot = models.PositiveSmallIntegerField(default=0)
+    quantity = models.IntegerField(default=0, verbose_name="Quantidade")
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['product', 'slot'], name='product_sales_rollup_product_slot')]
+
+    def __str__(self):
+        return f"{self.product_id} #{self.slot}: {self.quantity}"
+
+class MonthlyCashRollup(models.Model):
+    """Paid income and expenses per month of payment (month is its first day)."""
+    month = models.DateField(verbose_name="Mês")
+    slot = models.PositiveSmallIntegerField(default=0)
+    income = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Receitas")
+    expense = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Despesas")
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['month', 'slot'], name='monthly_cash_rollup_month_slot')]
+
+    def __str__(self):
+        return f"{self.month:%m/%Y} #{self.slot}: +{self.income} -{self.expense}"
@@ -0,0 +1,119 @@
+import random
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import TruncDate, TruncMonth
+from core.versions import invalidate
+from finance.models import Transaction
+from sales.models import Sale, SaleItem
+from .models import ROLLUP_SLOTS, DailySalesRollup, MonthlyCashRollup, ProductSalesRollup
+
+
+def _add(model, key_field, deltas):
+    """
+    Add {key: {field: delta}} to the rollup rows of model, keyed by key_field.
+
+    Every key goes to the same randomly picked slot: the missing rows are
+    inserted, then locked in key order so concurrent writers cannot
+    deadlock, and incremented with a single UPDATE, in the caller's
+    transaction when there is one.
+    """
+    deltas = {key: values for key, values in deltas.items() if any(values.values())}
+    if not deltas:
+        return
+    slot = random.randrange(ROLLUP_SLOTS)
+    keys = sorted(deltas)
+    fields = {field for values in deltas.values() for field in values}
+    with transaction.atomic(savepoint=False):
+        model.objects.bulk_create([model(slot=slot, **{key_field: key}) for key in keys], ignore_conflicts=True)
+        pks = list(
+            model.objects.select_for_update().filter(slot=slot, **{f'{key_field}__in': keys})
+            .order_by(key_field).values_list('pk', flat=True)
+        )
+        model.objects.filter(pk__in=pks).update(**{
+            field: F(field) + Case(
+                *[When(**{key_field: key}, then=Value(values.get(field, 0))) for key, values in deltas.items()],
+                default=Value(0), output_field=model._meta.get_field(field).clone(),
+            )
+            for field in fields
+        })
+    invalidate(model)
+
+
+def _daily_deltas(sales, items, sign=1):
+    days = defaultdict(dict)
+    for row in sales.annotate(day=TruncDate('created_at')).values('day').annotate(
+            count=Count('pk'), total=Sum('total')).order_by():
+        days[row['day']].update(sales_count=sign * row['count'], total=sign * row['total'])
+    for row in items.annotate(day=TruncDate('sale__created_at')).values('day').annotate(
+            products=Sum('quantity', filter=Q(product__isnull=False), default=0),
+            services=Sum('quantity', filter=Q(service__isnull=False), default=0)).order_by():
+        days[row['day']].update(product_quantity=sign * row['products'], service_quantity=sign * row['services'])
+    return days
+
+
+def _product_deltas(items, sign=1):
+    rows = items.filter(product__isnull=False).values('product').annotate(quantity=Sum('quantity')).order_by()
+    return {row['product']: {'quantity': sign * row['quantity']} for row in rows}
+
+
+def _cash_deltas(rows):
+    months = defaultdict(lambda: defaultdict(int))
+    for kind, status, paid_date, amount, sign in rows:
+        if status == 'PAID' and paid_date:
+            months[paid_date.replace(day=1)]['income' if kind == 'INCOME' else 'expense'] += sign * amount
+    return months
+
+
+def record_sales(sale_ids, product_quantities, sign=1):
+    """
+    Count completed sales into the daily and product rollups, or take them
+    out with sign=-1. product_quantities is {product_id: quantity} of all
+    those sales, which the callers already computed for the stock. Called
+    in the transaction that finalizes, cancels or deletes them.
+    """
+    if not sale_ids:
+        return
+    items = SaleItem.objects.filter(sale__in=sale_ids)
+    _add(DailySalesRollup, 'day', _daily_deltas(Sale.objects.filter(pk__in=sale_ids), items, sign))
+    _add(ProductSalesRollup, 'product_id', {
+        product_id: {'quantity': sign * quantity} for product_id, quantity in product_quantities.items()
+    })
+
+
+def cash_state(entry):
+    """The fields of a Transaction that decide its part in the monthly cash rollup."""
+    return entry.type, entry.status, entry.paid_date, entry.amount
+
+
+def record_cash(added=(), removed=()):
+    """Apply transaction states (see cash_state) to the monthly cash rollup: added ones count in, removed ones out."""
+    _add(MonthlyCashRollup, 'month', _cash_deltas(
+        [(*state, 1) for state in added] + [(*state, -1) for state in removed]
+    ))
+
+
+def rebuild_rollups():
+    """Recompute every rollup from the sales and transactions in one transaction. Returns the row counts."""
+    completed = Sale.objects.filter(status='COMPLETED')
+    items = SaleItem.objects.filter(sale__status='COMPLETED')
+    paid = (
+        Transaction.objects.filter(status='PAID', paid_date__isnull=False)
+        .annotate(month=TruncMonth('paid_date')).values('month')
+        .annotate(
+            income=Sum('amount', filter=Q(type='INCOME'), default=0),
+            expense=Sum('amount', filter=Q(type='EXPENSE'), default=0),
+        ).order_by()
+    )
+    with transaction.atomic():
+        for model in (DailySalesRollup, ProductSalesRollup, MonthlyCashRollup):
+            model.objects.all().delete()
+        days = DailySalesRollup.objects.bulk_create(
+            DailySalesRollup(day=day, **values) for day, values in _daily_deltas(completed, items).items()
+        )
+        products = ProductSalesRollup.objects.bulk_create(
+            ProductSalesRollup(product_id=product_id, **values) for product_id, values in _product_deltas(items).items()
+        )
+        months = MonthlyCashRollup.objects.bulk_create(MonthlyCashRollup(**row) for row in paid)
+        invalidate(DailySalesRollup, ProductSalesRollup, MonthlyCashRollup)
+    return {'days': len(days), 'products': len(products), 'months': len(months)}
@@ -0,0 +1,32 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from finance.models import Transaction
+from .live import kpi_broadcaster
+from .rollups import cash_state, record_cash
+
+
+@receiver(pre_save, sender=Transaction)
+def transaction_saving(sender, instance, **kwargs):
+    # What the stored row contributes to the cash rollup, read before it is overwritten
+    instance._stored_cash_state = None
+    if not instance._state.adding:
+        instance._stored_cash_state = (
+            Transaction.objects.filter(pk=instance.pk).values_list('type', 'status', 'paid_date', 'amount').first()
+        )
+
+
+@receiver(post_save, sender=Transaction)
+def transaction_saved(sender, instance, **kwargs):
+    stored = getattr(instance, '_stored_cash_state', None)
+    current = cash_state(instance)
+    if stored != current:
+        record_cash(added=[current], removed=[stored] if stored else [])
+    if instance.status == 'PAID' and (stored is None or stored[1] != 'PAID'):
+        # Paid now, finalized sales included: refresh the live dashboards once it commits
+        transaction.on_commit(kpi_broadcaster.notify)
+
+
+@receiver(post_delete, sender=Transaction)
+def transaction_deleted(sender, instance, **kwargs):
+    record_cash(removed=[cash_state(instance)])
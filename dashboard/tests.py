@@ -1,6 +1,32 @@
-from django.test import TestCase, Client
+import datetime
+import io
+import json
+from decimal import Decimal
+import threading
+import time
+from unittest import mock
+from asgiref.sync import async_to_sync, sync_to_async
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.contrib.auth import get_user_model
-from django.urls import reverse
+from django.core.cache import cache
+from django.db.models import Sum
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+from django.core.management import call_command
+from core.concurrency import run_queries
+from core.models import DataVersion
+from core.versions import forget_data_versions
+from dashboard import views
+from dashboard.charts import dashboard_charts
+from dashboard.kpis import acompute_dashboard_kpis, compute_dashboard_kpis, dashboard_kpis
+from dashboard.live import ADMIN_KPIS, kpi_broadcaster
+from dashboard.models import DailySalesRollup, MonthlyCashRollup, Organization, ProductSalesRollup
+from finance.models import Transaction
+from inventory.models import Product, Service
+from sales.models import Customer, Sale, SaleItem
+from sales.services import apply_total_delta, cancel_sale, delete_sale, finalize_sale
 
 User = get_user_model()
 
@@ -24,3 +50,309 @@ class DashboardViewTest(TestCase):
             print(f"Content: {response.content.decode('utf-8')}")
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'dashboard/index.html')
+
+
+class OrganizationCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        forget_data_versions()
+        self.user = User.objects.create_user(email='organization@test.com', password='password')
+        self.client.force_login(self.user)
+
+    def organization_queries(self, queries):
+        return [query['sql'] for query in queries.captured_queries if 'dashboard_organization' in query['sql']]
+
+    def test_warm_renders_do_not_query_the_organization(self):
+        self.client.get(reverse('index'))
+        with self.assertNumQueries(0):
+            self.assertEqual(Organization.load().name, 'Atena')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('customer_search'), {'q': 'x'}, HTTP_HX_REQUEST='true')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.organization_queries(queries), [])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Atena')
+        self.assertEqual(self.organization_queries(queries), [])
+
+    def test_save_invalidates_the_cached_organization(self):
+        Organization.load()
+        organization = Organization.load()
+        organization.name = 'Papelaria Central'
+        self.assertEqual(Organization.load().name, 'Atena')
+
+        organization.save()
+        self.assertEqual(Organization.load().name, 'Papelaria Central')
+        self.assertContains(self.client.get(reverse('index')), 'Papelaria Central')
+
+    def test_save_in_another_process_is_seen(self):
+        Organization.load()
+        # All another process' save leaves behind: the row and the stored version
+        Organization.objects.filter(pk=1).update(receipt_footer_text='Volte sempre')
+        DataVersion.objects.filter(label='dashboard.organization').update(version=time.time_ns())
+        forget_data_versions()  # as DATA_VERSIONS_TTL running out does
+        self.assertEqual(Organization.load().receipt_footer_text, 'Volte sempre')
+
+
+class DashboardKpiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        forget_data_versions()
+        self.user = User.objects.create_user(email='kpis@test.com', password='password')
+        self.customer = Customer.objects.create(name='KPI Customer')
+        self.product = Product.objects.create(name='Caderno', sku='KPI-1', price=10, stock=20, min_stock=5)
+        Product.objects.create(name='Borracha', sku='KPI-2', price=2, stock=3, min_stock=5)
+        today = timezone.now().date()
+        Transaction.objects.create(description='Aluguel', amount=300, type='EXPENSE', status='PAID', due_date=today, paid_date=today)
+        Transaction.objects.create(description='Venda antiga', amount=1000, type='INCOME', status='PAID', due_date=today, paid_date=today)
+        Transaction.objects.create(description='A receber', amount=50, type='INCOME', status='PENDING', due_date=today + datetime.timedelta(days=3))
+        Transaction.objects.create(description='Distante', amount=70, type='EXPENSE', status='PENDING', due_date=today + datetime.timedelta(days=30))
+
+    def test_figures_in_three_queries(self):
+        sale = Sale.objects.create(customer=self.customer, seller=self.user)
+        SaleItem.objects.create(sale=sale, product=self.product, quantity=2, price=10)
+        apply_total_delta(sale, Decimal('20'))
+        with self.assertNumQueries(3):
+            kpis = compute_dashboard_kpis(timezone.now().date())
+        self.assertEqual(kpis, {
+            'sales_today_amount': Decimal('20'),
+            'pending_orders_count': 1,
+            'cash_flow': Decimal('700'),
+            'low_stock_count': 1,
+            'average_ticket': Decimal('20'),
+            'receivables': Decimal('50'),
+            'payables': Decimal('0'),
+            'stock_value': Decimal('206'),
+        })
+
+    def test_cached_until_a_write(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('index'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('index'))
+        self.assertFalse(any('inventory_product' in query['sql'] for query in queries.captured_queries))
+
+        sale = Sale.objects.create(customer=self.customer, seller=self.user)
+        SaleItem.objects.create(sale=sale, product=self.product, quantity=5, price=10)
+        apply_total_delta(sale, Decimal('50'))
+        self.assertEqual(dashboard_kpis()['sales_today_amount'], Decimal('50'))
+        finalize_sale(sale)
+        kpis = dashboard_kpis()
+        self.assertEqual((kpis['pending_orders_count'], kpis['stock_value']), (0, Decimal('156')))
+
+
+class DashboardRollupTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='rollups@test.com', password='password')
+        self.client.force_login(self.user)
+        self.customer = Customer.objects.create(name='Rollup Customer')
+        self.product = Product.objects.create(name='Caneta', sku='RU-1', price=5, stock=100)
+        self.service = Service.objects.create(name='Gravação', price=20)
+
+    def _sale(self, quantity=3, status=None):
+        sale = Sale.objects.create(customer=self.customer, seller=self.user)
+        SaleItem.objects.create(sale=sale, product=self.product, quantity=quantity, price=5)
+        SaleItem.objects.create(sale=sale, service=self.service, quantity=1, price=20)
+        apply_total_delta(sale, Decimal(5 * quantity + 20))
+        return sale
+
+    def _charts(self):
+        return self.client.get(reverse('dashboard_charts_data')).json()
+
+    def _snapshot(self):
+        return (
+            list(DailySalesRollup.objects.values_list('day').annotate(
+                Sum('sales_count'), Sum('total'), Sum('product_quantity'), Sum('service_quantity')).order_by('day')),
+            list(ProductSalesRollup.objects.values_list('product').annotate(Sum('quantity')).order_by('product')),
+            list(MonthlyCashRollup.objects.values_list('month').annotate(Sum('income'), Sum('expense')).order_by('month')),
+        )
+
+    def test_charts_follow_finalized_and_canceled_sales(self):
+        first = self._sale(3)
+        second = self._sale(2)
+        self._sale(50)  # still pending: not in the charts
+        finalize_sale(first)
+        finalize_sale(second)
+
+        charts = self._charts()
+        self.assertEqual(charts['sales_chart']['data'], [65.0])
+        self.assertEqual(charts['top_products_chart'], {'labels': ['Caneta'], 'data': [5]})
+        self.assertEqual(charts['mix_chart']['data'], [5, 2])
+        self.assertEqual(charts['cash_flow_chart']['income'], [65.0])
+
+        cancel_sale(first)
+        charts = self._charts()
+        self.assertEqual(charts['sales_chart']['data'], [30.0])
+        self.assertEqual(charts['mix_chart']['data'], [2, 1])
+        # The paid income is kept and reversed by an expense
+        self.assertEqual((charts['cash_flow_chart']['income'], charts['cash_flow_chart']['expense']), ([65.0], [35.0]))
+
+        delete_sale(second)
+        charts = self._charts()
+        self.assertEqual(charts['sales_chart']['data'], [0.0])
+        self.assertEqual(charts['top_products_chart']['labels'], [])
+        self.assertEqual(charts['cash_flow_chart']['income'], [35.0])
+
+    def test_transaction_changes_move_between_months(self):
+        entry = Transaction.objects.create(description='Aluguel', amount=100, type='EXPENSE', status='PENDING',
+                                           due_date=datetime.date(2026, 1, 10))
+        self.assertFalse(MonthlyCashRollup.objects.exists())
+        entry.status = 'PAID'
+        entry.paid_date = datetime.date(2026, 1, 12)
+        entry.save()
+        entry.paid_date = datetime.date(2026, 2, 1)
+        entry.amount = 120
+        entry.save()
+        self.assertEqual(self._snapshot()[2], [(datetime.date(2026, 1, 1), 0, 0), (datetime.date(2026, 2, 1), 0, 120)])
+        entry.delete()
+        self.assertEqual(self._snapshot()[2], [(datetime.date(2026, 1, 1), 0, 0), (datetime.date(2026, 2, 1), 0, 0)])
+
+    def test_rebuild_matches_the_incremental_rollups(self):
+        for quantity in (1, 2, 3):
+            finalize_sale(self._sale(quantity))
+        cancel_sale(Sale.objects.order_by('pk').first())
+        Transaction.objects.create(description='Luz', amount=40, type='EXPENSE', status='PAID',
+                                   due_date=datetime.date(2026, 3, 5), paid_date=datetime.date(2026, 3, 5))
+
+        def totals():
+            days, products, months = self._snapshot()
+            # Rows that only add up to zero are dropped by the rebuild
+            return ([row for row in days if any(row[1:])], [row for row in products if row[1]],
+                    [row for row in months if any(row[1:])])
+
+        incremental = totals()
+        call_command('rebuild_dashboard_rollups', stdout=io.StringIO())
+        self.assertEqual(totals(), incremental)
+        self.assertEqual(DailySalesRollup.objects.count(), 1)
+
+    def test_unchanged_charts_get_a_304(self):
+        finalize_sale(self._sale(1))
+        response = self.client.get(reverse('dashboard_charts_data'))
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('dashboard_charts_data'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(any('rollup"' in query['sql'] for query in queries.captured_queries))
+
+        finalize_sale(self._sale(2))
+        response = self.client.get(reverse('dashboard_charts_data'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['top_products_chart']['data'], [3])
+
+
+# The routes of an ASYNC_DASHBOARD deployment, for AsyncDashboardTest
+urlpatterns = [
+    path('', views.aindex, name='index'),
+    path('charts-data/', views.adashboard_charts_data, name='dashboard_charts_data'),
+    path('events/', views.dashboard_events, name='dashboard_events'),
+    path('', include('core.urls')),
+]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncDashboardTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        forget_data_versions()
+        self.user = User.objects.create_user(email='async@test.com', password='password')
+        self.client.force_login(self.user)
+        customer = Customer.objects.create(name='Async Customer')
+        product = Product.objects.create(name='Lápis', sku='AS-1', price=2, stock=50, min_stock=5)
+        sale = Sale.objects.create(customer=customer, seller=self.user)
+        SaleItem.objects.create(sale=sale, product=product, quantity=4, price=2)
+        apply_total_delta(sale, Decimal('8'))
+        finalize_sale(sale)
+
+    def test_async_views_match_the_sync_ones(self):
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.resolver_match.func, views.aindex)
+        self.assertTemplateUsed(response, 'dashboard/index.html')
+        self.assertEqual(response.context['stock_value'], dashboard_kpis()['stock_value'])
+
+        response = self.client.get(reverse('dashboard_charts_data'))
+        self.assertEqual(response.resolver_match.func, views.adashboard_charts_data)
+        self.assertEqual(response.json()['top_products_chart'], dashboard_charts(timezone.now().date())['top_products_chart'])
+
+        response = self.client.get(reverse('dashboard_charts_data'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class RunQueriesTest(TransactionTestCase):
+    def test_queries_run_concurrently_on_their_own_connections(self):
+        Product.objects.create(name='Régua', sku='RQ-1', price=3, stock=2, min_stock=5)
+        count, thread = async_to_sync(run_queries)(Product.objects.count, threading.get_ident)
+        self.assertEqual(count, 1)
+        self.assertNotEqual(thread, threading.get_ident())
+
+        today = timezone.now().date()
+        self.assertEqual(async_to_sync(acompute_dashboard_kpis)(today), compute_dashboard_kpis(today))
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class LiveDashboardTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        forget_data_versions()
+        self.seller = User.objects.create_user(email='live@test.com', password='password')
+        customer = Customer.objects.create(name='Live Customer')
+        product = Product.objects.create(name='Cola', sku='LV-1', price=4, stock=30, min_stock=5)
+        self.sale = Sale.objects.create(customer=customer, seller=self.seller)
+        SaleItem.objects.create(sale=self.sale, product=product, quantity=2, price=4)
+        apply_total_delta(self.sale, Decimal('8'))
+
+    def finalize(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            finalize_sale(self.sale)
+
+    async def test_one_computation_reaches_every_dashboard(self):
+        with mock.patch('dashboard.kpis.acompute_dashboard_kpis', wraps=acompute_dashboard_kpis) as compute:
+            admin = await kpi_broadcaster.subscribe()
+            seller = await kpi_broadcaster.subscribe(hidden=ADMIN_KPIS)
+            try:
+                self.assertEqual((await admin.changes(1))['pending_orders_count'], 1)
+                self.assertNotIn('stock_value', await seller.changes(1))
+
+                await sync_to_async(self.finalize)()
+                changes = await admin.changes(5)
+                self.assertEqual(changes, {
+                    'pending_orders_count': 0, 'cash_flow': Decimal('8'), 'stock_value': Decimal('112'),
+                })
+                self.assertEqual(await seller.changes(5), {'pending_orders_count': 0})
+                self.assertEqual(compute.call_count, 2)
+            finally:
+                kpi_broadcaster.unsubscribe(admin)
+                kpi_broadcaster.unsubscribe(seller)
+
+    def cancel_elsewhere(self):
+        # All another process' commit leaves behind: the row and the stored version
+        Sale.objects.filter(pk=self.sale.pk).update(status='CANCELED')
+        DataVersion.objects.filter(label='sales.sale').update(version=time.time_ns())
+        forget_data_versions()  # as DATA_VERSIONS_TTL running out does
+
+    async def test_writes_of_other_processes_reach_the_dashboards(self):
+        with mock.patch('dashboard.live.POLL_INTERVAL', 0.1):
+            admin = await kpi_broadcaster.subscribe()
+            try:
+                self.assertEqual((await admin.changes(1))['pending_orders_count'], 1)
+                await sync_to_async(self.cancel_elsewhere)()
+                self.assertEqual(await admin.changes(5), {'pending_orders_count': 0})
+            finally:
+                kpi_broadcaster.unsubscribe(admin)
+
+    async def test_event_stream_hides_admin_figures_from_sellers(self):
+        await self.async_client.aforce_login(self.seller)
+        response = await self.async_client.get(reverse('dashboard_events'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+        try:
+            event = (await anext(events)).decode()
+        finally:
+            await events.aclose()
+        self.assertTrue(event.startswith('event: kpis\n'))
+        figures = json.loads(event.split('data: ', 1)[1])
+        self.assertEqual(figures['pending_orders_count'], 1)
+        self.assertNotIn('stock_value', figures)
@@ -1,12 +1,21 @@
+from django.conf import settings
 from django.urls import path
 from . import views 
 
+if settings.ASYNC_DASHBOARD:
+    index, charts_data = views.aindex, views.adashboard_charts_data
+else:
+    index, charts_data = views.index, views.dashboard_charts_data
+
 urlpatterns = [
-    path('', views.index, name='index'),
-    path('charts-data/', views.dashboard_charts_data, name='dashboard_charts_data'),
+    path('', index, name='index'),
+    path('charts-data/', charts_data, name='dashboard_charts_data'),
     path('users/', views.user_list, name='user_list'),
     path('users/create/', views.user_create, name='user_create'),
     path('users/<int:pk>/update/', views.user_update, name='user_update'),
     path('users/<int:pk>/delete/', views.user_delete, name='user_delete'),
     path('organization/', views.organization_update, name='organization_update'),
 ]
+
+if settings.ASYNC_DASHBOARD:
+    urlpatterns.append(path('events/', views.dashboard_events, name='dashboard_events'))
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0003_transaction_canceled_status'),
+        ('inventory', '0009_purchase_orders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='purchase_order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='inventory.purchaseorder', verbose_name='Pedido de Compra'),
+        ),
+    ]
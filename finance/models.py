@@ -9,6 +9,7 @@ class Transaction(models.Model):
     STATUS_CHOICES = [
         ('PENDING', 'Pendente'),
         ('PAID', 'Pago'),
+        ('CANCELED', 'Cancelado'),
     ]
     
     description = models.CharField(max_length=255, verbose_name="Descrição")
@@ -18,6 +19,7 @@ class Transaction(models.Model):
     due_date = models.DateField(verbose_name="Data de Vencimento")
     paid_date = models.DateField(blank=True, null=True, verbose_name="Data de Pagamento")
     sale = models.ForeignKey(Sale, on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions', verbose_name="Venda")
+    purchase_order = models.ForeignKey('inventory.PurchaseOrder', on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions', verbose_name="Pedido de Compra")
     
     def __str__(self):
         return f"{self.description} - {self.amount}"
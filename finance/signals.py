@@ -0,0 +1,4 @@
+from core.versions import track_writes
+from .models import Transaction
+
+track_writes(Transaction)
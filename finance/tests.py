@@ -1,4 +1,5 @@
 from django.test import TestCase
+from django.urls import reverse
 from finance.models import Transaction
 from sales.models import Sale, Customer
 from django.contrib.auth import get_user_model
@@ -34,3 +35,16 @@ class TransactionModelTest(TestCase):
         self.transaction.save()
         self.assertEqual(self.transaction.status, 'PAID')
         self.assertIsNotNone(self.transaction.paid_date)
+
+
+class TransactionExportTest(TestCase):
+    def test_exports_transactions_as_csv(self):
+        admin = User.objects.create_user(email='export@test.com', password='password', role='ADMIN')
+        self.client.force_login(admin)
+        today = timezone.now().date()
+        Transaction.objects.create(description='Aluguel', amount=1500, type='EXPENSE', status='PAID',
+                                   due_date=today, paid_date=today)
+        response = self.client.get(reverse('transaction_export'))
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[0], 'ID,Descrição,Tipo,Status,Valor,Data de Vencimento,Data de Pagamento,Venda')
+        self.assertEqual(lines[1].split(',')[1:7], ['Aluguel', 'Despesa', 'Pago', '1500.00', str(today), str(today)])
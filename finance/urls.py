@@ -3,6 +3,7 @@ from . import views
 
 urlpatterns = [
     path('', views.transaction_list, name='transaction_list'),
+    path('export/', views.transaction_export, name='transaction_export'),
     path('create/', views.transaction_create, name='transaction_create'),
     path('<int:pk>/update/', views.transaction_update, name='transaction_update'),
     path('<int:pk>/delete/', views.transaction_delete, name='transaction_delete'),
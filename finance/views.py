@@ -1,27 +1,41 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse
-from django.template.loader import render_to_string
 from django.contrib import messages
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required, user_passes_test
 from .models import Transaction
 from .forms import TransactionForm
 from dashboard.views import is_admin
+from core.csv_export import EXPORT_CHUNK_SIZE, csv_response
+from core.htmx import row_response
 
 @login_required
 def transaction_list(request):
     transactions = Transaction.objects.all()
     return render(request, 'finance/transaction_list.html', {'transactions': transactions})
 
+@login_required
+@user_passes_test(is_admin)
+def transaction_export(request):
+    """Download every transaction as CSV."""
+    types, statuses = dict(Transaction.TYPE_CHOICES), dict(Transaction.STATUS_CHOICES)
+    rows = Transaction.objects.order_by('due_date', 'pk').values_list(
+        'pk', 'description', 'type', 'status', 'amount', 'due_date', 'paid_date', 'sale',
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    header = ['ID', 'Descrição', 'Tipo', 'Status', 'Valor', 'Data de Vencimento', 'Data de Pagamento', 'Venda']
+    return csv_response('transacoes.csv', header, (
+        [pk, description, types[kind], statuses[status], amount, due_date, paid_date, sale]
+        for pk, description, kind, status, amount, due_date, paid_date, sale in rows
+    ))
+
 @login_required
 def transaction_create(request):
     if request.method == 'POST':
         form = TransactionForm(request.POST)
         if form.is_valid():
-            form.save()
+            transaction = form.save()
             if request.htmx:
-                transactions = Transaction.objects.all()
-                return render(request, 'finance/partials/transaction_list_rows.html', {'transactions': transactions})
+                return row_response(request, 'finance/partials/transaction_row.html', {'transaction': transaction},
+                                    insert_into='transaction-table-body', close_modal=True)
             return redirect('transaction_list')
     else:
         form = TransactionForm()
@@ -36,10 +50,9 @@ def transaction_update(request, pk):
     if request.method == 'POST':
         form = TransactionForm(request.POST, instance=transaction)
         if form.is_valid():
-            form.save()
+            transaction = form.save()
             if request.htmx:
-                transactions = Transaction.objects.all()
-                return render(request, 'finance/partials/transaction_list_rows.html', {'transactions': transactions})
+                return row_response(request, 'finance/partials/transaction_row.html', {'transaction': transaction}, close_modal=True)
             return redirect('transaction_list')
     else:
         form = TransactionForm(instance=transaction)
@@ -56,9 +69,5 @@ def transaction_delete(request, pk):
     transaction.delete()
     messages.success(request, 'Transação excluída com sucesso.')
     if request.htmx:
-        transactions = Transaction.objects.all()
-        rows_html = render_to_string('finance/partials/transaction_list_rows.html', {'transactions': transactions}, request=request)
-        messages_html = render_to_string('partials/messages.html', {}, request=request)
-        final_html = rows_html + f'<tr style="display:none"><td>{messages_html}</td></tr>'
-        return HttpResponse(final_html)
+        return row_response(request, delete_row=f'transaction-{pk}')
     return redirect('transaction_list')
@@ -1,6 +1,80 @@
-from django.contrib import admin
-from .models import Product, Service, Supplier
+from django.contrib import admin, messages
+from django.db import transaction
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from .forms import ProductImportForm
+from .models import Product, PurchaseOrder, PurchaseOrderLine, Service, Supplier, StockMovement
+from .product_import import ProductImport, read_product_file
+from .stock import consolidate_stripes
+
+@admin.register(Product)
+class ProductAdmin(admin.ModelAdmin):
+    # Stock changes go through the stock ledger (inventory.stock)
+    readonly_fields = ('stock',)
+    change_list_template = 'admin/inventory/product/change_list.html'
+
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='inventory_product_import'),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        if not self.has_add_permission(request) or not self.has_change_permission(request):
+            return redirect('admin:inventory_product_changelist')
+
+        result = None
+        form = ProductImportForm(request.POST or None, request.FILES or None)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                result = ProductImport(read_product_file(upload, upload.name)).run()
+            except ValueError as e:
+                form.add_error('file', str(e))
+            else:
+                messages.success(request, f'{result.created} produto(s) criado(s) e {result.updated} atualizado(s).')
+                if result.errors:
+                    messages.warning(request, f'{len(result.errors)} linha(s) com erro foram ignoradas.')
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Importar produtos',
+            'form': form,
+            'result': result,
+        }
+        return TemplateResponse(request, 'admin/inventory/product/import.html', context)
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            if 'stock_stripes' in form.changed_data:
+                # Create, drop or fold the stripes right away
+                consolidate_stripes(Product.objects.filter(pk=obj.pk))
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'product', 'kind', 'quantity', 'balance', 'sale', 'note')
+    list_filter = ('kind',)
+    search_fields = ('product__name', 'product__sku')
+    raw_id_fields = ('product', 'sale')
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+class PurchaseOrderLineInline(admin.TabularInline):
+    model = PurchaseOrderLine
+    raw_id_fields = ('product',)
+    extra = 0
+
+@admin.register(PurchaseOrder)
+class PurchaseOrderAdmin(admin.ModelAdmin):
+    list_display = ('id', 'supplier', 'created_at', 'status', 'total')
+    list_filter = ('status',)
+    inlines = [PurchaseOrderLineInline]
 
-admin.site.register(Product)
 admin.site.register(Service)
 admin.site.register(Supplier)
@@ -0,0 +1,118 @@
+import threading
+from collections import Counter
+from django import forms
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.forms.models import ModelChoiceIterator
+from core.versions import data_versions
+from .models import Category, Service, Supplier
+
+CATALOG_CACHE_TIMEOUT = 60 * 60
+
+# Models cached as a whole table, keyed by their write version (see
+# core.versions), and the cached models whose rows change when one of them
+# is saved or deleted (a deleted supplier is SET_NULL on its services by a
+# queryset update, which sends no signals).
+CATALOG_MODELS = (Category, Supplier, Service)
+CATALOG_DEPENDENTS = {Supplier: (Service,)}
+
+_lock = threading.Lock()
+_counters = Counter()
+
+
+def _label(model):
+    return model._meta.label_lower
+
+
+def _key(model):
+    return f'catalog:{_label(model)}:{data_versions(model)[0]}:objects'
+
+
+def catalog_objects(model):
+    """{pk: instance} of every row of a catalog model, in pk order, read from the cache when possible."""
+    label = _label(model)
+    key = _key(model)
+    objects = cache.get(key)
+    with _lock:
+        _counters[label, 'hits' if objects is not None else 'misses'] += 1
+    if objects is None:
+        objects = {obj.pk: obj for obj in model._default_manager.order_by('pk')}
+        cache.set(key, objects, CATALOG_CACHE_TIMEOUT)
+    return objects
+
+
+def catalog_cache_stats():
+    """Hits, misses and current version of each catalog model, counted in this process."""
+    with _lock:
+        counters = dict(_counters)
+    return {
+        _label(model): {
+            'hits': counters.get((_label(model), 'hits'), 0),
+            'misses': counters.get((_label(model), 'misses'), 0),
+            'version': data_versions(model)[0],
+        }
+        for model in CATALOG_MODELS
+    }
+
+
+def reset_catalog_cache_stats():
+    with _lock:
+        _counters.clear()
+
+
+class CachedModelChoiceIterator(ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for obj in self.field.catalog().values():
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(self.field.catalog()) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.field.catalog())
+
+
+class CachedModelChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField over a whole catalog table whose options and submitted
+    value are both resolved from the catalog cache instead of the database,
+    once per form. A value the cache does not know is looked up in the
+    database before being rejected, and the cached table is dropped when it
+    is found there. Only for fields offering every row (no limit_choices_to).
+    """
+    iterator = CachedModelChoiceIterator
+    _catalog = None
+
+    def __deepcopy__(self, memo):
+        result = super().__deepcopy__(memo)
+        result._catalog = None
+        return result
+
+    def catalog(self):
+        """{pk: instance} of the field's model, read from the catalog cache on first use."""
+        if self._catalog is None:
+            self._catalog = catalog_objects(self.queryset.model)
+        return self._catalog
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        model = self.queryset.model
+        if isinstance(value, model):
+            value = value.pk
+        try:
+            pk = model._meta.pk.to_python(value)
+            try:
+                return self.catalog()[pk]
+            except KeyError:
+                # Written where this cache did not hear of it
+                obj = self.queryset.get(pk=pk)
+                cache.delete(_key(model))
+                self._catalog = None
+                return obj
+        except (model.DoesNotExist, TypeError, ValueError, ValidationError):
+            raise ValidationError(
+                self.error_messages['invalid_choice'], code='invalid_choice', params={'value': value},
+            )
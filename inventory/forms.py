@@ -1,5 +1,9 @@
 from django import forms
-from .models import Product, Service, Supplier, Category
+from django.db import transaction
+from .catalog import CachedModelChoiceField
+from .models import Product, PurchaseOrder, Service, Supplier, Category
+from .purchasing import parse_order_lines
+from .stock import consolidate_stripes, set_stock
 
 class SupplierForm(forms.ModelForm):
     class Meta:
@@ -24,7 +28,8 @@ class CategoryForm(forms.ModelForm):
 class ProductForm(forms.ModelForm):
     class Meta:
         model = Product
-        fields = ['name', 'sku', 'category', 'price', 'cost_price', 'stock', 'min_stock', 'unit', 'supplier']
+        fields = ['name', 'sku', 'category', 'price', 'cost_price', 'stock', 'min_stock', 'unit', 'supplier', 'stock_stripes']
+        field_classes = {'category': CachedModelChoiceField, 'supplier': CachedModelChoiceField}
         widgets = {
             'name': forms.TextInput(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-300 focus:ring focus:ring-indigo-200 focus:ring-opacity-50'}),
             'sku': forms.TextInput(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-300 focus:ring focus:ring-indigo-200 focus:ring-opacity-50'}),
@@ -35,15 +40,76 @@ class ProductForm(forms.ModelForm):
             'min_stock': forms.NumberInput(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-300 focus:ring focus:ring-indigo-200 focus:ring-opacity-50'}),
             'unit': forms.Select(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-300 focus:ring focus:ring-indigo-200 focus:ring-opacity-50'}),
             'supplier': forms.Select(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-300 focus:ring focus:ring-indigo-200 focus:ring-opacity-50'}),
+            'stock_stripes': forms.NumberInput(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-300 focus:ring focus:ring-indigo-200 focus:ring-opacity-50'}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['stock_stripes'].required = False
+        if self.instance.pk and self.instance.stock_stripes:
+            # Product.stock of a striped product lags behind its stripes
+            self.initial['stock'] = self.instance.available_stock
+
+    def clean_stock(self):
+        stock = self.cleaned_data['stock']
+        if stock < 0:
+            raise forms.ValidationError('O estoque não pode ser negativo.')
+        return stock
+
+    def clean_stock_stripes(self):
+        return self.cleaned_data['stock_stripes'] or 0
+
+    def save(self, commit=True):
+        # Stock is never overwritten directly: a changed value is recorded as
+        # an ADJUSTMENT in the stock ledger, under the product row lock.
+        product = super().save(commit=False)
+        if not commit:
+            return product
+        stock = product.stock
+        with transaction.atomic():
+            if product.pk is None:
+                product.stock = 0
+                product.save()
+                set_stock(product, stock, note='Estoque inicial')
+            else:
+                product.save(update_fields=[field for field in self._meta.fields if field != 'stock'])
+                if 'stock' in self.changed_data:
+                    set_stock(product, stock, note='Ajuste manual')
+                elif 'stock_stripes' in self.changed_data:
+                    consolidate_stripes(Product.objects.filter(pk=product.pk))
+        return product
+
 class ServiceForm(forms.ModelForm):
     class Meta:
         model = Service
         fields = ['name', 'price', 'estimated_duration', 'supplier']
+        field_classes = {'supplier': CachedModelChoiceField}
         widgets = {
             'name': forms.TextInput(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-300 focus:ring focus:ring-indigo-200 focus:ring-opacity-50'}),
             'price': forms.NumberInput(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-300 focus:ring focus:ring-indigo-200 focus:ring-opacity-50'}),
             'estimated_duration': forms.TextInput(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-300 focus:ring focus:ring-indigo-200 focus:ring-opacity-50', 'placeholder': 'HH:MM:SS'}),
             'supplier': forms.Select(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-300 focus:ring focus:ring-indigo-200 focus:ring-opacity-50'}),
         }
+
+class ProductImportForm(forms.Form):
+    file = forms.FileField(label='Arquivo', help_text='CSV ou XLSX com uma linha de cabeçalho (sku, nome, preço, estoque, categoria, fornecedor...).')
+
+class PurchaseOrderForm(forms.ModelForm):
+    class Meta:
+        model = PurchaseOrder
+        fields = ['supplier']
+        field_classes = {'supplier': CachedModelChoiceField}
+        widgets = {
+            'supplier': forms.Select(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-300 focus:ring focus:ring-indigo-200 focus:ring-opacity-50'}),
+        }
+
+class PurchaseOrderLinesForm(forms.Form):
+    """Lines pasted from the supplier's invoice or a spreadsheet, one "SKU;quantidade;custo" per line."""
+    lines = forms.CharField(label='Itens', widget=forms.Textarea(attrs={
+        'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-300 focus:ring focus:ring-indigo-200 focus:ring-opacity-50 font-mono text-sm',
+        'rows': 6,
+        'placeholder': 'SKU;quantidade;custo unitário',
+    }))
+
+    def clean_lines(self):
+        return parse_order_lines(self.cleaned_data['lines'])
@@ -0,0 +1,84 @@
+import threading
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, transaction
+from inventory.models import Product
+from inventory.stock import InsufficientStockError, consolidate_stripes, move_stock, set_stock
+
+BENCHMARK_SKU = 'BENCHMARK-CHECKOUT'
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures concurrent checkouts of a single product, with and without stock stripes. '
+        'Writes to the database: run it against a disposable copy on PostgreSQL.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent checkouts')
+        parser.add_argument('--sales', type=int, default=50, help='Checkouts per thread')
+        parser.add_argument('--stripes', type=int, default=8, help='Stripes of the striped run')
+        parser.add_argument('--hold', type=float, default=5, help='Milliseconds each checkout keeps its transaction open')
+
+    def checkout(self, product_id, sales, hold, errors):
+        try:
+            for _ in range(sales):
+                with transaction.atomic():
+                    move_stock([(product_id, -1, None)], 'SALE', note='Benchmark')
+                    # Stands in for the rest of finalize_sale (transaction, status, receipt job)
+                    time.sleep(hold)
+        except InsufficientStockError as e:
+            errors.append(e)
+        finally:
+            close_old_connections()
+
+    def run(self, product, stripes, options):
+        sales = options['threads'] * options['sales']
+        with transaction.atomic():
+            Product.objects.filter(pk=product.pk).update(stock_stripes=stripes)
+            product.stock_stripes = stripes
+            # Twice what is sold, so the run measures checkouts rather than running out of stock
+            set_stock(product, 2 * sales)
+
+        errors = []
+        threads = [
+            threading.Thread(target=self.checkout, args=(product.pk, options['sales'], options['hold'] / 1000, errors))
+            for _ in range(options['threads'])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        consolidate_stripes(Product.objects.filter(pk=product.pk))
+        product.refresh_from_db()
+        if errors or product.stock != sales:
+            raise CommandError(f'Stock left at {product.stock} after {sales} checkouts ({len(errors)} error(s))')
+        return sales / elapsed
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            raise CommandError('SQLite serializes every writer; run the benchmark on PostgreSQL')
+
+        product, created = Product.objects.get_or_create(
+            sku=BENCHMARK_SKU, defaults={'name': 'Benchmark de Checkout', 'price': 1},
+        )
+        stripes, stock = product.stock_stripes, product.available_stock
+        try:
+            single = self.run(product, 0, options)
+            self.stdout.write(f'Single row:  {single:8.1f} checkouts/s')
+            striped = self.run(product, options['stripes'], options)
+            self.stdout.write(f'{options["stripes"]} stripes:   {striped:8.1f} checkouts/s')
+            self.stdout.write(self.style.SUCCESS(f'Speedup: {striped / single:.1f}x'))
+        finally:
+            if created:
+                # Only the benchmark's own movements point at it
+                product.delete()
+            else:
+                # Someone else's product (or one sales now refer to): keep it, with its stock and stripes as they were
+                with transaction.atomic():
+                    Product.objects.filter(pk=product.pk).update(stock_stripes=stripes)
+                    set_stock(product, stock, note='Benchmark')
+                consolidate_stripes(Product.objects.filter(pk=product.pk))
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from inventory.stock import consolidate_stripes
+
+class Command(BaseCommand):
+    help = 'Folds the stock stripes of striped products back into Product.stock and rebalances them'
+
+    def handle(self, *args, **options):
+        count = consolidate_stripes()
+        self.stdout.write(self.style.SUCCESS(f'{count} striped product(s) consolidated'))
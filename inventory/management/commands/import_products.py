@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from inventory.product_import import IMPORT_BATCH_SIZE, ProductImport, read_product_file
+
+class Command(BaseCommand):
+    help = 'Creates or updates products from a CSV or XLSX file, matching them by SKU'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or XLSX file; the first row holds the column names')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='Rows validated and written per transaction')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], 'rb') as file:
+                result = ProductImport(
+                    read_product_file(file, options['path']), batch_size=options['batch_size'],
+                ).run()
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+
+        for line, sku, message in result.errors:
+            self.stderr.write(f'Line {line} ({sku or "no SKU"}): {message}')
+        self.stdout.write(self.style.SUCCESS(f'{result.created} product(s) created, {result.updated} updated'))
+        if result.errors:
+            self.stdout.write(self.style.WARNING(f'{len(result.errors)} row error(s)'))
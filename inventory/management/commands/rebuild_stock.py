@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from inventory.stock import rebuild_stock
+
+class Command(BaseCommand):
+    help = 'Recomputes Product.stock and the running balances from the stock movement ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Write the recomputed stock and balances back')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows fetched and written per batch')
+
+    def handle(self, *args, **options):
+        drifted = rebuild_stock(fix=options['fix'], chunk_size=options['chunk_size'])
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('Every product stock matches its ledger'))
+            return
+
+        for pk, stored, expected in drifted:
+            self.stdout.write(f'Product #{pk}: stored {stored}, ledger {expected}')
+
+        if options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'{len(drifted)} product(s) fixed'))
+        else:
+            self.stdout.write(self.style.WARNING(f'{len(drifted)} product(s) drifted, run with --fix to correct them'))
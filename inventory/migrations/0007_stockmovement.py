@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:52
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def opening_balances(apps, schema_editor):
+    # Start the ledger from the current stock of every product
+    Product = apps.get_model('inventory', 'Product')
+    StockMovement = apps.get_model('inventory', 'StockMovement')
+    products = Product.objects.exclude(stock=0).values_list('pk', 'stock').iterator(chunk_size=2000)
+    batch = []
+    for product_id, stock in products:
+        batch.append(StockMovement(product_id=product_id, kind='ADJUSTMENT', quantity=stock, balance=stock, note='Saldo inicial'))
+        if len(batch) >= 2000:
+            StockMovement.objects.bulk_create(batch)
+            batch = []
+    StockMovement.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0006_category_alter_product_cost_price_alter_product_name_and_more'),
+        ('sales', '0007_customer_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('SALE', 'Venda'), ('RETURN', 'Devolução'), ('ADJUSTMENT', 'Ajuste'), ('RECEIPT', 'Recebimento')], max_length=10, verbose_name='Tipo')),
+                ('quantity', models.IntegerField(verbose_name='Quantidade')),
+                ('balance', models.IntegerField(verbose_name='Saldo')),
+                ('note', models.CharField(blank=True, max_length=255, verbose_name='Observação')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Data')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='inventory.product', verbose_name='Produto')),
+                ('sale', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='sales.sale', verbose_name='Venda')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', '-created_at', '-id'], name='stock_movement_product_at_idx')],
+            },
+        ),
+        migrations.RunPython(opening_balances, migrations.RunPython.noop),
+    ]
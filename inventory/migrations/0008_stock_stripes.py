@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0007_stockmovement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='stock_stripes',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Para produtos muito vendidos: divide o estoque em faixas para que vendas simultâneas não se bloqueiem. 0 desativa.', verbose_name='Faixas de Estoque'),
+        ),
+        migrations.AlterField(
+            model_name='stockmovement',
+            name='balance',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Saldo'),
+        ),
+        migrations.CreateModel(
+            name='StockStripe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveSmallIntegerField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stripes', to='inventory.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('product', 'slot'), name='stock_stripe_product_slot_unique')],
+            },
+        ),
+    ]
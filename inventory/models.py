@@ -1,4 +1,8 @@
 from django.db import models
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from dashboard.models import User
 
 class Supplier(models.Model):
     name = models.CharField(max_length=255, verbose_name="Nome")
@@ -16,6 +20,19 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+class ProductQuerySet(models.QuerySet):
+    def with_on_hand(self):
+        """Annotate `on_hand`: the stock of the product, summed over its stripes when it is striped."""
+        stripes = StockStripe.objects.filter(product=OuterRef('pk')).values('product').annotate(
+            total=Sum('quantity')
+        ).values('total')
+        return self.annotate(on_hand=Case(
+            When(stock_stripes=0, then=F('stock')),
+            # A product whose stripes were not created yet still has its stock on the row
+            default=Coalesce(Subquery(stripes), F('stock')),
+            output_field=IntegerField(),
+        ))
+
 class Product(models.Model):
     UNIT_CHOICES = [
         ('UN', 'Unidade'),
@@ -33,10 +50,77 @@ class Product(models.Model):
     min_stock = models.IntegerField(default=5, verbose_name="Estoque Mínimo")
     unit = models.CharField(max_length=2, choices=UNIT_CHOICES, default='UN', verbose_name="Unidade")
     supplier = models.ForeignKey(Supplier, on_delete=models.SET_NULL, null=True, blank=True, related_name='products', verbose_name="Fornecedor")
+    stock_stripes = models.PositiveSmallIntegerField(
+        default=0, verbose_name="Faixas de Estoque",
+        help_text="Para produtos muito vendidos: divide o estoque em faixas para que vendas simultâneas não se bloqueiem. 0 desativa.",
+    )
+
+    objects = ProductQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.name} ({self.sku})"
 
+    @property
+    def available_stock(self):
+        """
+        Current stock. For striped products Product.stock is only the total
+        at the last consolidation and the live value is the sum of the stripes.
+        """
+        if not self.stock_stripes:
+            return self.stock
+        if hasattr(self, 'on_hand'):
+            return self.on_hand
+        total = self.stripes.aggregate(total=Sum('quantity'))['total']
+        return self.stock if total is None else total
+
+class StockStripe(models.Model):
+    """One of the sub-counters holding the stock of a striped product."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stripes')
+    slot = models.PositiveSmallIntegerField()
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'slot'], name='stock_stripe_product_slot_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} #{self.slot}: {self.quantity}"
+
+class StockMovement(models.Model):
+    """
+    Append-only ledger of stock changes.
+
+    Product.stock is the materialized running total of its movements and
+    every movement stores the balance right after it, so the stock at any
+    point in time is the balance of the last movement before it. Movements
+    of striped products taken from a single stripe do not know the total
+    and leave balance empty; the next consolidation records it again.
+    """
+    KIND_CHOICES = [
+        ('SALE', 'Venda'),
+        ('RETURN', 'Devolução'),
+        ('ADJUSTMENT', 'Ajuste'),
+        ('RECEIPT', 'Recebimento'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='movements', verbose_name="Produto")
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, verbose_name="Tipo")
+    quantity = models.IntegerField(verbose_name="Quantidade")
+    balance = models.IntegerField(null=True, blank=True, verbose_name="Saldo")
+    sale = models.ForeignKey('sales.Sale', on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements', verbose_name="Venda")
+    note = models.CharField(max_length=255, blank=True, verbose_name="Observação")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Data")
+
+    class Meta:
+        indexes = [
+            # Point-in-time stock seeks the last movement of a product before a date
+            models.Index(fields=['product', '-created_at', '-id'], name='stock_movement_product_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.quantity:+d} {self.product.name}"
+
 class Service(models.Model):
     name = models.CharField(max_length=255, verbose_name="Nome")
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Preço")
@@ -45,3 +129,33 @@ class Service(models.Model):
 
     def __str__(self):
         return self.name
+
+class PurchaseOrder(models.Model):
+    STATUS_CHOICES = [
+        ('PENDING', 'Pendente'),
+        ('RECEIVED', 'Recebido'),
+        ('CANCELED', 'Cancelado'),
+    ]
+
+    supplier = models.ForeignKey(Supplier, on_delete=models.PROTECT, related_name='purchase_orders', verbose_name="Fornecedor")
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='purchase_orders', verbose_name="Criado por")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Data de Criação")
+    received_at = models.DateTimeField(null=True, blank=True, verbose_name="Data de Recebimento")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING', verbose_name="Status")
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Total")
+
+    def __str__(self):
+        return f"Pedido de Compra #{self.id} - {self.supplier.name}"
+
+class PurchaseOrderLine(models.Model):
+    order = models.ForeignKey(PurchaseOrder, on_delete=models.CASCADE, related_name='lines', verbose_name="Pedido")
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='purchase_lines', verbose_name="Produto")
+    quantity = models.PositiveIntegerField(verbose_name="Quantidade")
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Custo Unitário")
+
+    @property
+    def subtotal(self):
+        return self.quantity * self.unit_cost
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product.name}"
@@ -0,0 +1,235 @@
+import csv
+import io
+import os
+from django import forms
+from django.db import transaction
+from .models import Category, Product, StockMovement, Supplier
+from core.versions import invalidate
+from .stock import move_stock
+
+IMPORT_BATCH_SIZE = 1000
+
+# Columns written from the file on every upserted product; stock goes through the ledger
+UPSERT_FIELDS = ['name', 'price', 'cost_price', 'min_stock', 'unit', 'category', 'supplier']
+
+
+class DecimalCommaField(forms.DecimalField):
+    """DecimalField that also accepts spreadsheet values written with a decimal comma ("10,50", "1.234,56")."""
+
+    def to_python(self, value):
+        if isinstance(value, str) and ',' in value:
+            value = value.replace('.', '').replace(',', '.')
+        return super().to_python(value)
+
+
+class ProductImportRowForm(forms.Form):
+    """Fields of one row of a product file. Cleaning them runs no queries: SKUs and names are resolved per batch."""
+    sku = forms.CharField(max_length=50)
+    name = forms.CharField(max_length=255)
+    price = DecimalCommaField(max_digits=10, decimal_places=2, min_value=0)
+    cost_price = DecimalCommaField(max_digits=10, decimal_places=2, min_value=0, required=False)
+    stock = forms.IntegerField(min_value=0, required=False)
+    min_stock = forms.IntegerField(required=False)
+    unit = forms.ChoiceField(choices=Product.UNIT_CHOICES, required=False)
+    category = forms.CharField(max_length=255, required=False)
+    supplier = forms.CharField(max_length=255, required=False)
+
+
+def _header_aliases():
+    """Map the accepted column titles (field names and their Portuguese labels) to field names."""
+    aliases = {}
+    for name in ProductImportRowForm.base_fields:
+        aliases[name] = name
+        aliases[str(Product._meta.get_field(name).verbose_name).lower()] = name
+    return aliases
+
+
+def _normalize(header):
+    aliases = _header_aliases()
+    return [aliases.get(str(title or '').strip().lower(), '') for title in header]
+
+
+def _csv_rows(file):
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    sample = text.read(4096)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(text, dialect)
+    yield from reader
+    # Leave the caller's file open
+    text.detach()
+
+
+def _xlsx_rows(file):
+    # openpyxl is only needed for spreadsheets; read_only mode streams the sheet
+    try:
+        import openpyxl
+    except ImportError:
+        raise ValueError('Instale o pacote openpyxl para importar planilhas .xlsx.')
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield ['' if value is None else value for value in row]
+    finally:
+        workbook.close()
+
+
+def read_product_file(file, filename):
+    """
+    Yield (line number, {field: value}) for each data row of a CSV or XLSX file.
+
+    The file is read as a stream. Columns are matched by field name or label
+    ("sku", "Nome", "Preço"...) and unknown columns are ignored.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.xlsx':
+        rows = _xlsx_rows(file)
+    elif extension in ('.csv', '.txt'):
+        rows = _csv_rows(file)
+    else:
+        raise ValueError('Formato não suportado: envie um arquivo .csv ou .xlsx.')
+
+    header = None
+    for line, row in enumerate(rows, start=1):
+        if header is None:
+            header = _normalize(row)
+            if 'sku' not in header:
+                raise ValueError('A primeira linha deve conter os nomes das colunas, incluindo "sku".')
+            continue
+        if not any(str(value).strip() for value in row):
+            continue
+        yield line, {field: value for field, value in zip(header, row) if field}
+
+
+def _pick(value, current, field, default):
+    if value not in (None, ''):
+        return value
+    return getattr(current, field) if current else default
+
+
+class ProductImport:
+    """
+    Create or update products from parsed rows, upserting by SKU.
+
+    Rows are validated and written in batches of batch_size, each in its own
+    transaction: one query loads the batch's existing products, a single
+    bulk_create(update_conflicts=True) inserts or updates them all and the
+    stock column becomes one ADJUSTMENT per product in the stock ledger.
+    Categories and suppliers are resolved by name through maps loaded once;
+    missing ones are created and committed before the batch that needs them,
+    so a batch that rolls back never leaves the maps pointing at rows that
+    are gone. Only the current batch is held in memory.
+
+    Invalid rows are skipped and collected in `errors` as (line, sku,
+    message); `created` and `updated` count the written products.
+    """
+
+    def __init__(self, rows, batch_size=IMPORT_BATCH_SIZE, note='Importação de produtos'):
+        self.rows = rows
+        self.batch_size = batch_size
+        self.note = note
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+        self._categories = None
+        self._suppliers = None
+
+    def run(self):
+        self._categories = {name.lower(): pk for pk, name in Category.objects.values_list('pk', 'name')}
+        self._suppliers = {name.lower(): pk for pk, name in Supplier.objects.values_list('pk', 'name')}
+        batch = []
+        for line, row in self.rows:
+            batch.append((line, row))
+            if len(batch) >= self.batch_size:
+                self._import_batch(batch)
+                batch = []
+        if batch:
+            self._import_batch(batch)
+        return self
+
+    def _create_missing(self, model, names, wanted):
+        # Committed on their own, before the batch's transaction
+        missing = {}
+        for name in wanted:
+            if name and name.lower() not in names:
+                missing.setdefault(name.lower(), name)
+        if missing:
+            with transaction.atomic():
+                for key, name in missing.items():
+                    names[key] = model.objects.create(name=name).pk
+
+    def _resolve(self, names, name):
+        return names[name.lower()] if name else None
+
+    def _validate(self, batch):
+        # The row form's fields are used directly: building a Form per row
+        # deep-copies every field and dominates the import time.
+        fields = ProductImportRowForm.base_fields
+        valid = {}
+        for line, row in batch:
+            data, errors = {}, []
+            for name, field in fields.items():
+                try:
+                    data[name] = field.clean(str(row.get(name, '')).strip())
+                except forms.ValidationError as e:
+                    errors.append(f'{name}: {" ".join(e.messages)}')
+            if errors:
+                self.errors.extend((line, row.get('sku', ''), message) for message in errors)
+                continue
+            if data['sku'] in valid:
+                self.errors.append((valid[data['sku']][0], data['sku'], f'SKU repetido na linha {line}; esta linha foi ignorada.'))
+            valid[data['sku']] = (line, data)
+        return valid
+
+    def _import_batch(self, batch):
+        valid = self._validate(batch)
+        if not valid:
+            return
+        self._create_missing(Category, self._categories, [data['category'] for _, data in valid.values()])
+        self._create_missing(Supplier, self._suppliers, [data['supplier'] for _, data in valid.values()])
+
+        with transaction.atomic():
+            existing = {
+                product.sku: product
+                for product in Product.objects.with_on_hand().select_for_update(of=('self',)).filter(sku__in=valid)
+            }
+            products = []
+            for sku, (_, data) in valid.items():
+                current = existing.get(sku)
+                # Columns left blank keep the product's current value (or the model default)
+                products.append(Product(
+                    sku=sku,
+                    name=data['name'],
+                    price=data['price'],
+                    cost_price=_pick(data['cost_price'], current, 'cost_price', 0),
+                    min_stock=_pick(data['min_stock'], current, 'min_stock', 5),
+                    unit=_pick(data['unit'], current, 'unit', 'UN'),
+                    category_id=_pick(self._resolve(self._categories, data['category']), current, 'category_id', None),
+                    supplier_id=_pick(self._resolve(self._suppliers, data['supplier']), current, 'supplier_id', None),
+                    stock=0 if current or data['stock'] is None else data['stock'],
+                ))
+            Product.objects.bulk_create(
+                products, update_conflicts=True, unique_fields=['sku'], update_fields=UPSERT_FIELDS,
+            )
+            # bulk_create sends no post_save
+            invalidate(Product)
+
+            # New products are inserted with their stock, so they only need
+            # the ledger entry; existing ones go through move_stock.
+            new_skus = [sku for sku in valid if sku not in existing]
+            opening = {sku: valid[sku][1]['stock'] for sku in new_skus if valid[sku][1]['stock']}
+            if opening:
+                StockMovement.objects.bulk_create([
+                    StockMovement(product_id=pk, kind='ADJUSTMENT', quantity=opening[sku], balance=opening[sku], note=self.note)
+                    for sku, pk in Product.objects.filter(sku__in=opening).values_list('sku', 'pk')
+                ])
+            move_stock([
+                (product.pk, valid[sku][1]['stock'] - product.on_hand, None)
+                for sku, product in existing.items() if valid[sku][1]['stock'] is not None
+            ], 'ADJUSTMENT', note=self.note)
+
+        self.created += len(new_skus)
+        self.updated += len(existing)
@@ -0,0 +1,123 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import DecimalField, F, Sum
+from django.utils import timezone
+from finance.models import Transaction
+from .models import Product, PurchaseOrder, PurchaseOrderLine
+from .product_import import DecimalCommaField
+from .stock import move_stock
+
+# Parses the unit cost column the way the product import parses prices
+_unit_cost = DecimalCommaField(max_digits=10, decimal_places=2, required=False)
+
+
+def parse_order_lines(text):
+    """
+    Parse pasted "SKU;quantidade;custo unitário" lines into (sku, quantity, unit_cost).
+
+    Commas and tabs are accepted as separators too (what spreadsheets copy)
+    and the unit cost may be written "1.234,56" when ";" or tabs separate
+    the columns. An empty cost means the product's current cost price. Raises
+    ValidationError listing every malformed line.
+    """
+    parsed, errors = [], []
+    for number, raw in enumerate(text.splitlines(), start=1):
+        raw = raw.strip()
+        if not raw:
+            continue
+        separator = ';' if ';' in raw else '\t' if '\t' in raw else ','
+        columns = [column.strip() for column in raw.split(separator)]
+        if len(columns) not in (2, 3) or not columns[0]:
+            errors.append(f'Linha {number}: use "SKU;quantidade;custo".')
+            continue
+        try:
+            quantity = int(columns[1])
+            unit_cost = _unit_cost.clean(columns[2] if len(columns) == 3 else '')
+        except (ValueError, ValidationError):
+            errors.append(f'Linha {number}: quantidade ou custo inválido.')
+            continue
+        if quantity < 1 or (unit_cost is not None and unit_cost < 0):
+            errors.append(f'Linha {number}: a quantidade deve ser maior que zero e o custo não pode ser negativo.')
+            continue
+        parsed.append((columns[0], quantity, unit_cost))
+    if errors:
+        raise ValidationError(errors)
+    return parsed
+
+
+def add_order_lines(order, lines):
+    """
+    Add (sku, quantity, unit_cost) lines to a pending purchase order.
+
+    The SKUs are resolved with one query, the lines are inserted with a
+    single bulk_create and the order total is updated once. Raises
+    ValidationError, writing nothing, when an SKU is unknown.
+    """
+    if not lines:
+        raise ValidationError('Informe ao menos uma linha.')
+    products = {
+        product.sku: product
+        for product in Product.objects.filter(sku__in={sku for sku, _, _ in lines}).only('pk', 'sku', 'cost_price')
+    }
+    missing = sorted({sku for sku, _, _ in lines if sku not in products})
+    if missing:
+        raise ValidationError([f'Produto com SKU {sku} não encontrado.' for sku in missing])
+
+    new_lines = [
+        PurchaseOrderLine(
+            order=order, product=products[sku], quantity=quantity,
+            unit_cost=products[sku].cost_price if unit_cost is None else unit_cost,
+        )
+        for sku, quantity, unit_cost in lines
+    ]
+    with transaction.atomic():
+        if PurchaseOrder.objects.select_for_update().get(pk=order.pk).status != 'PENDING':
+            raise ValidationError('Não é possível alterar um pedido já recebido ou cancelado.')
+        PurchaseOrderLine.objects.bulk_create(new_lines)
+        PurchaseOrder.objects.filter(pk=order.pk).update(total=F('total') + sum(line.subtotal for line in new_lines))
+    order.refresh_from_db(fields=['total'])
+    return new_lines
+
+
+def receive_purchase_order(order):
+    """
+    Put every line of a purchase order into stock and register the expense.
+
+    The quantities are summed per product in the database and applied by
+    move_stock as RECEIPT movements (one UPDATE for the whole delivery, one
+    insert for the ledger), then a pending EXPENSE transaction for the
+    order total is created and the order is marked as received. Raises
+    ValueError when the order is not pending or has no lines.
+    """
+    with transaction.atomic():
+        order = PurchaseOrder.objects.select_for_update(of=('self',)).select_related('supplier').get(pk=order.pk)
+        if order.status != 'PENDING':
+            raise ValueError('Este pedido já foi recebido ou cancelado.')
+
+        rows = list(order.lines.values('product').annotate(
+            units=Sum('quantity'),
+            cost=Sum(F('quantity') * F('unit_cost'), output_field=DecimalField(max_digits=12, decimal_places=2)),
+        ).order_by('product'))
+        if not rows:
+            raise ValueError('O pedido não tem itens.')
+        move_stock(
+            [(row['product'], row['units'], None) for row in rows],
+            'RECEIPT', note=f'Pedido de compra #{order.pk}',
+        )
+
+        now = timezone.now()
+        total = sum(row['cost'] for row in rows)
+        Transaction.objects.create(
+            description=f'Pedido de Compra #{order.pk} - {order.supplier.name}',
+            amount=total,
+            type='EXPENSE',
+            status='PENDING',
+            due_date=now.date(),
+            purchase_order=order,
+        )
+
+        order.status = 'RECEIVED'
+        order.received_at = now
+        order.total = total
+        order.save(update_fields=['status', 'received_at', 'total'])
+    return order
@@ -0,0 +1,104 @@
+import datetime
+import math
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from sales.models import SaleItem
+from .models import Product
+
+REORDER_WINDOW_DAYS = 28
+REORDER_LEAD_TIME_DAYS = 7
+REORDER_COVER_DAYS = 14
+
+
+def _daily_quantities(start, end):
+    """(product_id, day, quantity) of the completed sales between start and end, in one grouped query."""
+    return (
+        SaleItem.objects.filter(
+            sale__status='COMPLETED', sale__created_at__gte=start, sale__created_at__lt=end, product__isnull=False,
+        )
+        .annotate(day=TruncDate('sale__created_at'))
+        .values_list('product_id', 'day')
+        .annotate(quantity=Sum('quantity'))
+        .order_by()
+    )
+
+
+def reorder_plan(window_days=REORDER_WINDOW_DAYS, lead_time_days=REORDER_LEAD_TIME_DAYS,
+                 cover_days=REORDER_COVER_DAYS, today=None):
+    """
+    Suggest purchase quantities for the whole catalog, ordered by supplier.
+
+    The completed sales of the last window_days are loaded as a products x
+    days matrix and every product's velocity is a moving average weighted
+    towards the most recent days. A product is suggested when its stock
+    will not last the supplier lead time or is already at min_stock; the
+    quantity brings it to cover_days after the lead time plus min_stock as
+    safety stock. All the arithmetic runs on NumPy arrays over the whole
+    catalog, only the suggested lines become Python dicts.
+
+    Each line has product_id, sku, name, supplier_id, supplier (its name,
+    '' without one), stock, min_stock, velocity (units/day), days_of_cover
+    (None when nothing sells), quantity and cost.
+    """
+    # Only needed here, so the rest of the app does not depend on it
+    import numpy as np
+
+    today = today or timezone.localdate()
+    end = timezone.make_aware(datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time.min))
+    start = end - datetime.timedelta(days=window_days)
+
+    catalog = list(
+        Product.objects.with_on_hand().order_by('pk').values_list(
+            'pk', 'sku', 'name', 'supplier_id', 'supplier__name', 'on_hand', 'min_stock', 'cost_price',
+        ).iterator(chunk_size=5000)
+    )
+    if not catalog:
+        return []
+    ids = np.fromiter((row[0] for row in catalog), dtype=np.int64, count=len(catalog))
+    stock = np.fromiter((row[5] for row in catalog), dtype=np.float64, count=len(catalog))
+    min_stock = np.fromiter((row[6] for row in catalog), dtype=np.float64, count=len(catalog))
+
+    sold = list(_daily_quantities(start, end))
+    daily = np.zeros((len(catalog), window_days))
+    if sold:
+        product_ids = np.array([product_id for product_id, _, _ in sold], dtype=np.int64)
+        days = np.array([(day - start.date()).days for _, day, _ in sold])
+        quantities = np.array([quantity for _, _, quantity in sold], dtype=np.float64)
+        # ids is sorted, so searchsorted maps product ids to matrix rows
+        rows = np.searchsorted(ids, product_ids)
+        known = (rows < len(ids)) & (ids[np.minimum(rows, len(ids) - 1)] == product_ids) & (days >= 0) & (days < window_days)
+        np.add.at(daily, (rows[known], days[known]), quantities[known])
+
+    # Linearly weighted moving average: today, the last column, counts window_days times as much as the first day
+    weights = np.arange(1, window_days + 1, dtype=np.float64)
+    velocity = daily @ weights / weights.sum()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cover = np.where(velocity > 0, np.maximum(stock, 0) / velocity, np.inf)
+
+    target = velocity * (lead_time_days + cover_days) + min_stock
+    quantity = np.ceil(np.maximum(target - stock, 0))
+    suggested = np.flatnonzero(((cover <= lead_time_days) | (stock <= min_stock)) & (quantity > 0))
+
+    lines = []
+    for index in suggested.tolist():
+        product_id, sku, name, supplier_id, supplier, on_hand, minimum, cost_price = catalog[index]
+        units = int(quantity[index])
+        lines.append({
+            'product_id': product_id,
+            'sku': sku,
+            'name': name,
+            'supplier_id': supplier_id,
+            'supplier': supplier or '',
+            'stock': on_hand,
+            'min_stock': minimum,
+            'velocity': round(float(velocity[index]), 2),
+            'days_of_cover': None if math.isinf(cover[index]) else round(float(cover[index]), 1),
+            'quantity': units,
+            'cost': cost_price * units,
+        })
+    # By supplier name, products without a supplier last, keeping each
+    # supplier's lines together, then the most urgent products first
+    lines.sort(key=lambda line: (line['supplier_id'] is None, line['supplier'].lower(), line['supplier_id'] or 0,
+                                 math.inf if line['days_of_cover'] is None else line['days_of_cover'], line['name']))
+    return lines
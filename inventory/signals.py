@@ -0,0 +1,7 @@
+from core.versions import track_writes
+from .catalog import CATALOG_DEPENDENTS, CATALOG_MODELS
+from .models import Product
+
+for model in CATALOG_MODELS:
+    track_writes(model, *CATALOG_DEPENDENTS.get(model, ()))
+track_writes(Product)
@@ -0,0 +1,309 @@
+import datetime
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from core.versions import invalidate
+from .models import Product, StockMovement, StockStripe
+
+
+class InsufficientStockError(ValueError):
+    """Raised when one or more products do not have enough stock."""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        details = ', '.join(
+            f'{product.name} (disponível: {product.stock}, solicitado: {quantity})'
+            for product, quantity in shortages
+        )
+        super().__init__(f'Estoque insuficiente para: {details}')
+
+
+def _per_product(values):
+    return Case(
+        *[When(pk=pk, then=Value(value)) for pk, value in values.items()],
+        output_field=IntegerField(),
+    )
+
+
+def _shortages(products, deltas):
+    return [
+        (product, -deltas[product.pk])
+        for product in products
+        if deltas[product.pk] < 0 and product.stock + deltas[product.pk] < 0
+    ]
+
+
+def _take_from_stripe(product_id, delta):
+    """
+    Apply delta to a single random stripe of a striped product.
+
+    A stripe no other checkout holds is preferred so concurrent sales of the
+    same product proceed in parallel; when every stripe is busy it queues on
+    a random one that can cover the delta. Returns False when no single
+    stripe can take it.
+    """
+    stripes = StockStripe.objects.filter(product_id=product_id)
+    if delta < 0:
+        stripes = stripes.filter(quantity__gte=-delta)
+    stripe = (
+        stripes.select_for_update(skip_locked=True).order_by('?').only('pk').first()
+        or stripes.select_for_update().order_by('?').only('pk').first()
+    )
+    if stripe is None:
+        return False
+    StockStripe.objects.filter(pk=stripe.pk).update(quantity=F('quantity') + delta)
+    return True
+
+
+def _lock_stripes(product_id):
+    """Lock a product and all its stripes; returns (product, stripes, total stock)."""
+    # FOR NO KEY UPDATE: a stripe checkout holding a stripe still takes a
+    # KEY SHARE lock on the product when its movement's foreign key is
+    # checked at commit, which FOR UPDATE would turn into a deadlock.
+    product = Product.objects.select_for_update(no_key=True).get(pk=product_id)
+    stripes = list(StockStripe.objects.select_for_update().filter(product=product).order_by('slot'))
+    total = sum(stripe.quantity for stripe in stripes) if stripes else product.stock
+    return product, stripes, total
+
+
+def _spread(product, stripes, total):
+    """
+    Split total evenly over the product's stock_stripes stripes and store it
+    in Product.stock. With no stripes configured any leftover stripes are
+    folded back into the row. The product and stripes must be locked.
+    """
+    count = product.stock_stripes
+    existing = {stripe.slot: stripe for stripe in stripes}
+    if any(slot >= count for slot in existing):
+        StockStripe.objects.filter(product=product, slot__gte=count).delete()
+    share, extra = divmod(total, count) if count else (0, 0)
+    changed, created = [], []
+    for slot in range(count):
+        quantity = share + (1 if slot < extra else 0)
+        if slot not in existing:
+            created.append(StockStripe(product=product, slot=slot, quantity=quantity))
+        elif existing[slot].quantity != quantity:
+            existing[slot].quantity = quantity
+            changed.append(existing[slot])
+    StockStripe.objects.bulk_create(created)
+    StockStripe.objects.bulk_update(changed, ['quantity'])
+    if product.stock != total:
+        Product.objects.filter(pk=product.pk).update(stock=total)
+        product.stock = total
+
+
+def move_stock(lines, kind, note=''):
+    """
+    Apply (product_id, quantity, sale_id) lines to stock and record them in the ledger.
+
+    quantity is signed: negative for stock leaving. The product rows are
+    locked in primary key order, so concurrent writers touching the same
+    products queue up instead of deadlocking, then stock is updated with a
+    single UPDATE and the movements are inserted with a single bulk_create,
+    each one carrying the running balance.
+
+    Striped products (stock_stripes > 0) are not locked: their delta is
+    taken from one free stripe and the movement is recorded without a
+    balance. Only when no single stripe can cover it are the product and
+    all its stripes locked, the stock re-spread and the balance recorded.
+
+    A call that only touched stripes does not bump the Product data
+    version either (core.versions): every bump updates the one DataVersion
+    row of the model on commit, so concurrent checkouts would queue on it
+    again. Caches keyed on that version (dashboard KPIs) pick stripe
+    movements up at the next consolidation or when they expire.
+
+    Raises InsufficientStockError, listing every short product, if stock
+    would go negative. Must run inside a transaction, which the error is
+    expected to roll back. Returns the created movements.
+    """
+    lines = [(product_id, quantity, sale_id) for product_id, quantity, sale_id in lines if quantity]
+    if not lines:
+        return []
+
+    deltas = defaultdict(int)
+    for product_id, quantity, _ in lines:
+        deltas[product_id] += quantity
+
+    products = {
+        product.pk: product
+        for product in Product.objects.select_for_update().filter(pk__in=deltas, stock_stripes=0).order_by('pk')
+    }
+    plain = {pk: delta for pk, delta in deltas.items() if pk in products}
+    shortages = _shortages(products.values(), plain)
+    # Running balance per product; None for movements taken from a stripe
+    balances = {pk: product.stock for pk, product in products.items()}
+
+    for product_id in sorted(set(deltas) - set(plain)):
+        delta = deltas[product_id]
+        if _take_from_stripe(product_id, delta):
+            balances[product_id] = None
+            continue
+        product, stripes, total = _lock_stripes(product_id)
+        products[product_id] = product
+        balances[product_id] = total
+        if total + delta < 0:
+            product.stock = total
+            shortages.append((product, -delta))
+        else:
+            _spread(product, stripes, total + delta)
+    if shortages:
+        raise InsufficientStockError(shortages)
+
+    if plain:
+        # The guard keeps outgoing stock from ever going negative, even if a
+        # writer bypassed the row locks above (or the database ignores them).
+        outgoing = {pk: -delta for pk, delta in plain.items() if delta < 0}
+        guard = Q(pk__in=[pk for pk in plain if pk not in outgoing])
+        if outgoing:
+            guard |= Q(pk__in=outgoing, stock__gte=_per_product(outgoing))
+        updated = Product.objects.filter(guard).update(stock=F('stock') + _per_product(plain))
+        if updated != len(plain):
+            raise InsufficientStockError(_shortages(Product.objects.filter(pk__in=plain).order_by('pk'), plain))
+
+    now = timezone.now()
+    movements = []
+    if any(balance is not None for balance in balances.values()):
+        invalidate(Product)
+    for product_id, quantity, sale_id in lines:
+        if balances[product_id] is not None:
+            balances[product_id] += quantity
+        movements.append(StockMovement(
+            product_id=product_id, kind=kind, quantity=quantity, balance=balances[product_id],
+            sale_id=sale_id, note=note, created_at=now,
+        ))
+    return StockMovement.objects.bulk_create(movements)
+
+
+def set_stock(product, stock, note=''):
+    """Record an ADJUSTMENT bringing a product to an absolute stock (e.g. after a count). Must run inside a transaction."""
+    locked, stripes, current = _lock_stripes(product.pk)
+    if locked.stock_stripes or stripes:
+        # Spread the counted stock right away so the movement carries a balance
+        _spread(locked, stripes, stock)
+        invalidate(Product)
+        movements = StockMovement.objects.bulk_create([StockMovement(
+            product=locked, kind='ADJUSTMENT', quantity=stock - current, balance=stock, note=note,
+        )]) if stock != current else []
+    else:
+        movements = move_stock([(product.pk, stock - current, None)], 'ADJUSTMENT', note=note)
+    product.stock = stock
+    return movements
+
+
+def consolidate_stripes(products=None):
+    """
+    Fold the stripes of striped products back into Product.stock.
+
+    Each product is locked with its stripes in its own short transaction,
+    its stock is spread evenly over stock_stripes stripes again (creating
+    or dropping stripes when that number changed, folding them all when it
+    is 0) and, when movements were taken from stripes since the last one,
+    a zero-quantity ADJUSTMENT records the balance again. The Product data
+    version is bumped once, for the stripe movements move_stock left out.
+    Returns the number of products consolidated.
+    """
+    products = Product.objects.all() if products is None else products
+    product_ids = products.filter(
+        Q(stock_stripes__gt=0) | Q(stripes__isnull=False)
+    ).order_by('pk').values_list('pk', flat=True).distinct()
+    count = 0
+    for product_id in product_ids:
+        with transaction.atomic():
+            product, stripes, total = _lock_stripes(product_id)
+            _spread(product, stripes, total)
+            last = StockMovement.objects.filter(product=product).order_by('-created_at', '-id').only('balance').first()
+            if last is not None and last.balance != total:
+                StockMovement.objects.create(
+                    product=product, kind='ADJUSTMENT', quantity=0, balance=total, note='Consolidação de faixas',
+                )
+        count += 1
+    if count:
+        invalidate(Product)
+    return count
+
+
+# Stands in for "no checkpoint yet" so every stripe movement is counted
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def stock_at(when, products=None):
+    """
+    Annotate products with `stock_at`, their stock at the given datetime.
+
+    Each product costs one seek on the (product, created_at, id) index for
+    the last movement with a balance before `when`; the history is never
+    replayed. The stripe movements of striped products, recorded without a
+    balance, made after that one are added to it.
+    """
+    before = StockMovement.objects.filter(product=OuterRef('pk'), created_at__lte=when)
+    checkpoint = before.filter(balance__isnull=False).order_by('-created_at', '-id')
+    products = Product.objects.all() if products is None else products
+    products = products.annotate(
+        checkpoint_balance=Subquery(checkpoint.values('balance')[:1]),
+        checkpoint_at=Subquery(checkpoint.values('created_at')[:1]),
+        checkpoint_id=Subquery(checkpoint.values('id')[:1]),
+    )
+    since = before.filter(balance__isnull=True).filter(
+        Q(created_at__gt=Coalesce(OuterRef('checkpoint_at'), Value(_EPOCH)))
+        | Q(created_at=OuterRef('checkpoint_at'), id__gt=OuterRef('checkpoint_id'))
+    ).values('product').annotate(total=Sum('quantity')).values('total')
+    return products.annotate(
+        stock_at=Coalesce(F('checkpoint_balance'), Value(0)) + Coalesce(Subquery(since), Value(0))
+    )
+
+
+def rebuild_stock(fix=False, chunk_size=5000):
+    """
+    Recompute every running balance and the stock of every product from the ledger.
+
+    Streams the movements in (product, created_at, id) order, so memory use
+    does not grow with the size of the ledger. Returns a list of
+    (product_id, stored stock, ledger stock) for products that drifted.
+    With fix=True the drifted balances and stock are written back; stripe
+    movements keep their empty balance.
+    """
+    drifted = []
+    stock = {}
+    balance_fixes = []
+    movements = StockMovement.objects.order_by('product_id', 'created_at', 'id').values_list(
+        'pk', 'product_id', 'quantity', 'balance'
+    ).iterator(chunk_size=chunk_size)
+    for pk, product_id, quantity, balance in movements:
+        stock[product_id] = stock.get(product_id, 0) + quantity
+        if fix and balance is not None and balance != stock[product_id]:
+            balance_fixes.append(StockMovement(pk=pk, balance=stock[product_id]))
+            if len(balance_fixes) >= chunk_size:
+                StockMovement.objects.bulk_update(balance_fixes, ['balance'])
+                balance_fixes = []
+    if balance_fixes:
+        StockMovement.objects.bulk_update(balance_fixes, ['balance'])
+
+    striped = set()
+    products = Product.objects.with_on_hand().order_by('pk').values_list('pk', 'stock_stripes', 'on_hand')
+    for product_id, stripes, stored in products.iterator(chunk_size=chunk_size):
+        expected = stock.get(product_id, 0)
+        if stored != expected:
+            drifted.append((product_id, stored, expected))
+            if stripes:
+                striped.add(product_id)
+
+    if fix:
+        plain = [row for row in drifted if row[0] not in striped]
+        for start in range(0, len(plain), chunk_size):
+            batch = plain[start:start + chunk_size]
+            # Apply the difference rather than the value so a sale finalized
+            # meanwhile is not overwritten
+            Product.objects.filter(pk__in=[pk for pk, _, _ in batch]).update(
+                stock=F('stock') + _per_product({pk: expected - stored for pk, stored, expected in batch})
+            )
+        for product_id, stored, expected in drifted:
+            if product_id in striped:
+                with transaction.atomic():
+                    product, stripes, total = _lock_stripes(product_id)
+                    _spread(product, stripes, total + expected - stored)
+        if drifted:
+            invalidate(Product)
+    return drifted
@@ -1,7 +1,36 @@
-from django.test import TestCase
-from inventory.models import Supplier, Product
+import datetime
+import importlib.util
+import io
+import os
+import tempfile
+import unittest
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from django.test import TestCase, Client
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.core.files.uploadedfile import SimpleUploadedFile
+from inventory.catalog import catalog_cache_stats, catalog_objects, reset_catalog_cache_stats
+from core.versions import forget_data_versions
+from inventory.forms import ProductForm, ServiceForm
+from inventory.models import Category, Supplier, Product, PurchaseOrder, Service, StockMovement
+from inventory.product_import import ProductImport, read_product_file
+from inventory.purchasing import add_order_lines, parse_order_lines, receive_purchase_order
+from inventory.reorder import reorder_plan
+from inventory.stock import InsufficientStockError, consolidate_stripes, move_stock, rebuild_stock, set_stock, stock_at
+from sales.models import Customer, Sale, SaleItem
+from finance.models import Transaction
+from sales.services import cancel_sales, finalize_sale
 from django.core.exceptions import ValidationError
 
+User = get_user_model()
+
 class SupplierModelTest(TestCase):
     def setUp(self):
         self.supplier = Supplier.objects.create(
@@ -51,3 +80,461 @@ class ProductModelTest(TestCase):
         )
         self.assertEqual(product_minimal.stock, 0)
         self.assertEqual(product_minimal.unit, 'UN')
+
+class ProductRowSwapTests(TestCase):
+    """HTMX create/update/delete respond with the affected row only."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='rows@example.com', password='password', role='ADMIN')
+        self.client = Client()
+        self.client.force_login(self.user)
+        Product.objects.bulk_create([Product(name=f'Row Product {i}', sku=f'ROW-{i}', price=1) for i in range(20)])
+        self.product = Product.objects.get(sku='ROW-0')
+
+    def post(self, url, data):
+        return self.client.post(url, data, HTTP_HX_REQUEST='true')
+
+    def product_data(self, **overrides):
+        data = {'name': 'Row Product', 'sku': 'ROW-NEW', 'price': '5.00', 'cost_price': '2.00',
+                'stock': 3, 'min_stock': 1, 'unit': 'UN'}
+        data.update(overrides)
+        return data
+
+    def test_create_appends_one_row(self):
+        response = self.post(reverse('item_create'), self.product_data())
+        product = Product.objects.get(sku='ROW-NEW')
+        self.assertContains(response, 'hx-swap-oob="beforeend:#item-table-body"')
+        self.assertContains(response, f'id="product-{product.pk}"')
+        self.assertNotContains(response, 'Row Product 1')
+        self.assertEqual(response['HX-Trigger'], 'close-modal')
+
+    def test_update_replaces_its_row(self):
+        response = self.post(reverse('item_update', args=[self.product.pk]), self.product_data(sku='ROW-0', name='Renamed'))
+        self.assertContains(response, f'<tr id="product-{self.product.pk}" hx-swap-oob="true"')
+        self.assertContains(response, 'Renamed')
+        self.assertNotContains(response, 'Row Product 1')
+
+    def test_delete_removes_its_row(self):
+        response = self.client.delete(reverse('item_delete', args=[self.product.pk]), HTTP_HX_REQUEST='true')
+        self.assertContains(response, f'<tr id="product-{self.product.pk}" hx-swap-oob="delete"></tr>')
+        self.assertContains(response, 'Produto excluído com sucesso.')
+        self.assertFalse(Product.objects.filter(pk=self.product.pk).exists())
+
+    def test_invalid_form_is_rendered_back_into_the_modal(self):
+        response = self.post(reverse('item_create'), self.product_data(sku='ROW-1'))
+        self.assertContains(response, '<form hx-post')
+        self.assertFalse(response.has_header('HX-Trigger'))
+
+class StockLedgerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='ledger@example.com', password='password', role='ADMIN')
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.product = Product.objects.create(name='Ledger Product', sku='LEDGER-1', price=10)
+        with transaction.atomic():
+            set_stock(self.product, 10, note='Contagem')
+
+    def finalized_sale(self, quantity):
+        customer = Customer.objects.create(name='Ledger Customer')
+        sale = Sale.objects.create(customer=customer, seller=self.user, total=10 * quantity)
+        SaleItem.objects.create(sale=sale, product=self.product, quantity=quantity, price=10)
+        with mock.patch('sales.services.enqueue'):
+            finalize_sale(sale)
+        return sale
+
+    def test_every_change_is_recorded_with_its_running_balance(self):
+        sale = self.finalized_sale(3)
+        cancel_sales([sale.pk])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+        self.assertEqual(
+            list(self.product.movements.order_by('id').values_list('kind', 'quantity', 'balance', 'sale')),
+            [('ADJUSTMENT', 10, 10, None), ('SALE', -3, 7, sale.pk), ('RETURN', 3, 10, sale.pk)],
+        )
+
+    def test_stock_at_reads_the_balance_at_a_point_in_time(self):
+        before = timezone.now()
+        self.product.movements.update(created_at=before - datetime.timedelta(days=2))
+        self.finalized_sale(4)
+        yesterday = before - datetime.timedelta(days=1)
+        self.assertEqual(stock_at(yesterday).get(pk=self.product.pk).stock_at, 10)
+        self.assertEqual(stock_at(timezone.now()).get(pk=self.product.pk).stock_at, 6)
+        self.assertEqual(stock_at(before - datetime.timedelta(days=3)).get(pk=self.product.pk).stock_at, 0)
+
+    def test_product_form_records_an_adjustment(self):
+        data = {'name': 'Ledger Product', 'sku': 'LEDGER-1', 'price': '10.00', 'cost_price': '5.00',
+                'stock': 25, 'min_stock': 1, 'unit': 'UN'}
+        self.client.post(reverse('item_update', args=[self.product.pk]), data)
+        movement = self.product.movements.latest('id')
+        self.assertEqual((movement.kind, movement.quantity, movement.balance), ('ADJUSTMENT', 15, 25))
+
+        # Saving without touching the stock records nothing
+        self.client.post(reverse('item_update', args=[self.product.pk]), dict(data, name='Renamed'))
+        self.assertEqual(self.product.movements.count(), 2)
+
+    def test_rebuild_fixes_drift(self):
+        Product.objects.filter(pk=self.product.pk).update(stock=99)
+        out = StringIO()
+        call_command('rebuild_stock', stdout=out)
+        self.assertIn(f'Product #{self.product.pk}: stored 99, ledger 10', out.getvalue())
+
+        call_command('rebuild_stock', '--fix', stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+        self.assertEqual(rebuild_stock(), [])
+
+class StripedStockTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Hot Product', sku='HOT-1', price=10, stock_stripes=3)
+        with transaction.atomic():
+            set_stock(self.product, 30, note='Contagem')
+
+    def on_hand(self):
+        return Product.objects.with_on_hand().get(pk=self.product.pk).on_hand
+
+    def sell(self, quantity):
+        with transaction.atomic():
+            return move_stock([(self.product.pk, -quantity, None)], 'SALE')
+
+    def test_stock_is_spread_over_the_stripes(self):
+        self.assertEqual(sorted(self.product.stripes.values_list('quantity', flat=True)), [10, 10, 10])
+        self.assertEqual(self.on_hand(), 30)
+
+    def test_sale_covered_by_one_stripe_skips_the_product_row(self):
+        movement, = self.sell(4)
+        self.assertIsNone(movement.balance)
+        self.assertEqual(sorted(self.product.stripes.values_list('quantity', flat=True)), [6, 10, 10])
+        self.assertEqual(self.on_hand(), 26)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.available_stock), (30, 26))
+
+    def test_only_stock_that_is_not_striped_bumps_the_product_version(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.sell(4)
+        self.assertEqual(callbacks, [])
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.sell(25)
+        self.assertEqual(len(callbacks), 1)
+        with self.captureOnCommitCallbacks() as callbacks:
+            consolidate_stripes()
+        self.assertEqual(len(callbacks), 1)
+
+    def test_sale_larger_than_any_stripe_respreads_the_stock(self):
+        movement, = self.sell(25)
+        self.assertEqual(movement.balance, 5)
+        self.assertEqual(sorted(self.product.stripes.values_list('quantity', flat=True)), [1, 2, 2])
+        with self.assertRaises(InsufficientStockError):
+            self.sell(6)
+        self.assertEqual(self.on_hand(), 5)
+
+    def test_consolidation_records_the_balance_and_keeps_the_ledger_consistent(self):
+        before = timezone.now()
+        self.product.movements.update(created_at=before - datetime.timedelta(days=1))
+        self.sell(3)
+        self.sell(2)
+        self.assertEqual(stock_at(timezone.now()).get(pk=self.product.pk).stock_at, 25)
+        self.assertEqual(rebuild_stock(), [])
+
+        self.assertEqual(consolidate_stripes(), 1)
+        movement = self.product.movements.latest('id')
+        self.assertEqual((movement.kind, movement.quantity, movement.balance), ('ADJUSTMENT', 0, 25))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 25)
+        self.assertEqual(stock_at(timezone.now()).get(pk=self.product.pk).stock_at, 25)
+        self.assertEqual(stock_at(before).get(pk=self.product.pk).stock_at, 30)
+
+    def test_turning_stripes_off_folds_them_into_the_product(self):
+        self.sell(4)
+        Product.objects.filter(pk=self.product.pk).update(stock_stripes=0)
+        call_command('consolidate_stock_stripes', stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 26)
+        self.assertFalse(self.product.stripes.exists())
+
+class ProductImportTests(TestCase):
+    CSV = (
+        'SKU;Nome;Preço;Estoque;Categoria;Fornecedor;Ignorada\n'
+        'IMP-1;Caneta;2.50;10;Papelaria;Acme;x\n'
+        'IMP-2;Lápis;1.00;;papelaria;;x\n'
+        'IMP-3;Sem preço;;5;;;x\n'
+        'OLD-1;Caderno Novo;12.00;4;;;x\n'
+        '\n'
+        'IMP-1;Caneta Azul;2.75;10;;;x\n'
+    )
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Papelaria')
+        self.old = Product.objects.create(name='Caderno', sku='OLD-1', price=10, cost_price=6)
+        with transaction.atomic():
+            set_stock(self.old, 9)
+
+    def run_import(self, content=CSV, batch_size=2):
+        return ProductImport(read_product_file(io.BytesIO(content.encode()), 'produtos.csv'), batch_size=batch_size).run()
+
+    def test_upserts_by_sku_and_reports_row_errors(self):
+        result = self.run_import()
+        # The second IMP-1 row falls in a later batch and updates the product
+        self.assertEqual((result.created, result.updated), (2, 2))
+        self.assertEqual([(line, sku) for line, sku, _ in result.errors], [(4, 'IMP-3')])
+
+        pen = Product.objects.get(sku='IMP-1')
+        self.assertEqual((pen.name, pen.price, pen.stock, pen.category, pen.supplier.name),
+                         ('Caneta Azul', Decimal('2.75'), 10, self.category, 'Acme'))
+        self.assertEqual(Product.objects.get(sku='IMP-2').stock, 0)
+
+        self.old.refresh_from_db()
+        self.assertEqual((self.old.name, self.old.price, self.old.cost_price, self.old.stock),
+                         ('Caderno Novo', Decimal('12.00'), Decimal('6.00'), 4))
+        movement = self.old.movements.latest('id')
+        self.assertEqual((movement.kind, movement.quantity, movement.balance), ('ADJUSTMENT', -5, 4))
+        self.assertEqual(rebuild_stock(), [])
+
+    def test_duplicate_sku_in_a_batch_keeps_the_last_row(self):
+        content = 'sku,name,price\nDUP-1,Primeira,1\nDUP-1,Segunda,2\n'
+        result = self.run_import(content, batch_size=10)
+        self.assertEqual(result.created, 1)
+        self.assertEqual(Product.objects.get(sku='DUP-1').name, 'Segunda')
+        self.assertEqual(result.errors[0][:2], (2, 'DUP-1'))
+
+    def test_accepts_decimal_commas(self):
+        content = 'SKU;Nome;Preço;Preço de Custo\nDEC-1;Régua;10,50;1.234,56\nDEC-2;Borracha;2.25;\n'
+        result = self.run_import(content)
+        self.assertEqual(result.errors, [])
+        ruler = Product.objects.get(sku='DEC-1')
+        self.assertEqual((ruler.price, ruler.cost_price), (Decimal('10.50'), Decimal('1234.56')))
+        self.assertEqual(Product.objects.get(sku='DEC-2').price, Decimal('2.25'))
+
+    def test_rolled_back_batch_keeps_its_new_categories_usable(self):
+        content = 'sku,name,price,category\nCAT-1,Caneta,1,Escritório\nCAT-2,Lápis,1,Escritório\n'
+        with mock.patch('inventory.product_import.move_stock', side_effect=[RuntimeError, None]):
+            importer = ProductImport(read_product_file(io.BytesIO(content.encode()), 'produtos.csv'), batch_size=1)
+            with self.assertRaises(RuntimeError):
+                importer.run()
+            # The same importer carries on with the next batch
+            importer._import_batch([(3, {'sku': 'CAT-2', 'name': 'Lápis', 'price': '1', 'category': 'Escritório'})])
+        self.assertFalse(Product.objects.filter(sku='CAT-1').exists())
+        self.assertEqual(Product.objects.get(sku='CAT-2').category.name, 'Escritório')
+
+    def test_rejects_files_without_a_sku_column(self):
+        with self.assertRaises(ValueError):
+            self.run_import('name,price\nCaneta,1\n')
+
+    def test_command_and_admin_upload(self):
+        path = os.path.join(tempfile.mkdtemp(), 'produtos.csv')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(self.CSV)
+        out, err = StringIO(), StringIO()
+        call_command('import_products', path, stdout=out, stderr=err)
+        self.assertIn('2 product(s) created, 1 updated', out.getvalue())
+        self.assertIn('Line 4 (IMP-3)', err.getvalue())
+        self.assertIn('Line 2 (IMP-1): SKU repetido na linha 7', err.getvalue())
+
+        admin = User.objects.create_superuser(email='import@example.com', password='password')
+        self.client.force_login(admin)
+        upload = SimpleUploadedFile('produtos.csv', b'sku,name,price\nADM-1,Borracha,1.50\n')
+        response = self.client.post(reverse('admin:inventory_product_import'), {'file': upload}, follow=True)
+        self.assertContains(response, '1 produto(s) criado(s) e 0 atualizado(s).')
+        self.assertTrue(Product.objects.filter(sku='ADM-1').exists())
+
+    def test_export_can_be_imported_back(self):
+        self.client.force_login(User.objects.create_user(email='export@example.com', password='password', role='ADMIN'))
+        content = b''.join(self.client.get(reverse('item_export')).streaming_content)
+        self.old.delete()
+        result = ProductImport(read_product_file(io.BytesIO(content), 'produtos.csv')).run()
+        self.assertEqual((result.created, result.errors), (1, []))
+        product = Product.objects.get(sku='OLD-1')
+        self.assertEqual((product.name, product.stock, product.cost_price), ('Caderno', 9, Decimal('6.00')))
+
+
+@unittest.skipUnless(importlib.util.find_spec('numpy'), 'numpy is not installed')
+class ReorderPlanTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='reorder@example.com', password='password', role='ADMIN')
+        self.client.force_login(self.user)
+        acme = Supplier.objects.create(name='Acme')
+        self.fast = Product.objects.create(name='Caneta', sku='RE-1', price=3, cost_price=2, stock=10, min_stock=2, supplier=acme)
+        self.idle = Product.objects.create(name='Régua', sku='RE-2', price=5, cost_price=1, stock=1, min_stock=5)
+        self.stocked = Product.objects.create(name='Lápis', sku='RE-3', price=1, stock=100, min_stock=5, supplier=acme)
+        customer = Customer.objects.create(name='Reorder Customer')
+        now = timezone.now()
+        for day in range(28):
+            for status, product, quantity in (('COMPLETED', self.fast, 2), ('COMPLETED', self.stocked, 1), ('CANCELED', self.fast, 50)):
+                sale = Sale.objects.create(customer=customer, seller=self.user, status=status)
+                SaleItem.objects.create(sale=sale, product=product, quantity=quantity, price=1)
+                Sale.objects.filter(pk=sale.pk).update(created_at=now - datetime.timedelta(days=day))
+
+    def test_suggests_products_that_will_run_out_grouped_by_supplier(self):
+        lines = reorder_plan()
+        self.assertEqual(
+            [(line['sku'], line['supplier'], line['velocity'], line['days_of_cover'], line['quantity']) for line in lines],
+            # Caneta: 2/day for 7 + 14 days plus min_stock, minus the 10 in stock
+            [('RE-1', 'Acme', 2.0, 5.0, 34), ('RE-2', '', 0.0, None, 4)],
+        )
+        self.assertEqual(lines[0]['cost'], Decimal('68.00'))
+
+    def test_page_and_csv(self):
+        response = self.client.get(reverse('reorder_list'), {'lead_time': '3'})
+        # With a 3 day lead time Caneta lasts long enough; Régua is still under its minimum
+        self.assertContains(response, 'RE-2')
+        self.assertNotContains(response, 'RE-1')
+        lines = b''.join(self.client.get(reverse('reorder_export')).streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith('Acme,RE-1,Caneta,10,2,2.0,5.0,34,'))
+
+    def test_page_groups_by_supplier(self):
+        # Same name as Acme, and a name differing only in case: three suppliers
+        for sku, name in (('RE-4', 'Acme'), ('RE-5', 'ACME')):
+            Product.objects.create(name=sku, sku=sku, price=1, stock=0, min_stock=5, supplier=Supplier.objects.create(name=name))
+        suppliers = self.client.get(reverse('reorder_list')).context['suppliers']
+        self.assertEqual(
+            [(supplier['name'], [line['sku'] for line in supplier['lines']]) for supplier in suppliers],
+            [(name, [sku]) for name, sku in (('Acme', 'RE-1'), ('Acme', 'RE-4'), ('ACME', 'RE-5'), ('', 'RE-2'))],
+        )
+
+    def test_admin_only(self):
+        self.client.force_login(User.objects.create_user(email='reorder-seller@example.com', password='password'))
+        self.assertEqual(self.client.get(reverse('reorder_list')).status_code, 302)
+        self.assertEqual(self.client.get(reverse('reorder_export')).status_code, 302)
+
+
+class PurchaseOrderTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='buyer@example.com', password='password')
+        self.client.force_login(self.user)
+        self.supplier = Supplier.objects.create(name='Distribuidora')
+        self.products = [
+            Product.objects.create(name=f'Item {i}', sku=f'PO-{i}', price=10, cost_price=4, stock=i)
+            for i in range(1, 4)
+        ]
+        self.order = PurchaseOrder.objects.create(supplier=self.supplier, created_by=self.user)
+
+    def test_parse_order_lines(self):
+        self.assertEqual(
+            parse_order_lines('PO-1;10;2,50\nPO-2\t3\n\nPO-3,1,7.00\nPO-1;2;1.234,56'),
+            [('PO-1', 10, Decimal('2.50')), ('PO-2', 3, None), ('PO-3', 1, Decimal('7.00')), ('PO-1', 2, Decimal('1234.56'))],
+        )
+        with self.assertRaises(ValidationError) as ctx:
+            parse_order_lines('PO-1;0;1\nPO-2\nPO-3;x\nPO-1;1;1,2,3')
+        self.assertEqual(len(ctx.exception.messages), 4)
+        self.assertEqual(ctx.exception.messages[-1], 'Linha 4: quantidade ou custo inválido.')
+
+    def test_add_lines_in_one_request(self):
+        response = self.client.post(
+            reverse('purchase_order_add_lines', args=[self.order.pk]),
+            {'lines': 'PO-1;10;2,50\nPO-2;3\nPO-1;5;2,50'}, HTTP_HX_REQUEST='true',
+        )
+        self.assertContains(response, 'PO-2')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.lines.count(), 3)
+        # 15 x 2.50 + 3 x the cost price of PO-2
+        self.assertEqual(self.order.total, Decimal('49.50'))
+
+    def test_unknown_sku_adds_nothing(self):
+        with self.assertRaises(ValidationError):
+            add_order_lines(self.order, [('PO-1', 1, None), ('NOPE', 1, None)])
+        self.assertFalse(self.order.lines.exists())
+
+    def test_receive_updates_stock_and_finance(self):
+        add_order_lines(self.order, [(product.sku, 10, Decimal('3')) for product in self.products])
+        add_order_lines(self.order, [('PO-1', 5, Decimal('3'))])
+        response = self.client.post(reverse('purchase_order_receive', args=[self.order.pk]))
+        self.assertRedirects(response, reverse('purchase_order_detail', args=[self.order.pk]))
+
+        self.assertEqual(
+            list(Product.objects.order_by('sku').values_list('stock', flat=True)), [16, 12, 13],
+        )
+        receipts = StockMovement.objects.filter(kind='RECEIPT')
+        self.assertEqual(receipts.count(), 3)
+        self.assertEqual(receipts.get(product=self.products[0]).quantity, 15)
+
+        expense = Transaction.objects.get(purchase_order=self.order)
+        self.assertEqual((expense.type, expense.status, expense.amount), ('EXPENSE', 'PENDING', Decimal('105.00')))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'RECEIVED')
+        self.assertIsNotNone(self.order.received_at)
+
+        with self.assertRaises(ValueError):
+            receive_purchase_order(self.order)
+        with self.assertRaises(ValidationError):
+            add_order_lines(self.order, [('PO-1', 1, None)])
+        self.assertEqual(Transaction.objects.filter(purchase_order=self.order).count(), 1)
+
+    def test_receive_query_count_does_not_grow_with_lines(self):
+        add_order_lines(self.order, [(product.sku, 1, None) for product in self.products])
+        other = PurchaseOrder.objects.create(supplier=self.supplier)
+        add_order_lines(other, [('PO-1', 1, None)])
+        with CaptureQueriesContext(connection) as many:
+            receive_purchase_order(self.order)
+        with CaptureQueriesContext(connection) as one:
+            receive_purchase_order(other)
+        self.assertEqual(len(many), len(one))
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        forget_data_versions()
+        reset_catalog_cache_stats()
+        self.category = Category.objects.create(name='Papelaria')
+        self.supplier = Supplier.objects.create(name='Fornecedor A')
+        self.service = Service.objects.create(name='Montagem', price=50, supplier=self.supplier)
+
+    def test_form_choices_and_validation_come_from_the_cache(self):
+        str(ProductForm()['category'])
+        str(ProductForm()['supplier'])
+        with self.assertNumQueries(0):
+            html = str(ProductForm()['category']) + str(ProductForm()['supplier'])
+        form = ServiceForm({'name': 'Entrega', 'price': '10', 'supplier': self.supplier.pk})
+        # Only the model's own foreign key check is left
+        with self.assertNumQueries(1):
+            self.assertTrue(form.is_valid())
+        self.assertIn('Papelaria', html)
+        self.assertEqual(form.cleaned_data['supplier'], self.supplier)
+        self.assertFalse(ServiceForm({'name': 'Entrega', 'price': '10', 'supplier': 999}).is_valid())
+        stats = catalog_cache_stats()
+        self.assertEqual((stats['inventory.category']['misses'], stats['inventory.category']['hits']), (1, 1))
+
+    def test_warm_form_render_runs_no_queries(self):
+        str(ProductForm())
+        with self.assertNumQueries(0):
+            html = str(ProductForm())
+        self.assertIn('Papelaria', html)
+        self.assertIn('Fornecedor A', html)
+        # Each catalog is read once per form, however often its choices are used
+        reset_catalog_cache_stats()
+        form = ProductForm()
+        str(form['supplier'])
+        str(form['supplier'])
+        self.assertEqual(catalog_cache_stats()['inventory.supplier']['hits'], 1)
+
+    def test_save_and_delete_bump_the_version(self):
+        catalog_objects(Category)
+        version = catalog_cache_stats()['inventory.category']['version']
+        Category.objects.create(name='Limpeza')
+        self.assertGreater(catalog_cache_stats()['inventory.category']['version'], version)
+        self.assertEqual(sorted(c.name for c in catalog_objects(Category).values()), ['Limpeza', 'Papelaria'])
+
+        # Services point at the deleted supplier through a SET_NULL update, without signals
+        self.assertEqual(catalog_objects(Service)[self.service.pk].supplier_id, self.supplier.pk)
+        self.supplier.delete()
+        self.assertIsNone(catalog_objects(Service)[self.service.pk].supplier_id)
+        self.assertEqual(catalog_objects(Supplier), {})
+
+    def test_choice_missing_from_the_cache_is_looked_up(self):
+        catalog_objects(Supplier)
+        # Written without signals, like a row created by another worker the cache did not hear of
+        supplier, = Supplier.objects.bulk_create([Supplier(name='Fornecedor B')])
+        form = ServiceForm({'name': 'Entrega', 'price': '10', 'supplier': supplier.pk})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['supplier'], supplier)
+        self.assertIn(supplier.pk, catalog_objects(Supplier))
+        self.assertFalse(ServiceForm({'name': 'Entrega', 'price': '10', 'supplier': 999}).is_valid())
+
+    def test_stats_endpoint_is_admin_only(self):
+        url = reverse('catalog_cache_stats')
+        self.client.force_login(User.objects.create_user(email='cache-user@example.com', password='password'))
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(User.objects.create_user(email='cache-admin@example.com', password='password', role='ADMIN'))
+        self.client.get(reverse('service_list'))
+        response = self.client.get(url)
+        self.assertEqual(response.json()['inventory.service']['misses'], 1)
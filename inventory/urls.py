@@ -12,6 +12,15 @@ urlpatterns = [
     path('categories/<int:pk>/delete/', views.category_delete, name='category_delete'),
     path('start_item_list_section/', views.item_list, name='start_item_list_section'), # dummy to mark end of inserted block if needed, or just insert before products
     path('products/', views.item_list, name='item_list'),
+    path('products/export/', views.item_export, name='item_export'),
+    path('reorder/', views.reorder_list, name='reorder_list'),
+    path('purchase-orders/', views.purchase_order_list, name='purchase_order_list'),
+    path('purchase-orders/create/', views.purchase_order_create, name='purchase_order_create'),
+    path('purchase-orders/<int:pk>/', views.purchase_order_detail, name='purchase_order_detail'),
+    path('purchase-orders/<int:pk>/add_lines/', views.purchase_order_add_lines, name='purchase_order_add_lines'),
+    path('purchase-orders/<int:pk>/receive/', views.purchase_order_receive, name='purchase_order_receive'),
+    path('reorder/export/', views.reorder_export, name='reorder_export'),
+    path('catalog-cache/', views.catalog_cache_stats_view, name='catalog_cache_stats'),
     path('services/', views.service_list, name='service_list'),
     path('create/', views.item_create, name='item_create'),
     path('<int:pk>/update/', views.item_update, name='item_update'),
@@ -1,18 +1,24 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse
-from django.template.loader import render_to_string
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.urls import reverse
 from django.contrib import messages
+from django.core.exceptions import ValidationError
 from django.db import models
-from .models import Product, Service, Supplier, Category
-from .forms import ProductForm, ServiceForm, SupplierForm, CategoryForm
+from django.http import JsonResponse
+from itertools import groupby
+from .models import Product, PurchaseOrder, Service, Supplier, Category
+from .forms import ProductForm, PurchaseOrderForm, PurchaseOrderLinesForm, ServiceForm, SupplierForm, CategoryForm
+from .catalog import catalog_cache_stats, catalog_objects
+from .purchasing import add_order_lines, receive_purchase_order
+from .reorder import REORDER_COVER_DAYS, REORDER_LEAD_TIME_DAYS, REORDER_WINDOW_DAYS, reorder_plan
 from dashboard.views import is_admin
+from core.csv_export import EXPORT_CHUNK_SIZE, csv_response
+from core.htmx import partial_response, row_response
 
 @login_required
 def supplier_list(request):
-    suppliers = Supplier.objects.all()
+    suppliers = catalog_objects(Supplier).values()
     return render(request, 'inventory/supplier_list.html', {'suppliers': suppliers})
 
 @login_required
@@ -20,10 +26,10 @@ def supplier_create(request):
     if request.method == 'POST':
         form = SupplierForm(request.POST)
         if form.is_valid():
-            form.save()
+            supplier = form.save()
             if request.htmx:
-                suppliers = Supplier.objects.all()
-                return render(request, 'inventory/partials/supplier_list_rows.html', {'suppliers': suppliers})
+                return row_response(request, 'inventory/partials/supplier_row.html', {'supplier': supplier},
+                                    insert_into='supplier-table-body', close_modal=True)
             return redirect('supplier_list')
     else:
         form = SupplierForm()
@@ -39,10 +45,9 @@ def supplier_update(request, pk):
     if request.method == 'POST':
         form = SupplierForm(request.POST, instance=supplier)
         if form.is_valid():
-            form.save()
+            supplier = form.save()
             if request.htmx:
-                suppliers = Supplier.objects.all()
-                return render(request, 'inventory/partials/supplier_list_rows.html', {'suppliers': suppliers})
+                return row_response(request, 'inventory/partials/supplier_row.html', {'supplier': supplier}, close_modal=True)
             return redirect('supplier_list')
     else:
         form = SupplierForm(instance=supplier)
@@ -57,29 +62,72 @@ def supplier_update(request, pk):
 @require_http_methods(["DELETE", "POST"])
 def supplier_delete(request, pk):
     supplier = get_object_or_404(Supplier, pk=pk)
+    deleted_row = None
     try:
         supplier.delete()
+        deleted_row = f'supplier-{pk}'
         messages.success(request, 'Fornecedor excluído com sucesso.')
     except models.ProtectedError:
         messages.error(request, 'Não é possível excluir este fornecedor pois existem produtos associados a ele.')
 
     if request.htmx:
-        suppliers = Supplier.objects.all()
-        rows_html = render_to_string('inventory/partials/supplier_list_rows.html', {'suppliers': suppliers}, request=request)
-        messages_html = render_to_string('partials/messages.html', {}, request=request)
-        final_html = rows_html + f'<tr style="display:none"><td>{messages_html}</td></tr>'
-        return HttpResponse(final_html)
+        return row_response(request, delete_row=deleted_row)
     return redirect('supplier_list')
 
 @login_required
 def item_list(request):
-    context = {'products': Product.objects.select_related('category', 'supplier').all()}
+    context = {'products': Product.objects.with_on_hand().select_related('category', 'supplier')}
     context['page_title'] = 'Produtos'
     return render(request, 'inventory/product_list.html', context)
 
+@login_required
+@user_passes_test(is_admin)
+def item_export(request):
+    """Download every product as CSV, with the columns import_products reads."""
+    rows = Product.objects.with_on_hand().order_by('name', 'pk').values_list(
+        'sku', 'name', 'category__name', 'supplier__name', 'price', 'cost_price', 'on_hand', 'min_stock', 'unit',
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    header = ['SKU', 'Nome', 'Categoria', 'Fornecedor', 'Preço', 'Preço de Custo', 'Estoque', 'Estoque Mínimo', 'Unidade']
+    return csv_response('produtos.csv', header, rows)
+
+def _reorder_params(params):
+    """Planner settings from the query string, falling back to the defaults when missing or out of range."""
+    def days(name, default, maximum):
+        value = params.get(name, '')
+        return int(value) if value.isdigit() and 0 < int(value) <= maximum else default
+    return {
+        'window_days': days('window', REORDER_WINDOW_DAYS, 365),
+        'lead_time_days': days('lead_time', REORDER_LEAD_TIME_DAYS, 180),
+        'cover_days': days('cover', REORDER_COVER_DAYS, 365),
+    }
+
+@login_required
+@user_passes_test(is_admin)
+def reorder_list(request):
+    params = _reorder_params(request.GET)
+    lines = reorder_plan(**params)
+    # reorder_plan keeps each supplier's lines together
+    suppliers = [
+        {'name': group[0]['supplier'], 'lines': group, 'cost': sum(line['cost'] for line in group)}
+        for group in (list(group) for _, group in groupby(lines, key=lambda line: line['supplier_id']))
+    ]
+    return render(request, 'inventory/reorder_list.html', {'suppliers': suppliers, 'params': params, 'total': len(lines)})
+
+@login_required
+@user_passes_test(is_admin)
+def reorder_export(request):
+    rows = (
+        [line['supplier'], line['sku'], line['name'], line['stock'], line['min_stock'], line['velocity'],
+         line['days_of_cover'], line['quantity'], line['cost']]
+        for line in reorder_plan(**_reorder_params(request.GET))
+    )
+    header = ['Fornecedor', 'SKU', 'Nome', 'Estoque', 'Estoque Mínimo', 'Vendas/Dia', 'Dias de Cobertura',
+              'Quantidade Sugerida', 'Custo Estimado']
+    return csv_response('sugestao_de_compra.csv', header, rows)
+
 @login_required
 def category_list(request):
-    categories = Category.objects.all()
+    categories = catalog_objects(Category).values()
     return render(request, 'inventory/category_list.html', {'categories': categories})
 
 @login_required
@@ -87,15 +135,10 @@ def category_create(request):
     if request.method == 'POST':
         form = CategoryForm(request.POST)
         if form.is_valid():
-            form.save()
+            category = form.save()
             if request.htmx:
-                categories = Category.objects.all()
-                rows_html = render_to_string('inventory/partials/category_list_rows.html', {'categories': categories}, request=request)
-                messages_html = render_to_string('partials/messages.html', {}, request=request)
-                response_content = f'<tbody id="category-table-body" hx-swap-oob="innerHTML">{rows_html}</tbody>{messages_html}'
-                response = HttpResponse(response_content)
-                response['HX-Trigger'] = 'close-modal'
-                return response
+                return row_response(request, 'inventory/partials/category_row.html', {'category': category},
+                                    insert_into='category-table-body', close_modal=True)
             return redirect('category_list')
     else:
         form = CategoryForm()
@@ -111,15 +154,9 @@ def category_update(request, pk):
     if request.method == 'POST':
         form = CategoryForm(request.POST, instance=category)
         if form.is_valid():
-            form.save()
+            category = form.save()
             if request.htmx:
-                categories = Category.objects.all()
-                rows_html = render_to_string('inventory/partials/category_list_rows.html', {'categories': categories}, request=request)
-                messages_html = render_to_string('partials/messages.html', {}, request=request)
-                response_content = f'<tbody id="category-table-body" hx-swap-oob="innerHTML">{rows_html}</tbody>{messages_html}'
-                response = HttpResponse(response_content)
-                response['HX-Trigger'] = 'close-modal'
-                return response
+                return row_response(request, 'inventory/partials/category_row.html', {'category': category}, close_modal=True)
             return redirect('category_list')
     else:
         form = CategoryForm(instance=category)
@@ -134,23 +171,21 @@ def category_update(request, pk):
 @require_http_methods(["DELETE", "POST"])
 def category_delete(request, pk):
     category = get_object_or_404(Category, pk=pk)
+    deleted_row = None
     try:
         category.delete()
+        deleted_row = f'category-{pk}'
         messages.success(request, 'Categoria excluída com sucesso.')
     except models.ProtectedError:
         messages.error(request, 'Não é possível excluir esta categoria pois existem produtos associados a ela.')
 
     if request.htmx:
-        categories = Category.objects.all()
-        rows_html = render_to_string('inventory/partials/category_list_rows.html', {'categories': categories}, request=request)
-        messages_html = render_to_string('partials/messages.html', {}, request=request)
-        final_html = rows_html + f'<tr style="display:none"><td>{messages_html}</td></tr>'
-        return HttpResponse(final_html)
+        return row_response(request, delete_row=deleted_row)
     return redirect('category_list')
 
 @login_required
 def service_list(request):
-    context = {'services': Service.objects.all()}
+    context = {'services': catalog_objects(Service).values()}
     context['page_title'] = 'Serviços'
     return render(request, 'inventory/service_list.html', context)
 
@@ -159,14 +194,10 @@ def item_create(request):
     if request.method == 'POST':
         form = ProductForm(request.POST)
         if form.is_valid():
-            form.save()
+            product = form.save()
             if request.htmx:
-                rows_html = render_to_string('inventory/partials/product_list_rows.html', {'products': Product.objects.select_related('category', 'supplier').all()}, request=request)
-                messages_html = render_to_string('partials/messages.html', {}, request=request)
-                response_content = f'<tbody id="item-table-body" hx-swap-oob="innerHTML">{rows_html}</tbody>{messages_html}'
-                response = HttpResponse(response_content)
-                response['HX-Trigger'] = 'close-modal'
-                return response
+                return row_response(request, 'inventory/partials/product_row.html', {'product': product},
+                                    insert_into='item-table-body', close_modal=True)
             return redirect('item_list')
     else:
         form = ProductForm()
@@ -182,14 +213,9 @@ def item_update(request, pk):
     if request.method == 'POST':
         form = ProductForm(request.POST, instance=item)
         if form.is_valid():
-            form.save()
+            product = form.save()
             if request.htmx:
-                rows_html = render_to_string('inventory/partials/product_list_rows.html', {'products': Product.objects.select_related('category', 'supplier').all()}, request=request)
-                messages_html = render_to_string('partials/messages.html', {}, request=request)
-                response_content = f'<tbody id="item-table-body" hx-swap-oob="innerHTML">{rows_html}</tbody>{messages_html}'
-                response = HttpResponse(response_content)
-                response['HX-Trigger'] = 'close-modal'
-                return response
+                return row_response(request, 'inventory/partials/product_row.html', {'product': product}, close_modal=True)
             return redirect('item_list')
     else:
         form = ProductForm(instance=item)
@@ -204,17 +230,16 @@ def item_update(request, pk):
 @require_http_methods(["DELETE", "POST"])
 def item_delete(request, pk):
     item = get_object_or_404(Product, pk=pk)
+    deleted_row = None
     try:
         item.delete()
+        deleted_row = f'product-{pk}'
         messages.success(request, 'Produto excluído com sucesso.')
     except models.ProtectedError:
         messages.error(request, 'Não é possível excluir este produto pois existem vendas associadas a ele.')
 
     if request.htmx:
-        rows_html = render_to_string('inventory/partials/product_list_rows.html', {'products': Product.objects.all()}, request=request)
-        messages_html = render_to_string('partials/messages.html', {}, request=request)
-        final_html = rows_html + f'<tr style="display:none"><td>{messages_html}</td></tr>'
-        return HttpResponse(final_html)
+        return row_response(request, delete_row=deleted_row)
     return redirect('item_list')
 
 @login_required
@@ -222,9 +247,10 @@ def service_create(request):
     if request.method == 'POST':
         form = ServiceForm(request.POST)
         if form.is_valid():
-            form.save()
+            service = form.save()
             if request.htmx:
-                return render(request, 'inventory/partials/service_list_rows.html', {'services': Service.objects.all()})
+                return row_response(request, 'inventory/partials/service_row.html', {'service': service},
+                                    insert_into='item-table-body', close_modal=True)
             return redirect('service_list')
     else:
         form = ServiceForm()
@@ -240,9 +266,9 @@ def service_update(request, pk):
     if request.method == 'POST':
         form = ServiceForm(request.POST, instance=service)
         if form.is_valid():
-            form.save()
+            service = form.save()
             if request.htmx:
-                return render(request, 'inventory/partials/service_list_rows.html', {'services': Service.objects.all()})
+                return row_response(request, 'inventory/partials/service_row.html', {'service': service}, close_modal=True)
             return redirect('service_list')
     else:
         form = ServiceForm(instance=service)
@@ -257,15 +283,87 @@ def service_update(request, pk):
 @require_http_methods(["DELETE", "POST"])
 def service_delete(request, pk):
     service = get_object_or_404(Service, pk=pk)
+    deleted_row = None
     try:
         service.delete()
+        deleted_row = f'service-{pk}'
         messages.success(request, 'Serviço excluído com sucesso.')
     except models.ProtectedError:
         messages.error(request, 'Não é possível excluir este serviço pois existem vendas associadas a ele.')
 
     if request.htmx:
-        rows_html = render_to_string('inventory/partials/service_list_rows.html', {'services': Service.objects.all()}, request=request)
-        messages_html = render_to_string('partials/messages.html', {}, request=request)
-        final_html = rows_html + f'<tr style="display:none"><td>{messages_html}</td></tr>'
-        return HttpResponse(final_html)
+        return row_response(request, delete_row=deleted_row)
     return redirect('service_list')
+
+@login_required
+def purchase_order_list(request):
+    orders = PurchaseOrder.objects.select_related('supplier').order_by('-created_at', '-id')
+    return render(request, 'inventory/purchase_order_list.html', {'orders': orders})
+
+@login_required
+def purchase_order_create(request):
+    if request.method == 'POST':
+        form = PurchaseOrderForm(request.POST)
+        if form.is_valid():
+            order = form.save(commit=False)
+            order.created_by = request.user
+            order.save()
+            if request.htmx:
+                return row_response(request, 'inventory/partials/purchase_order_row.html', {'order': order},
+                                    insert_into='purchase-order-table-body', position='afterbegin', close_modal=True)
+            return redirect('purchase_order_detail', pk=order.pk)
+    else:
+        form = PurchaseOrderForm()
+
+    context = {'form': form, 'submit_url': reverse('purchase_order_create'), 'modal_title': 'Novo Pedido de Compra'}
+    if request.htmx:
+        return render(request, 'inventory/partials/item_form.html', context)
+    return render(request, 'inventory/item_form.html', context)
+
+def _purchase_order_context(order):
+    return {'order': order, 'lines': order.lines.select_related('product').order_by('pk')}
+
+@login_required
+def purchase_order_detail(request, pk):
+    order = get_object_or_404(PurchaseOrder.objects.select_related('supplier', 'created_by'), pk=pk)
+    context = _purchase_order_context(order)
+    context['form'] = PurchaseOrderLinesForm()
+    return render(request, 'inventory/purchase_order_detail.html', context)
+
+@login_required
+@require_http_methods(["POST"])
+def purchase_order_add_lines(request, pk):
+    """Add every pasted line to the order in one request."""
+    order = get_object_or_404(PurchaseOrder, pk=pk)
+    form = PurchaseOrderLinesForm(request.POST)
+    if form.is_valid():
+        try:
+            lines = add_order_lines(order, form.cleaned_data['lines'])
+            messages.success(request, f'{len(lines)} item(ns) adicionado(s) ao pedido.')
+        except ValidationError as e:
+            for message in e.messages:
+                messages.error(request, message)
+    else:
+        for message in form.errors['lines']:
+            messages.error(request, message)
+
+    if request.htmx:
+        return partial_response(request, 'inventory/partials/purchase_order_lines.html', _purchase_order_context(order))
+    return redirect('purchase_order_detail', pk=pk)
+
+@login_required
+@require_http_methods(["POST"])
+def purchase_order_receive(request, pk):
+    order = get_object_or_404(PurchaseOrder, pk=pk)
+    try:
+        receive_purchase_order(order)
+        messages.success(request, 'Mercadorias recebidas: estoque atualizado e despesa registrada no financeiro.')
+    except ValueError as e:
+        messages.error(request, str(e))
+    return redirect('purchase_order_detail', pk=pk)
+
+@login_required
+@user_passes_test(is_admin)
+def catalog_cache_stats_view(request):
+    """Hit/miss counters of the catalog cache in the worker serving the request."""
+    return JsonResponse(catalog_cache_stats())
@@ -0,0 +1,52 @@
+import multiprocessing
+import signal
+from django.core.management.base import BaseCommand
+from django.db import connections
+from jobs.queue import requeue_stale_jobs, work
+from jobs.worker import main as worker_main
+
+
+class Command(BaseCommand):
+    help = 'Runs background job workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help='Number of worker processes')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--burst', action='store_true', help='Exit once there are no due jobs left')
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(self.style.WARNING(f'{requeued} stale job(s) requeued'))
+
+        concurrency = max(options['concurrency'], 1)
+        self.stdout.write(f'Starting {concurrency} worker(s)...')
+
+        if concurrency == 1:
+            try:
+                executed = work(poll_interval=options['poll_interval'], burst=options['burst'])
+            except KeyboardInterrupt:
+                return
+            self.stdout.write(self.style.SUCCESS(f'{executed} job(s) executed'))
+            return
+
+        context = multiprocessing.get_context('spawn')
+        stop_event = context.Event()
+        connections.close_all()
+        workers = [
+            context.Process(target=worker_main, args=(stop_event, options['poll_interval'], options['burst']))
+            for _ in range(concurrency)
+        ]
+        for worker in workers:
+            worker.start()
+
+        # SIGTERM (docker stop) finishes the running jobs like Ctrl+C does
+        signal.signal(signal.SIGTERM, lambda *args: stop_event.set())
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            stop_event.set()
+            for worker in workers:
+                worker.join()
+        self.stdout.write(self.style.SUCCESS('Workers stopped'))
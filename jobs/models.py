@@ -0,0 +1,39 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils import timezone
+from dashboard.models import User
+
+class Job(models.Model):
+    STATUS_CHOICES = [
+        ('PENDING', 'Pendente'),
+        ('RUNNING', 'Em execução'),
+        ('DONE', 'Concluído'),
+        ('FAILED', 'Falhou'),
+    ]
+
+    name = models.CharField(max_length=255, verbose_name="Tarefa")  # Dotted path of the task function
+    args = models.JSONField(default=list, blank=True, verbose_name="Argumentos")
+    kwargs = models.JSONField(default=dict, blank=True, verbose_name="Argumentos Nomeados")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING', verbose_name="Status")
+    attempts = models.IntegerField(default=0, verbose_name="Tentativas")
+    max_attempts = models.IntegerField(default=3, verbose_name="Máximo de Tentativas")
+    run_at = models.DateTimeField(default=timezone.now, verbose_name="Executar Em")
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder, verbose_name="Resultado")
+    error = models.TextField(blank=True, default='', verbose_name="Erro")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Data de Criação")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Iniciado Em")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Finalizado Em")
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs', verbose_name="Criado por")
+
+    class Meta:
+        indexes = [
+            # Workers poll for the oldest due job of a given status
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+
+    @property
+    def is_finished(self):
+        return self.status in ('DONE', 'FAILED')
+
+    def __str__(self):
+        return f"Job #{self.id} - {self.name} ({self.status})"
@@ -0,0 +1,129 @@
+import datetime
+import json
+import time
+import traceback
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import Job
+
+RETRY_BASE_DELAY = 10  # seconds, doubled after every failed attempt
+STALE_AFTER = datetime.timedelta(minutes=30)
+
+
+def task_name(func):
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def enqueue(func, *args, max_attempts=3, run_at=None, created_by=None, **kwargs):
+    """
+    Queue func(*args, **kwargs) to run in a `run_workers` process.
+
+    func is a module level function (or its dotted path) and its arguments
+    must be JSON serializable; a return value that is not is stored as its
+    str(). created_by is the user allowed to follow the job besides the
+    admins. Returns the created Job.
+    """
+    name = func if isinstance(func, str) else task_name(func)
+    return Job.objects.create(
+        name=name,
+        args=list(args),
+        kwargs=kwargs,
+        max_attempts=max_attempts,
+        run_at=run_at or timezone.now(),
+        created_by=created_by,
+    )
+
+
+def claim_job():
+    """
+    Atomically take the oldest due job and mark it as running.
+
+    SELECT ... FOR UPDATE SKIP LOCKED lets several workers poll the table
+    without blocking on each other. The conditional UPDATE keeps the claim
+    safe on databases without row locking (SQLite).
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status='PENDING', run_at__lte=now)
+            .order_by('run_at', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        claimed = Job.objects.filter(pk=job.pk, status='PENDING').update(
+            status='RUNNING', attempts=job.attempts + 1, started_at=now
+        )
+    if not claimed:
+        return None
+    job.refresh_from_db()
+    return job
+
+
+def _storable(result):
+    # The task has already done its work: a result JSON cannot hold is kept
+    # as text instead of failing the job and running it again
+    try:
+        json.dumps(result, cls=DjangoJSONEncoder)
+    except (TypeError, ValueError):
+        return str(result)
+    return result
+
+
+def run_job(job):
+    """Execute a claimed job, storing its result or scheduling a retry with exponential backoff."""
+    try:
+        result = import_string(job.name)(*job.args, **job.kwargs)
+    except Exception:
+        job.error = traceback.format_exc()
+        job.finished_at = timezone.now()
+        if job.attempts < job.max_attempts:
+            job.status = 'PENDING'
+            job.run_at = job.finished_at + datetime.timedelta(seconds=RETRY_BASE_DELAY * 2 ** (job.attempts - 1))
+        else:
+            job.status = 'FAILED'
+        job.save(update_fields=['status', 'error', 'run_at', 'finished_at'])
+        return job
+
+    job.status = 'DONE'
+    job.result = _storable(result)
+    job.error = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'error', 'finished_at'])
+    return job
+
+
+def requeue_stale_jobs(stale_after=STALE_AFTER):
+    """Put back jobs left RUNNING by a worker that died mid-task."""
+    return Job.objects.filter(
+        status='RUNNING', started_at__lt=timezone.now() - stale_after
+    ).update(status='PENDING', run_at=timezone.now())
+
+
+def work(poll_interval=1.0, burst=False, should_stop=lambda: False):
+    """
+    Process jobs until should_stop() returns True.
+
+    With burst=True the loop returns as soon as no job is due, which is
+    handy for cron and tests. Returns the number of jobs executed.
+    """
+    executed = 0
+    while not should_stop():
+        # A long-running worker drops connections that broke or outlived
+        # CONN_MAX_AGE, as Django does around every request
+        close_old_connections()
+        job = claim_job()
+        if job is None:
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+        try:
+            run_job(job)
+        finally:
+            close_old_connections()
+        executed += 1
+    return executed
@@ -0,0 +1,103 @@
+import datetime
+from unittest import mock
+from django.test import TestCase, Client
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from jobs.models import Job
+from jobs.queue import claim_job, enqueue, requeue_stale_jobs, run_job, work
+
+User = get_user_model()
+
+
+def add(a, b):
+    return {'sum': a + b}
+
+
+def explode():
+    raise RuntimeError('boom')
+
+
+def opaque():
+    return object()
+
+
+class JobQueueTests(TestCase):
+    def test_enqueued_job_runs_and_stores_result(self):
+        job = enqueue(add, 2, b=3)
+        self.assertEqual(job.name, 'jobs.tests.add')
+
+        self.assertEqual(work(burst=True), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'DONE')
+        self.assertEqual(job.result, {'sum': 5})
+        self.assertEqual(job.attempts, 1)
+
+    def test_claim_skips_future_and_claimed_jobs(self):
+        enqueue(add, 1, 1, run_at=timezone.now() + datetime.timedelta(hours=1))
+        due = enqueue(add, 1, 2)
+
+        self.assertEqual(claim_job().pk, due.pk)
+        self.assertIsNone(claim_job())
+
+    def test_failed_job_is_retried_with_backoff_then_failed(self):
+        job = enqueue(explode, max_attempts=2)
+
+        run_job(claim_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'PENDING')
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('RuntimeError: boom', job.error)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        run_job(claim_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'FAILED')
+        self.assertEqual(job.attempts, 2)
+
+    def test_unserializable_result_does_not_rerun_the_job(self):
+        job = enqueue(opaque)
+
+        self.assertEqual(work(burst=True), 1)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('DONE', 1))
+        self.assertIn('object object', job.result)
+
+    def test_stale_running_jobs_are_requeued(self):
+        job = enqueue(add, 1, 1)
+        Job.objects.filter(pk=job.pk).update(status='RUNNING', started_at=timezone.now() - datetime.timedelta(hours=1))
+
+        self.assertEqual(requeue_stale_jobs(), 1)
+        self.assertEqual(claim_job().pk, job.pk)
+
+    def test_status_partial_polls_until_finished(self):
+        user = User.objects.create_user(email='jobs@example.com', password='password')
+        client = Client()
+        client.force_login(user)
+        job = enqueue(add, 1, 1, created_by=user)
+
+        response = client.get(reverse('job_status', args=[job.pk]))
+        self.assertContains(response, 'hx-trigger="every 2s"')
+
+        work(burst=True)
+        response = client.get(reverse('job_status', args=[job.pk]))
+        self.assertNotContains(response, 'hx-trigger')
+        self.assertContains(response, 'Concluído')
+
+    def test_status_of_other_users_jobs_is_admin_only(self):
+        owner = User.objects.create_user(email='jobs-owner@example.com', password='password')
+        job = enqueue(add, 1, 1, created_by=owner)
+        client = Client()
+        client.force_login(User.objects.create_user(email='jobs-other@example.com', password='password'))
+        self.assertEqual(client.get(reverse('job_status', args=[job.pk])).status_code, 404)
+        client.force_login(User.objects.create_user(email='jobs-admin@example.com', password='password', role='ADMIN'))
+        self.assertEqual(client.get(reverse('job_status', args=[job.pk])).status_code, 200)
+
+    def test_worker_closes_old_connections_around_each_job(self):
+        enqueue(add, 1, 1)
+        with mock.patch('jobs.queue.close_old_connections') as close:
+            self.assertEqual(work(burst=True), 1)
+        # Before and after the job, then before finding the queue empty
+        self.assertEqual(close.call_count, 3)
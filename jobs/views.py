@@ -0,0 +1,12 @@
+from django.shortcuts import render, get_object_or_404
+from django.contrib.auth.decorators import login_required
+from dashboard.views import is_admin
+from .models import Job
+
+@login_required
+def job_status(request, pk):
+    # Admins follow any job, everyone else only the jobs they started
+    jobs = Job.objects.all() if is_admin(request.user) else Job.objects.filter(created_by=request.user)
+    job = get_object_or_404(jobs, pk=pk)
+    # While the job is not finished the partial keeps polling itself via hx-trigger
+    return render(request, 'jobs/partials/job_status.html', {'job': job})
@@ -0,0 +1,17 @@
+import signal
+
+
+def main(stop_event, poll_interval, burst):
+    """
+    Entry point of a `run_workers` child process.
+
+    Children are spawned rather than forked, so Django has to be set up here
+    before anything touching the ORM is imported.
+    """
+    import django
+    django.setup()
+    from .queue import work
+
+    # The parent handles Ctrl+C and tells the workers to stop through stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    work(poll_interval=poll_interval, burst=burst, should_stop=stop_event.is_set)
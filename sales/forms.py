@@ -1,6 +1,28 @@
 from django import forms
+from django.template.loader import render_to_string
+from django.urls import reverse
+from inventory.catalog import CachedModelChoiceField
+from inventory.models import Product
 from .models import Sale, SaleItem, Customer
 
+class CustomerSearchWidget(forms.HiddenInput):
+    """
+    Customer picker that fetches matches from customer_search as the user types.
+
+    Unlike forms.Select it never renders the customer table into the page;
+    only the currently selected customer is looked up to show its name.
+    """
+    template_name = 'sales/widgets/customer_search.html'
+
+    def render(self, name, value, attrs=None, renderer=None):
+        context = self.get_context(name, value, attrs)
+        customer = Customer.objects.filter(pk=value).only('name').first() if value else None
+        context.update({
+            'label': customer.name if customer else '',
+            'search_url': reverse('customer_search'),
+        })
+        return render_to_string(self.template_name, context)
+
 class CustomerForm(forms.ModelForm):
     class Meta:
         model = Customer
@@ -20,15 +42,33 @@ class SaleForm(forms.ModelForm):
         model = Sale
         fields = ['customer']
         widgets = {
-            'customer': forms.Select(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-300 focus:ring focus:ring-indigo-200 focus:ring-opacity-50'}),
+            'customer': CustomerSearchWidget(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-300 focus:ring focus:ring-indigo-200 focus:ring-opacity-50'}),
         }
 
 class SaleItemForm(forms.ModelForm):
+    """
+    Product and service are hidden ids filled in by the item picker
+    (sale_item_search). A scanned barcode can be posted as `sku` instead and
+    is resolved to its product with a single lookup on the unique index.
+    """
+    sku = forms.CharField(required=False, widget=forms.HiddenInput)
+
     class Meta:
         model = SaleItem
         fields = ['product', 'service', 'quantity']
+        field_classes = {'service': CachedModelChoiceField}
         widgets = {
-            'product': forms.Select(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-300 focus:ring focus:ring-indigo-200 focus:ring-opacity-50'}),
-            'service': forms.Select(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-300 focus:ring focus:ring-indigo-200 focus:ring-opacity-50'}),
+            'product': forms.HiddenInput,
+            'service': forms.HiddenInput,
             'quantity': forms.NumberInput(attrs={'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-300 focus:ring focus:ring-indigo-200 focus:ring-opacity-50'}),
         }
+
+    def clean(self):
+        cleaned_data = super().clean()
+        sku = cleaned_data.get('sku', '').strip()
+        if sku and not cleaned_data.get('product') and not cleaned_data.get('service'):
+            product = Product.objects.filter(sku=sku).first()
+            if product is None:
+                raise forms.ValidationError(f'Nenhum produto com o SKU {sku}.')
+            cleaned_data['product'] = product
+        return cleaned_data
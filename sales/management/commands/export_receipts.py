@@ -0,0 +1,40 @@
+import os
+from django.core.management.base import BaseCommand
+from dashboard.models import Organization
+from sales.models import Sale
+from sales.receipt_export import ReceiptExport
+from sales.services import filter_sales
+
+class Command(BaseCommand):
+    help = 'Exports the PDF receipts of the selected sales to a ZIP file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the ZIP file to write')
+        parser.add_argument('--date-from', help='First sale date (YYYY-MM-DD)')
+        parser.add_argument('--date-to', help='Last sale date (YYYY-MM-DD)')
+        parser.add_argument('--status', choices=[value for value, _ in Sale.STATUS_CHOICES])
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of rendering processes (default: CPU count)')
+
+    def handle(self, *args, **options):
+        params = {
+            'date_from': options['date_from'],
+            'date_to': options['date_to'],
+            'status': options['status'],
+        }
+        sales = filter_sales(Sale.objects.all(), params)
+        export = ReceiptExport(sales, Organization.load(), workers=options['workers'], progress=self.report)
+
+        with open(options['output'], 'wb') as output:
+            for chunk in export:
+                output.write(chunk)
+
+        exported = export.total - len(export.failures)
+        self.stdout.write(self.style.SUCCESS(f'{exported} receipt(s) written to {options["output"]}'))
+        if export.failures:
+            self.stdout.write(self.style.WARNING(f'{len(export.failures)} receipt(s) failed, see erros.txt in the archive'))
+
+    def report(self, done, total, sale, error):
+        if error:
+            self.stderr.write(f'[{done}/{total}] Sale #{sale.pk} failed: {error}')
+        else:
+            self.stdout.write(f'[{done}/{total}] Sale #{sale.pk}')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from sales.services import verify_sale_totals
+
+class Command(BaseCommand):
+    help = 'Finds sales whose total differs from the sum of their items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Correct the total of drifted pending sales')
+
+    def handle(self, *args, **options):
+        drifted = verify_sale_totals(fix=options['fix'])
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('All sale totals match their items'))
+            return
+
+        for pk, status, stored, expected in drifted:
+            self.stdout.write(f'Sale #{pk} ({status}): stored {stored}, items {expected}')
+
+        if options['fix']:
+            fixed = sum(1 for _, status, _, _ in drifted if status == 'PENDING')
+            self.stdout.write(self.style.SUCCESS(f'{fixed} pending sale(s) fixed'))
+            if fixed < len(drifted):
+                self.stdout.write(self.style.WARNING(f'{len(drifted) - fixed} finalized sale(s) need manual review'))
+        else:
+            self.stdout.write(self.style.WARNING(f'{len(drifted)} sale(s) with drifted totals, run with --fix to correct pending ones'))
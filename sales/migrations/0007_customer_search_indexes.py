@@ -0,0 +1,62 @@
+from django.db import DatabaseError, migrations, transaction
+
+# Customer typeahead (sales.services.search_customers) filters with
+# UPPER(name) LIKE 'x%', document LIKE 'x%' and phone LIKE 'x%'. On PostgreSQL
+# those prefix lookups only use a B-tree index built with a pattern operator
+# class; the substring fallback on the name needs a pg_trgm GIN index, which
+# is created only when the extension is installed or this role may install it
+# (CREATE on the database; on managed PostgreSQL a superuser may have to run
+# CREATE EXTENSION pg_trgm first). Other databases skip this.
+
+PREFIX_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS customer_name_prefix_idx ON sales_customer (UPPER(name::text) text_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS customer_document_prefix_idx ON sales_customer ((document::text) text_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS customer_phone_prefix_idx ON sales_customer ((phone::text) text_pattern_ops)',
+]
+TRIGRAM_INDEX = 'CREATE INDEX IF NOT EXISTS customer_name_trgm_idx ON sales_customer USING gin (UPPER(name::text) gin_trgm_ops)'
+INDEX_NAMES = ['customer_name_prefix_idx', 'customer_document_prefix_idx', 'customer_phone_prefix_idx', 'customer_name_trgm_idx']
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for statement in PREFIX_INDEXES:
+        schema_editor.execute(statement)
+    if _has_trigram(schema_editor.connection):
+        schema_editor.execute(TRIGRAM_INDEX)
+
+
+def _has_trigram(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if cursor.fetchone() is not None:
+            return True
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return False
+        try:
+            # In a savepoint, so a role without CREATE on the database only
+            # loses the trigram index, not the prefix indexes
+            with transaction.atomic(using=connection.alias):
+                cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        except DatabaseError:
+            return False
+    return True
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in INDEX_NAMES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0006_sale_created_at_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -28,6 +28,12 @@ class Sale(models.Model):
     total = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name="Total")
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING', verbose_name="Status")
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of the sale list walks (created_at, id) backwards
+            models.Index(fields=['-created_at', '-id'], name='sale_created_at_id_idx'),
+        ]
+
     def __str__(self):
         return f"Sale #{self.id} - {self.customer.name}"
 
@@ -0,0 +1,163 @@
+import multiprocessing
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Prefetch
+from .models import SaleItem
+from .receipts import html_to_pdf, receipt_html, receipt_key, store_receipt
+
+
+class _ZipStream:
+    """Write-only file object that hands back whatever zipfile wrote since the last pop()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+_pool_lock = threading.Lock()
+_pool = None
+
+
+def _process_pool(workers):
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def shared_pool(broken=None):
+    """
+    The rendering pool shared by every export of this process, with
+    RECEIPT_EXPORT_WORKERS processes started on first use. Pass the pool
+    that raised BrokenProcessPool as broken to get a fresh one.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool is broken:
+            _pool = _process_pool(settings.RECEIPT_EXPORT_WORKERS)
+        return _pool
+
+
+class ReceiptExport:
+    """
+    Stream a ZIP archive with one PDF receipt per sale.
+
+    Receipt HTML is rendered in this process (it needs the ORM) and handed to
+    a pool of WeasyPrint worker processes. At most `window` PDFs are in
+    flight at any time and each one is written to the archive and yielded as
+    soon as it is ready, so memory use does not grow with the number of sales.
+    Receipts already in the PDF cache are reused and new finalized receipts
+    are stored there.
+
+    Exports share the process-wide pool of RECEIPT_EXPORT_WORKERS processes
+    (see shared_pool), so concurrent downloads do not multiply the number of
+    interpreters; with workers, the export gets a pool of its own instead,
+    shut down when it ends (the export_receipts command).
+
+    Iterating the export yields the archive bytes. Sales that fail to render
+    are collected in `failures` and listed in an `erros.txt` file at the end
+    of the archive. `progress(done, total, sale, error)` is called after each
+    sale.
+    """
+
+    def __init__(self, sales, organization, workers=None, base_url=None, progress=None):
+        self.sales = sales
+        self.organization = organization
+        self.workers = workers
+        self.window = (workers or settings.RECEIPT_EXPORT_WORKERS) * 2
+        self.base_url = base_url
+        self.progress = progress
+        self.total = 0
+        self.done = 0
+        self.failures = []
+
+    def _queryset(self):
+        items = SaleItem.objects.select_related('product', 'service').order_by('pk')
+        return self.sales.select_related('customer', 'seller').prefetch_related(
+            Prefetch('items', queryset=items)
+        ).order_by('pk')
+
+    def _submit(self, executor, sale):
+        items = list(sale.items.all())
+        _, path = receipt_key(sale, self.organization, items)
+        cacheable = sale.status == 'COMPLETED'
+        future = Future()
+        try:
+            if cacheable and default_storage.exists(path):
+                with default_storage.open(path) as cached:
+                    future.set_result(cached.read())
+                return sale, None, future
+            html_string = receipt_html(sale, self.organization, items)
+        except Exception as e:
+            future.set_exception(e)
+            return sale, None, future
+        try:
+            future = executor.submit(html_to_pdf, html_string, self.base_url)
+        except BrokenProcessPool:
+            # A worker of the shared pool died (in this export or another one)
+            if self.workers:
+                raise
+            self._executor = executor = shared_pool(broken=executor)
+            future = executor.submit(html_to_pdf, html_string, self.base_url)
+        return sale, path if cacheable else None, future
+
+    def _write(self, archive, entry):
+        sale, path, future = entry
+        error = None
+        try:
+            pdf_file = future.result()
+            archive.writestr(f'comprovante_venda_{sale.pk}.pdf', pdf_file)
+            if path:
+                store_receipt(path, pdf_file)
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+            self.failures.append((sale.pk, error))
+        self.done += 1
+        if self.progress:
+            self.progress(self.done, self.total, sale, error)
+
+    def _flush(self, stream):
+        data = stream.pop()
+        if data:
+            yield data
+
+    def __iter__(self):
+        self.total = self.sales.count()
+        stream = _ZipStream()
+        self._executor = _process_pool(self.workers) if self.workers else shared_pool()
+        in_flight = deque()
+        try:
+            with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for sale in self._queryset().iterator(chunk_size=200):
+                    in_flight.append(self._submit(self._executor, sale))
+                    if len(in_flight) >= self.window:
+                        self._write(archive, in_flight.popleft())
+                        yield from self._flush(stream)
+                while in_flight:
+                    self._write(archive, in_flight.popleft())
+                    yield from self._flush(stream)
+
+                if self.failures:
+                    report = '\n'.join(f'Venda #{pk}: {error}' for pk, error in self.failures)
+                    archive.writestr('erros.txt', report + '\n')
+            yield from self._flush(stream)
+        finally:
+            if self.workers:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+            else:
+                # Leave the shared pool running; drop what this export still had queued
+                for _, _, future in in_flight:
+                    future.cancel()
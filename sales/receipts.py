@@ -0,0 +1,109 @@
+import hashlib
+import shutil
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.template.loader import render_to_string
+
+RECEIPT_CACHE_DIR = 'receipts'
+
+# Organization fields printed on the receipt. Changing any of them changes
+# the branding fingerprint and therefore every cached receipt path.
+BRANDING_FIELDS = ('name', 'logo', 'cnpj', 'phone', 'email', 'address', 'pix_key', 'receipt_footer_text')
+
+
+def _digest(parts):
+    return hashlib.sha256('\x1f'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:16]
+
+
+def branding_fingerprint(organization):
+    parts = [getattr(organization, field) or '' for field in BRANDING_FIELDS]
+    if organization.logo:
+        # A logo replaced under the same file name still has to bust the cache
+        try:
+            parts.append(organization.logo.storage.get_modified_time(organization.logo.name).timestamp())
+        except (OSError, NotImplementedError):
+            pass
+    return _digest(parts)
+
+
+def sale_fingerprint(sale, items):
+    customer = sale.customer
+    seller = sale.seller
+    parts = [
+        sale.pk, sale.status, f'{sale.total:.2f}', sale.created_at.isoformat(),
+        customer.name, customer.email, customer.document, customer.phone,
+        customer.address, customer.city, customer.state,
+        seller.get_full_name(), seller.email,
+    ]
+    for item in items:
+        name = item.product.name if item.product else (item.service.name if item.service else '')
+        unit = item.product.unit if item.product else ''
+        parts.extend([item.pk, name, unit, item.quantity, f'{item.price:.2f}'])
+    return _digest(parts)
+
+
+def receipt_items(sale):
+    return list(sale.items.select_related('product', 'service').order_by('pk'))
+
+
+def receipt_key(sale, organization, items):
+    """Return (etag, storage path) identifying the receipt of a sale."""
+    branding = branding_fingerprint(organization)
+    content = sale_fingerprint(sale, items)
+    return f'"{branding}-{content}"', f'{RECEIPT_CACHE_DIR}/{branding}/{sale.pk}_{content}.pdf'
+
+
+def receipt_html(sale, organization, items):
+    return render_to_string('sales/pdf/receipt.html', {
+        'sale': sale,
+        'items': items,
+        'organization': organization,
+    })
+
+
+def html_to_pdf(html_string, base_url=None):
+    # Kept free of ORM access so it can run inside a process pool worker
+    import weasyprint
+    return weasyprint.HTML(string=html_string, base_url=base_url).write_pdf()
+
+
+def render_receipt_pdf(sale, organization, items, base_url=None):
+    return html_to_pdf(receipt_html(sale, organization, items), base_url=base_url)
+
+
+def store_receipt(path, pdf_file):
+    saved = default_storage.save(path, ContentFile(pdf_file))
+    if saved != path:
+        # Another request stored the same receipt first
+        default_storage.delete(saved)
+
+
+def cached_receipt_path(sale, organization, items, path, base_url=None):
+    """
+    Return the storage path of a finalized sale receipt, rendering it only once.
+
+    Only completed sales are stored: pending sales can still change and are
+    rendered on every download.
+    """
+    if not default_storage.exists(path):
+        store_receipt(path, render_receipt_pdf(sale, organization, items, base_url=base_url))
+    return path
+
+
+def purge_stale_receipts(organization):
+    """Remove cached receipts rendered with a previous organization branding."""
+    if not default_storage.exists(RECEIPT_CACHE_DIR):
+        return
+    current = branding_fingerprint(organization)
+    directories, _ = default_storage.listdir(RECEIPT_CACHE_DIR)
+    for directory in directories:
+        if directory == current:
+            continue
+        name = f'{RECEIPT_CACHE_DIR}/{directory}'
+        try:
+            shutil.rmtree(default_storage.path(name))
+        except NotImplementedError:
+            for filename in default_storage.listdir(name)[1]:
+                default_storage.delete(f'{name}/{filename}')
+        except FileNotFoundError:
+            pass
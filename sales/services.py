@@ -0,0 +1,359 @@
+import datetime
+from collections import defaultdict
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q, Case, DecimalField, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from core.versions import invalidate
+from dashboard.rollups import cash_state, record_cash, record_sales
+from finance.models import Transaction
+from inventory.models import Product, Service
+from inventory.stock import move_stock
+from jobs.queue import enqueue
+from .models import Customer, Sale, SaleItem
+from .tasks import render_receipt
+
+
+def _parse_date(value):
+    try:
+        return parse_date(value or '')
+    except ValueError:
+        return None
+
+
+def _start_of_day(value):
+    return timezone.make_aware(datetime.datetime.combine(value, datetime.time.min))
+
+
+def filter_sales(queryset, params):
+    """Apply the sale list filters (status, seller, customer, date range) from a QueryDict."""
+    status = params.get('status')
+    if status in dict(Sale.STATUS_CHOICES):
+        queryset = queryset.filter(status=status)
+
+    seller = params.get('seller')
+    if seller and seller.isdigit():
+        queryset = queryset.filter(seller_id=seller)
+
+    customer = params.get('customer')
+    if customer and customer.isdigit():
+        queryset = queryset.filter(customer_id=customer)
+
+    # Compare against day boundaries instead of created_at__date so the
+    # (created_at, id) index can still be used for the range.
+    date_from = _parse_date(params.get('date_from'))
+    if date_from:
+        queryset = queryset.filter(created_at__gte=_start_of_day(date_from))
+
+    date_to = _parse_date(params.get('date_to'))
+    if date_to:
+        queryset = queryset.filter(created_at__lt=_start_of_day(date_to + datetime.timedelta(days=1)))
+
+    return queryset
+
+
+CUSTOMER_SEARCH_LIMIT = 20
+
+
+def search_customers(query, limit=CUSTOMER_SEARCH_LIMIT):
+    """
+    Typeahead search of customers by name, CPF/CNPJ or phone.
+
+    Prefix matches come first and are served by the prefix indexes of the
+    sales migrations. Only when they do not fill the limit does it fall back
+    to a substring search on the name (trigram indexed when pg_trgm exists).
+    """
+    query = (query or '').strip()
+    if not query:
+        return []
+
+    fields = ('id', 'name', 'document', 'phone')
+    prefix = Q(name__istartswith=query) | Q(document__startswith=query) | Q(phone__startswith=query)
+    results = list(Customer.objects.filter(prefix).order_by('name', 'id').only(*fields)[:limit])
+    if len(results) < limit and len(query) >= 3:
+        results += list(
+            Customer.objects.filter(name__icontains=query)
+            .exclude(pk__in=[customer.pk for customer in results])
+            .order_by('name', 'id').only(*fields)[:limit - len(results)]
+        )
+    return results
+
+
+CATALOG_SEARCH_LIMIT = 20
+
+
+def _ranked(queryset, prefix, fields):
+    """Order a catalog queryset by match quality: prefix matches first, then substring matches."""
+    rank = Case(When(prefix, then=Value(0)), default=Value(1), output_field=IntegerField())
+    return queryset.annotate(rank=rank).order_by('rank', 'name', 'id').values('rank', *fields)
+
+
+def _product_result(row):
+    row['stock'] = row.pop('on_hand')
+    return dict(row, kind='product')
+
+
+def search_catalog(query, limit=CATALOG_SEARCH_LIMIT):
+    """
+    Item picker search over products and services.
+
+    Returns (exact, results). A query equal to a product SKU (what a barcode
+    scanner types) is answered with that single product through the unique
+    sku index and exact=True. Otherwise products and services are searched by
+    name (and products by SKU prefix), prefix matches ranked first. Every
+    result is a dict with kind, id, name, price and, for products, sku, unit
+    and the available stock.
+    """
+    query = (query or '').strip()
+    if not query:
+        return False, []
+
+    product_fields = ('id', 'name', 'sku', 'price', 'on_hand', 'unit')
+    catalog = Product.objects.with_on_hand()
+    product = catalog.filter(sku=query).values(*product_fields).first()
+    if product:
+        return True, [_product_result(product)]
+
+    product_prefix = Q(sku__startswith=query) | Q(name__istartswith=query)
+    service_prefix = Q(name__istartswith=query)
+    if len(query) >= 3:
+        product_match = product_prefix | Q(name__icontains=query)
+        service_match = Q(name__icontains=query)
+    else:
+        product_match, service_match = product_prefix, service_prefix
+
+    products = _ranked(catalog.filter(product_match), product_prefix, product_fields)[:limit]
+    services = _ranked(Service.objects.filter(service_match), service_prefix, ('id', 'name', 'price'))[:limit]
+    results = [_product_result(row) for row in products] + [dict(row, kind='service') for row in services]
+    results.sort(key=lambda row: (row['rank'], row['name'].lower()))
+    return False, results[:limit]
+
+
+def apply_total_delta(sale, delta):
+    """Add delta to Sale.total in the database and refresh the instance."""
+    Sale.objects.filter(pk=sale.pk).update(total=F('total') + delta)
+    invalidate(Sale)
+    sale.refresh_from_db(fields=['total'])
+
+
+def _items_total():
+    """Subquery computing the sum of price * quantity of the outer sale's items."""
+    totals = SaleItem.objects.filter(sale=OuterRef('pk')).values('sale').annotate(
+        items_total=Sum(F('price') * F('quantity'), output_field=DecimalField(max_digits=10, decimal_places=2))
+    ).values('items_total')
+    return Coalesce(Subquery(totals), Value(0), output_field=DecimalField(max_digits=10, decimal_places=2))
+
+
+def verify_sale_totals(fix=False):
+    """
+    Find sales whose stored total differs from the sum of their items.
+
+    Returns a list of (sale_id, status, stored_total, items_total). With
+    fix=True the drifted PENDING sales are corrected in a single UPDATE;
+    completed or canceled sales are only reported because their total is
+    already recorded in finance.Transaction.
+    """
+    drifted = list(
+        Sale.objects.annotate(items_total=_items_total())
+        .exclude(total=F('items_total'))
+        .order_by('pk')
+        .values_list('pk', 'status', 'total', 'items_total')
+    )
+    if fix:
+        pending_ids = [pk for pk, status, _, _ in drifted if status == 'PENDING']
+        if pending_ids:
+            Sale.objects.filter(pk__in=pending_ids).update(total=_items_total())
+            invalidate(Sale)
+    return drifted
+
+
+def _parse_cart_line(index, line):
+    if not isinstance(line, dict):
+        raise ValidationError(f'Linha {index}: formato inválido.')
+    product_id, service_id = line.get('product') or None, line.get('service') or None
+    if bool(product_id) == bool(service_id):
+        raise ValidationError(f'Linha {index}: informe um produto ou um serviço.')
+    try:
+        quantity = int(line.get('quantity', 1))
+        item_id = int(product_id or service_id)
+    except (TypeError, ValueError):
+        raise ValidationError(f'Linha {index}: quantidade ou item inválido.')
+    if quantity < 1:
+        raise ValidationError(f'Linha {index}: a quantidade deve ser maior que zero.')
+    return ('product' if product_id else 'service'), item_id, quantity
+
+
+def add_items(sale, lines):
+    """
+    Add a whole cart of {'product'|'service': id, 'quantity': n} lines to a sale.
+
+    Products and services are loaded with one query each, stock is checked
+    for the cart as a whole, the items are inserted with a single
+    bulk_create and the total is updated once. Raises ValidationError with
+    every problem found; nothing is written in that case.
+    """
+    errors = []
+    parsed = []
+    for index, line in enumerate(lines, start=1):
+        try:
+            parsed.append(_parse_cart_line(index, line))
+        except ValidationError as e:
+            errors.extend(e.messages)
+    if not parsed and not errors:
+        errors.append('O carrinho está vazio.')
+
+    products = Product.objects.with_on_hand().in_bulk([item_id for kind, item_id, _ in parsed if kind == 'product'])
+    services = Service.objects.in_bulk([item_id for kind, item_id, _ in parsed if kind == 'service'])
+
+    requested = {}
+    items = []
+    for kind, item_id, quantity in parsed:
+        catalog = products if kind == 'product' else services
+        if item_id not in catalog:
+            errors.append(f'{"Produto" if kind == "product" else "Serviço"} #{item_id} não encontrado.')
+            continue
+        item = catalog[item_id]
+        if kind == 'product':
+            requested[item_id] = requested.get(item_id, 0) + quantity
+        items.append(SaleItem(sale=sale, quantity=quantity, price=item.price, **{kind: item}))
+
+    for product_id, quantity in requested.items():
+        product = products[product_id]
+        if product.available_stock < quantity:
+            errors.append(f'Estoque insuficiente para {product.name}. Disponível: {product.available_stock}')
+
+    if errors:
+        raise ValidationError(errors)
+
+    with transaction.atomic():
+        if Sale.objects.select_for_update().get(pk=sale.pk).status != 'PENDING':
+            raise ValidationError('Não é possível adicionar itens a uma venda finalizada.')
+        SaleItem.objects.bulk_create(items)
+        apply_total_delta(sale, sum(item.subtotal for item in items))
+    return items
+
+
+def _product_quantities(sale):
+    """Return {product_id: total quantity} for the product lines of a sale."""
+    rows = sale.items.filter(product__isnull=False).values('product').annotate(quantity=Sum('quantity'))
+    return {row['product']: row['quantity'] for row in rows}
+
+
+def deduct_stock(sale, quantities):
+    """Take {product_id: quantity} of a sale out of stock. Must run inside a transaction."""
+    move_stock([(pk, -quantity, sale.pk) for pk, quantity in quantities.items()], 'SALE')
+
+
+def delete_sale(sale):
+    """Delete a sale; a completed one puts its stock back and drops its transactions first."""
+    with transaction.atomic():
+        sale = Sale.objects.select_for_update().get(pk=sale.pk)
+        if sale.status == 'COMPLETED':
+            quantities = _product_quantities(sale)
+            record_sales([sale.pk], quantities, sign=-1)
+            move_stock(
+                [(pk, quantity, None) for pk, quantity in quantities.items()],
+                'RETURN', note=f'Exclusão da venda #{sale.pk}',
+            )
+            sale.transactions.all().delete()
+        sale.delete()
+
+
+def cancel_sales(sale_ids):
+    """
+    Cancel every sale in sale_ids that is not canceled yet and return their ids.
+
+    All the sales are locked first. Completed sales give their products back
+    to stock with one aggregated UPDATE; their paid income is reversed with
+    an EXPENSE transaction and income still pending is marked as canceled,
+    so the financial history is kept. Completed sales also leave the
+    dashboard chart rollups.
+    """
+    today = timezone.now().date()
+    with transaction.atomic():
+        sales = list(
+            Sale.objects.select_for_update().filter(pk__in=sale_ids)
+            .exclude(status='CANCELED').order_by('pk').values_list('pk', 'status')
+        )
+        canceled = [pk for pk, _ in sales]
+        completed = [pk for pk, status in sales if status == 'COMPLETED']
+        if not canceled:
+            return []
+
+        rows = list(
+            SaleItem.objects.filter(sale__in=completed, product__isnull=False)
+            .values('sale', 'product').annotate(quantity=Sum('quantity')).order_by('sale', 'product')
+        )
+        move_stock([(row['product'], row['quantity'], row['sale']) for row in rows], 'RETURN')
+
+        returned = defaultdict(int)
+        for row in rows:
+            returned[row['product']] += row['quantity']
+        record_sales(completed, returned, sign=-1)
+
+        income = Transaction.objects.select_for_update().filter(sale__in=canceled, type='INCOME')
+        reversals = Transaction.objects.bulk_create([
+            Transaction(
+                description=f'Estorno da Venda #{paid.sale_id}',
+                amount=paid.amount,
+                type='EXPENSE',
+                status='PAID',
+                due_date=today,
+                paid_date=today,
+                sale_id=paid.sale_id,
+            )
+            for paid in income.filter(status='PAID').order_by('pk')
+        ])
+        # bulk_create sends no post_save
+        record_cash(added=[cash_state(reversal) for reversal in reversals])
+        income.filter(status='PENDING').update(status='CANCELED')
+
+        Sale.objects.filter(pk__in=canceled).update(status='CANCELED')
+        invalidate(Sale, Transaction)
+    return canceled
+
+
+def cancel_sale(sale):
+    """Cancel a single sale. Raises ValueError when it is already canceled."""
+    if not cancel_sales([sale.pk]):
+        raise ValueError('Esta venda já está cancelada.')
+    sale.refresh_from_db(fields=['status'])
+    return sale
+
+
+def finalize_sale(sale):
+    """
+    Deduct stock, register the income transaction and mark the sale as completed.
+
+    Raises ValueError (InsufficientStockError for stock problems) and leaves
+    the database untouched when the sale cannot be finalized.
+    """
+    with transaction.atomic():
+        # Lock the sale first so the same sale cannot be finalized twice
+        sale = Sale.objects.select_for_update().select_related('customer').get(pk=sale.pk)
+        if sale.status != 'PENDING':
+            raise ValueError('Esta venda já foi finalizada.')
+
+        quantities = _product_quantities(sale)
+        deduct_stock(sale, quantities)
+        record_sales([sale.pk], quantities)
+
+        today = timezone.now().date()
+        Transaction.objects.create(
+            description=f"Venda #{sale.id} - {sale.customer.name}",
+            amount=sale.total,
+            type='INCOME',
+            status='PAID',
+            due_date=today,
+            paid_date=today,
+            sale=sale
+        )
+
+        sale.status = 'COMPLETED'
+        sale.save(update_fields=['status'])
+
+        # Queued in the same transaction: the receipt is pre-rendered only if the sale commits
+        enqueue(render_receipt, sale.pk)
+    return sale
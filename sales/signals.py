@@ -0,0 +1,15 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from core.versions import track_writes
+from dashboard.models import Organization, User
+from .models import Customer, Sale
+from .receipts import purge_stale_receipts
+
+track_writes(Sale)
+track_writes(Customer)
+track_writes(User)
+
+@receiver(post_save, sender=Organization)
+def organization_saved(sender, instance, **kwargs):
+    # Receipts embed the organization branding (logo, footer, contact data)
+    purge_stale_receipts(instance)
@@ -0,0 +1,15 @@
+from django.urls import reverse
+from dashboard.models import Organization
+from .models import Sale
+from .receipts import cached_receipt_path, receipt_items, receipt_key
+
+
+def render_receipt(sale_id):
+    """Background job: render a finalized receipt into the PDF cache ahead of the first download."""
+    sale = Sale.objects.select_related('customer', 'seller').get(pk=sale_id)
+    if sale.status == 'COMPLETED':
+        organization = Organization.load()
+        items = receipt_items(sale)
+        _, path = receipt_key(sale, organization, items)
+        cached_receipt_path(sale, organization, items, path)
+    return {'url': reverse('sale_receipt_pdf', args=[sale_id]), 'label': 'Baixar Comprovante'}
@@ -1,9 +1,33 @@
-from django.test import TestCase, Client
+import datetime
+import os
+import shutil
+import tempfile
+import json
+import threading
+import time
+import zipfile
+from io import BytesIO
+from unittest import mock
+from decimal import Decimal
+import unittest
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from django.contrib.auth import get_user_model
-from inventory.models import Product, Supplier
+from core.models import DataVersion
+from core.versions import forget_data_versions
+from inventory.catalog import catalog_objects
+from inventory.models import Product, Service, Supplier
 from sales.models import Sale, SaleItem, Customer
 from finance.models import Transaction
+from dashboard.models import Organization
+from sales.views import SALE_PAGE_SIZE
+from sales.services import apply_total_delta, cancel_sales, finalize_sale, verify_sale_totals, search_catalog, CUSTOMER_SEARCH_LIMIT
+from sales import receipt_export
+from sales.receipt_export import ReceiptExport
+from sales.receipts import receipt_items, receipt_key, store_receipt
 
 User = get_user_model()
 
@@ -76,3 +100,642 @@ class SaleFlowTests(TestCase):
         
         messages = list(response.context['messages'])
         self.assertTrue(any('Estoque insuficiente' in str(m) for m in messages))
+
+    def test_finalize_sale_reports_every_short_item(self):
+        other = Product.objects.create(name='Other Product', sku='OTHER-SKU', price=10.00, stock=1)
+        SaleItem.objects.create(sale=self.sale, product=self.product, quantity=6, price=100.00)
+        SaleItem.objects.create(sale=self.sale, product=self.product, quantity=6, price=100.00)
+        SaleItem.objects.create(sale=self.sale, product=other, quantity=2, price=10.00)
+
+        response = self.client.post(reverse('sale_finalize', args=[self.sale.pk]), follow=True)
+
+        errors = [str(m) for m in response.context['messages']]
+        self.assertEqual(len(errors), 1)
+        self.assertIn('Test Product (disponível: 10, solicitado: 12)', errors[0])
+        self.assertIn('Other Product (disponível: 1, solicitado: 2)', errors[0])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+        self.assertFalse(Transaction.objects.filter(sale=self.sale).exists())
+
+class SaleCancelTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='cancel@example.com', password='password', role='ADMIN')
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.customer = Customer.objects.create(name='Cancel Customer')
+        self.pen = Product.objects.create(name='Pen', sku='CANCEL-PEN', price=2.00, stock=20)
+        self.ink = Product.objects.create(name='Ink', sku='CANCEL-INK', price=5.00, stock=20)
+
+    def completed_sale(self):
+        sale = Sale.objects.create(customer=self.customer, seller=self.user, total=Decimal('13.00'))
+        SaleItem.objects.bulk_create([
+            SaleItem(sale=sale, product=self.pen, quantity=2, price=2.00),
+            SaleItem(sale=sale, product=self.pen, quantity=2, price=2.00),
+            SaleItem(sale=sale, product=self.ink, quantity=1, price=5.00),
+        ])
+        with mock.patch('sales.services.enqueue'):
+            finalize_sale(sale)
+        return sale
+
+    def test_cancel_restores_stock_and_reverses_income(self):
+        sale = self.completed_sale()
+        response = self.client.post(reverse('sale_cancel', args=[sale.pk]), HTTP_HX_REQUEST='true')
+        self.assertContains(response, f'<tr id="sale-{sale.pk}" hx-swap-oob="true"')
+
+        sale.refresh_from_db()
+        self.pen.refresh_from_db()
+        self.ink.refresh_from_db()
+        self.assertEqual(sale.status, 'CANCELED')
+        self.assertEqual((self.pen.stock, self.ink.stock), (20, 20))
+        self.assertEqual(
+            sorted(sale.transactions.values_list('type', 'status', 'amount')),
+            [('EXPENSE', 'PAID', Decimal('13.00')), ('INCOME', 'PAID', Decimal('13.00'))],
+        )
+
+        # Cancelling again changes nothing
+        self.client.post(reverse('sale_cancel', args=[sale.pk]))
+        self.pen.refresh_from_db()
+        self.assertEqual(self.pen.stock, 20)
+        self.assertEqual(sale.transactions.count(), 2)
+
+    def test_bulk_cancel(self):
+        sales = [self.completed_sale() for _ in range(3)]
+        pending = Sale.objects.create(customer=self.customer, seller=self.user)
+        Transaction.objects.create(description='A receber', amount=10, type='INCOME', status='PENDING',
+                                   due_date=datetime.date.today(), sale=pending)
+        ids = [sale.pk for sale in sales] + [pending.pk]
+
+        self.assertEqual(cancel_sales(ids[:2]), ids[:2])
+        response = self.client.post(reverse('sale_bulk_cancel'), {'sale_ids': ids}, HTTP_HX_REQUEST='true')
+        self.assertContains(response, '2 vendas canceladas com sucesso.')
+        self.assertContains(response, f'<tr id="sale-{pending.pk}" hx-swap-oob="true"')
+
+        self.assertEqual(Sale.objects.filter(pk__in=ids, status='CANCELED').count(), 4)
+        self.pen.refresh_from_db()
+        self.assertEqual(self.pen.stock, 20)
+        self.assertEqual(Transaction.objects.get(sale=pending).status, 'CANCELED')
+        self.assertEqual(Transaction.objects.filter(type='EXPENSE').count(), 3)
+
+    def test_bulk_cancel_queries_do_not_grow_with_the_batch(self):
+        # savepoint, lock sales, aggregate quantities, lock + restock products,
+        # stock movements, daily rollup (2 aggregates, insert, lock, update),
+        # product rollup (insert, lock, update), paid income, reversals, cash
+        # rollup (insert, lock, update), pending income, sale status, release:
+        # the same statements whatever the number of sales
+        def cancel_queries(count):
+            ids = [self.completed_sale().pk for _ in range(count)]
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(cancel_sales(ids), ids)
+            return len(queries)
+
+        self.assertEqual(cancel_queries(1), cancel_queries(4))
+
+    def test_canceled_sale_is_read_only(self):
+        sale = self.completed_sale()
+        self.client.post(reverse('sale_cancel', args=[sale.pk]))
+        self.client.post(reverse('sale_add_item', args=[sale.pk]), {'product': self.pen.pk, 'quantity': 1})
+        self.assertEqual(sale.items.count(), 3)
+
+class SaleTotalTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='total@example.com', password='password')
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.customer = Customer.objects.create(name='Total Customer')
+        self.product = Product.objects.create(name='Total Product', sku='TOTAL-SKU', price=12.50, stock=100)
+        self.sale = Sale.objects.create(customer=self.customer, seller=self.user)
+
+    def test_add_and_remove_item_keep_total_in_sync(self):
+        self.client.post(reverse('sale_add_item', args=[self.sale.pk]), {'product': self.product.pk, 'quantity': 2})
+        self.client.post(reverse('sale_add_item', args=[self.sale.pk]), {'product': self.product.pk, 'quantity': 3})
+        self.sale.refresh_from_db()
+        self.assertEqual(self.sale.total, Decimal('62.50'))
+
+        item = self.sale.items.first()
+        self.client.post(reverse('sale_remove_item', args=[self.sale.pk, item.pk]))
+        self.sale.refresh_from_db()
+        self.assertEqual(self.sale.total, Decimal('37.50'))
+        self.assertEqual(verify_sale_totals(), [])
+
+    def test_item_removed_by_a_concurrent_request_is_not_subtracted_twice(self):
+        self.client.post(reverse('sale_add_item', args=[self.sale.pk]), {'product': self.product.pk, 'quantity': 2})
+        item = self.sale.items.get()
+
+        def stale_lookup(klass, **kwargs):
+            # The other request deleted the item and took its subtotal off after this one loaded it
+            obj = get_object_or_404(klass, **kwargs)
+            if klass is SaleItem:
+                SaleItem.objects.filter(pk=obj.pk).delete()
+                apply_total_delta(self.sale, -obj.subtotal)
+            return obj
+
+        with mock.patch('sales.views.get_object_or_404', side_effect=stale_lookup):
+            self.client.post(reverse('sale_remove_item', args=[self.sale.pk, item.pk]))
+        self.sale.refresh_from_db()
+        self.assertEqual(self.sale.total, Decimal('0'))
+
+    def test_add_item_rechecks_the_status_under_lock(self):
+        def stale_lookup(klass, **kwargs):
+            # Finalized by another request after this one loaded the sale
+            obj = get_object_or_404(klass, **kwargs)
+            Sale.objects.filter(pk=obj.pk).update(status='COMPLETED')
+            return obj
+
+        with mock.patch('sales.views.get_object_or_404', side_effect=stale_lookup):
+            self.client.post(reverse('sale_add_item', args=[self.sale.pk]), {'product': self.product.pk, 'quantity': 2})
+        self.sale.refresh_from_db()
+        self.assertFalse(self.sale.items.exists())
+        self.assertEqual(self.sale.total, Decimal('0'))
+
+    def test_verify_sale_totals_fixes_pending_drift_only(self):
+        SaleItem.objects.create(sale=self.sale, product=self.product, quantity=2, price=12.50)
+        completed = Sale.objects.create(customer=self.customer, seller=self.user, status='COMPLETED', total=99)
+        empty = Sale.objects.create(customer=self.customer, seller=self.user)
+
+        drifted = verify_sale_totals(fix=True)
+
+        self.assertEqual([row[0] for row in drifted], [self.sale.pk, completed.pk])
+        self.sale.refresh_from_db()
+        completed.refresh_from_db()
+        empty.refresh_from_db()
+        self.assertEqual(self.sale.total, Decimal('25.00'))
+        self.assertEqual(completed.total, Decimal('99'))
+        self.assertEqual(empty.total, Decimal('0'))
+
+class CustomerSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='search@example.com', password='password')
+        self.client = Client()
+        self.client.force_login(self.user)
+        Customer.objects.bulk_create([Customer(name=f'Cliente {i:03d}', phone=f'1190000{i:04d}') for i in range(50)])
+        self.maria = Customer.objects.create(name='Maria Silva', document='12345678900', phone='11988887777')
+        self.joao = Customer.objects.create(name='João da Silva', document='98765432100')
+
+    def search(self, query):
+        response = self.client.get(reverse('customer_search'), {'q': query})
+        return [result['name'] for result in response.json()['results']]
+
+    def test_prefix_matches_name_document_and_phone(self):
+        self.assertEqual(self.search('mar'), ['Maria Silva'])
+        self.assertEqual(self.search('98765'), ['João da Silva'])
+        self.assertEqual(self.search('119888'), ['Maria Silva'])
+
+    def test_prefix_matches_come_before_substring_matches(self):
+        silva = Customer.objects.create(name='Silva Comércio')
+        self.assertEqual(self.search('silva'), [silva.name, 'João da Silva', 'Maria Silva'])
+
+    def test_results_are_limited(self):
+        self.assertEqual(len(self.search('cliente')), CUSTOMER_SEARCH_LIMIT)
+        self.assertEqual(self.search(''), [])
+
+    def test_sale_form_does_not_embed_customers(self):
+        response = self.client.get(reverse('sale_create'), HTTP_HX_REQUEST='true')
+        self.assertNotContains(response, 'Cliente 001')
+        self.assertContains(response, reverse('customer_search'))
+
+        sale = Sale.objects.create(customer=self.maria, seller=self.user)
+        response = self.client.get(reverse('sale_update', args=[sale.pk]), HTTP_HX_REQUEST='true')
+        self.assertContains(response, 'Maria Silva')
+        self.assertNotContains(response, 'João da Silva')
+
+class CatalogSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='catalog@example.com', password='password')
+        self.client = Client()
+        self.client.force_login(self.user)
+        Product.objects.bulk_create([
+            Product(name=f'Produto {i:03d}', sku=f'789000{i:04d}', price=10.00, stock=i) for i in range(50)
+        ])
+        self.caneta = Product.objects.create(name='Caneta Azul', sku='7891234567890', price=2.50, stock=30)
+        self.conserto = Service.objects.create(name='Conserto de Caneta', price=40.00)
+        self.customer = Customer.objects.create(name='Catalog Customer')
+
+    def search(self, query):
+        response = self.client.get(reverse('sale_item_search'), {'q': query})
+        return response.json()
+
+    def test_exact_sku_is_a_single_indexed_lookup(self):
+        with self.assertNumQueries(1):
+            exact, results = search_catalog('7891234567890')
+        self.assertTrue(exact)
+        self.assertEqual(results, [{
+            'id': self.caneta.pk, 'name': 'Caneta Azul', 'sku': '7891234567890',
+            'price': Decimal('2.50'), 'stock': 30, 'unit': 'UN', 'kind': 'product',
+        }])
+
+    def test_name_search_ranks_prefix_matches_first_across_products_and_services(self):
+        data = self.search('caneta')
+        self.assertFalse(data['exact'])
+        self.assertEqual(
+            [(result['kind'], result['name']) for result in data['results']],
+            [('product', 'Caneta Azul'), ('service', 'Conserto de Caneta')],
+        )
+        self.assertEqual(data['results'][0]['stock'], 30)
+        self.assertEqual(len(self.search('produto')['results']), 20)
+
+    def test_sale_detail_does_not_embed_the_catalog(self):
+        sale = Sale.objects.create(customer=self.customer, seller=self.user)
+        response = self.client.get(reverse('sale_detail', args=[sale.pk]))
+        self.assertNotContains(response, 'Produto 001')
+        self.assertContains(response, reverse('sale_item_search'))
+
+    def test_scanned_sku_adds_the_product(self):
+        sale = Sale.objects.create(customer=self.customer, seller=self.user)
+        response = self.client.post(
+            reverse('sale_add_item', args=[sale.pk]), {'sku': '7891234567890', 'quantity': 2}, HTTP_HX_REQUEST='true'
+        )
+        self.assertContains(response, 'Caneta Azul')
+        sale.refresh_from_db()
+        self.assertEqual(sale.total, Decimal('5.00'))
+
+        response = self.client.post(
+            reverse('sale_add_item', args=[sale.pk]), {'sku': '0000', 'quantity': 1}, HTTP_HX_REQUEST='true'
+        )
+        self.assertContains(response, 'Nenhum produto com o SKU 0000.')
+        self.assertEqual(sale.items.count(), 1)
+
+class SaleBulkAddItemsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='cart@example.com', password='password')
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.customer = Customer.objects.create(name='Cart Customer')
+        self.products = [
+            Product.objects.create(name=f'Cart Product {i}', sku=f'CART-{i}', price=10.00, stock=5)
+            for i in range(30)
+        ]
+        self.service = Service.objects.create(name='Installation', price=50.00)
+        self.sale = Sale.objects.create(customer=self.customer, seller=self.user)
+
+    def post_cart(self, lines):
+        return self.client.post(
+            reverse('sale_add_items', args=[self.sale.pk]),
+            data=json.dumps({'items': lines}),
+            content_type='application/json',
+        )
+
+    def test_whole_cart_is_added_in_one_request(self):
+        lines = [{'product': product.pk, 'quantity': 2} for product in self.products]
+        lines.append({'service': self.service.pk, 'quantity': 1})
+
+        # Session, user, sale, products, services, then the locked insert and total update:
+        # the count does not grow with the number of lines
+        with self.assertNumQueries(11):
+            response = self.post_cart(lines)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['added'], 31)
+        self.sale.refresh_from_db()
+        self.assertEqual(self.sale.items.count(), 31)
+        self.assertEqual(self.sale.total, Decimal('650.00'))
+
+    def test_every_problem_is_reported_and_nothing_is_added(self):
+        response = self.post_cart([
+            {'product': self.products[0].pk, 'quantity': 3},
+            {'product': self.products[0].pk, 'quantity': 3},
+            {'product': 999999, 'quantity': 1},
+            {'product': self.products[1].pk, 'service': self.service.pk},
+            {'service': self.service.pk, 'quantity': 0},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertEqual(len(errors), 4)
+        self.assertIn('Estoque insuficiente para Cart Product 0. Disponível: 5', errors)
+        self.assertFalse(self.sale.items.exists())
+
+    def test_htmx_cart_form_rerenders_items_once(self):
+        cart = json.dumps([{'product': self.products[0].pk, 'quantity': 1}])
+        response = self.client.post(reverse('sale_add_items', args=[self.sale.pk]), {'cart': cart}, HTTP_HX_REQUEST='true')
+
+        self.assertTemplateUsed(response, 'sales/partials/sale_items.html')
+        self.assertContains(response, 'Cart Product 0')
+
+    def test_only_the_services_in_the_cart_are_loaded(self):
+        Service.objects.bulk_create([Service(name=f'Other Service {i}', price=1.00) for i in range(50)])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_cart([{'service': self.service.pk, 'quantity': 1}])
+        self.assertEqual(response.json()['added'], 1)
+        services = [query['sql'] for query in queries.captured_queries if 'FROM "inventory_service"' in query['sql']]
+        self.assertEqual(len(services), 1)
+        self.assertIn(f'IN ({self.service.pk})', services[0])
+
+class SaleQueryCountTests(TestCase):
+    """Rendering a sale must cost the same number of queries regardless of how many items it has."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='queries@example.com', password='password')
+        self.client = Client()
+        self.client.force_login(self.user)
+        Organization.load()
+        customer = Customer.objects.create(name='Query Customer')
+        products = Product.objects.bulk_create([
+            Product(name=f'Query Product {i}', sku=f'QRY-{i}', price=1.00, stock=1000) for i in range(100)
+        ])
+        self.service = Service.objects.create(name='Query Service', price=5.00)
+        self.sale = Sale.objects.create(customer=customer, seller=self.user, status='COMPLETED')
+        SaleItem.objects.bulk_create(
+            [SaleItem(sale=self.sale, product=product, quantity=2, price=1.00) for product in products] +
+            [SaleItem(sale=self.sale, service=self.service, quantity=1, price=5.00) for _ in range(100)]
+        )
+
+    def test_sale_detail(self):
+        # session, user, sale + customer + seller, items + product + service;
+        # the organization is cached and the item picker does not load the catalog
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('sale_detail', args=[self.sale.pk]))
+        self.assertContains(response, 'Query Product 99 (Produto)')
+
+    def test_sale_items_partial(self):
+        Sale.objects.filter(pk=self.sale.pk).update(status='PENDING')
+        catalog_objects(Service)
+        # session, user, sale, service existence check (model validation),
+        # savepoint, locked sale, item insert, total update and refresh,
+        # release, items + product + service; the service itself comes from
+        # the catalog cache and the organization is only read if a template uses it
+        with self.assertNumQueries(11):
+            response = self.client.post(
+                reverse('sale_add_item', args=[self.sale.pk]), {'service': self.service.pk, 'quantity': 1}, HTTP_HX_REQUEST='true'
+            )
+        self.assertContains(response, 'Item adicionado com sucesso.')
+        self.assertContains(response, 'Query Service (Serviço)', count=101)
+        self.assertEqual(self.sale.items.count(), 201)
+
+    @mock.patch('sales.views.render_receipt_pdf', return_value=b'%PDF')
+    def test_receipt(self, render):
+        self.sale.status = 'PENDING'
+        self.sale.save()
+        # session, user, sale + customer + seller, items + product + service;
+        # the organization comes from the cache
+        with self.assertNumQueries(4):
+            self.client.get(reverse('sale_receipt_pdf', args=[self.sale.pk]))
+        self.assertEqual(len(render.call_args.args[2]), 200)
+
+class SaleReceiptCacheTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(email='receipt@example.com', password='password')
+        self.client = Client()
+        self.client.force_login(self.user)
+        customer = Customer.objects.create(name='Receipt Customer')
+        product = Product.objects.create(name='Receipt Product', sku='RCPT-SKU', price=10.00, stock=10)
+        self.sale = Sale.objects.create(customer=customer, seller=self.user, status='COMPLETED', total=20)
+        SaleItem.objects.create(sale=self.sale, product=product, quantity=2, price=10.00)
+
+        patcher = mock.patch('sales.receipts.render_receipt_pdf', return_value=b'%PDF-1.4 receipt')
+        self.render = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def download(self, **headers):
+        return self.client.get(reverse('sale_receipt_pdf', args=[self.sale.pk]), **headers)
+
+    def test_completed_receipt_is_rendered_once_and_revalidated(self):
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4 receipt')
+        etag = response['ETag']
+
+        self.assertEqual(self.download(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.download(HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.download().status_code, 200)
+        self.assertEqual(self.render.call_count, 1)
+
+    def test_branding_change_invalidates_cached_receipts(self):
+        etag = self.download()['ETag']
+
+        organization = Organization.load()
+        organization.receipt_footer_text = 'Novo rodapé'
+        organization.save()
+
+        response = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.render.call_count, 2)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'receipts'))), 1)
+
+class SaleCsvExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='csv@example.com', password='password', role='ADMIN')
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.customer = Customer.objects.create(name='Cliente CSV', document='123')
+        product = Product.objects.create(name='Caneta', sku='CSV-1', price=Decimal('2.50'), stock=10)
+        service = Service.objects.create(name='Entrega', price=Decimal('5.00'))
+        self.sale = Sale.objects.create(customer=self.customer, seller=self.user, total=Decimal('10.00'))
+        SaleItem.objects.create(sale=self.sale, product=product, quantity=2, price=Decimal('2.50'))
+        SaleItem.objects.create(sale=self.sale, service=service, quantity=1, price=Decimal('5.00'))
+        self.empty = Sale.objects.create(customer=self.customer, seller=self.user, status='CANCELED')
+
+    def read(self, response):
+        chunks = list(response.streaming_content)
+        return chunks, b''.join(chunks).decode('utf-8-sig').splitlines()
+
+    def test_streams_one_line_per_item_with_the_list_filters(self):
+        response = self.client.get(reverse('sale_export'), {'status': 'PENDING'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        chunks, lines = self.read(response)
+        # The header is sent on its own, before the sales are queried
+        self.assertTrue(chunks[0].decode('utf-8-sig').startswith('Venda,Data,Cliente'))
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].endswith('CSV-1,Caneta,2,2.50,5.00'))
+        self.assertTrue(lines[2].endswith(',Entrega,1,5.00,5.00'))
+
+        _, lines = self.read(self.client.get(reverse('sale_export'), {'status': 'CANCELED'}))
+        columns = lines[1].split(',')
+        self.assertEqual(columns[0], str(self.empty.pk))
+        self.assertEqual(columns[2:], ['Cliente CSV', 'csv@example.com', 'Cancelada', '0.00', '', '', '', '', ''])
+
+    def test_customer_export(self):
+        _, lines = self.read(self.client.get(reverse('customer_export')))
+        self.assertEqual(lines, ['Nome,Email,Telefone,CPF/CNPJ,Endereço,Cidade,Estado', 'Cliente CSV,,,123,,,'])
+
+    def test_exports_are_for_admins(self):
+        self.client.force_login(User.objects.create_user(email='seller@example.com', password='password'))
+        self.assertEqual(self.client.get(reverse('sale_export')).status_code, 302)
+
+
+class SaleReceiptExportTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.admin = User.objects.create_user(email='export@example.com', password='password', role='ADMIN')
+        self.client = Client()
+        self.client.force_login(self.admin)
+        customer = Customer.objects.create(name='Export Customer')
+        self.organization = Organization.load()
+        self.sales = [
+            Sale.objects.create(customer=customer, seller=self.admin, status='COMPLETED', total=0)
+            for _ in range(3)
+        ]
+        for sale in self.sales:
+            _, path = receipt_key(sale, self.organization, receipt_items(sale))
+            store_receipt(path, f'%PDF receipt {sale.pk}'.encode())
+
+    def test_export_streams_a_zip_with_every_receipt(self):
+        response = self.client.get(reverse('sale_receipts_export'), {'status': 'COMPLETED'})
+        self.assertEqual(response['Content-Type'], 'application/zip')
+
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(
+            sorted(archive.namelist()),
+            sorted(f'comprovante_venda_{sale.pk}.pdf' for sale in self.sales),
+        )
+        self.assertEqual(archive.read(f'comprovante_venda_{self.sales[0].pk}.pdf'), f'%PDF receipt {self.sales[0].pk}'.encode())
+
+    def test_failed_receipts_are_reported(self):
+        pending = Sale.objects.create(customer=self.sales[0].customer, seller=self.admin)
+        progress = []
+        export = ReceiptExport(Sale.objects.all(), self.organization, workers=1, progress=lambda *args: progress.append(args))
+
+        with mock.patch('sales.receipt_export.receipt_html', side_effect=ValueError('template error')):
+            archive = zipfile.ZipFile(BytesIO(b''.join(export)))
+
+        self.assertEqual(export.failures, [(pending.pk, 'template error')])
+        self.assertIn(f'Venda #{pending.pk}: template error', archive.read('erros.txt').decode())
+        self.assertEqual([(done, total) for done, total, _, _ in progress], [(1, 4), (2, 4), (3, 4), (4, 4)])
+
+    @override_settings(RECEIPT_EXPORT_WORKERS=1)
+    def test_downloads_share_one_capped_pool(self):
+        with mock.patch('sales.receipt_export._pool', None), \
+                mock.patch('sales.receipt_export._process_pool', wraps=receipt_export._process_pool) as create:
+            for _ in range(2):
+                response = self.client.get(reverse('sale_receipts_export'))
+                self.assertEqual(len(zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))).namelist()), 3)
+            self.assertIs(receipt_export.shared_pool(), receipt_export._pool)
+        create.assert_called_once_with(1)
+
+    def test_export_requires_admin(self):
+        seller = User.objects.create_user(email='seller-export@example.com', password='password')
+        self.client.force_login(seller)
+        response = self.client.get(reverse('sale_receipts_export'))
+        self.assertEqual(response.status_code, 302)
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Row locking requires PostgreSQL')
+class SaleFinalizeConcurrencyTests(TransactionTestCase):
+    def test_competing_finalizations_never_oversell(self):
+        user = User.objects.create_user(email='race@example.com', password='password')
+        customer = Customer.objects.create(name='Race Customer')
+        product = Product.objects.create(name='Hot Product', sku='HOT-SKU', price=10.00, stock=10)
+        sales = []
+        for _ in range(4):
+            sale = Sale.objects.create(customer=customer, seller=user, total=30)
+            SaleItem.objects.create(sale=sale, product=product, quantity=3, price=10.00)
+            sales.append(sale)
+
+        barrier = threading.Barrier(len(sales))
+        results = []
+
+        def finalize(sale):
+            try:
+                barrier.wait()
+                finalize_sale(sale)
+                results.append(True)
+            except ValueError:
+                results.append(False)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=finalize, args=(sale,)) for sale in sales]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(results.count(True), 3)
+        self.assertEqual(product.stock, 1)
+        self.assertEqual(Sale.objects.filter(status='COMPLETED').count(), 3)
+
+class SaleListPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='list@example.com', password='password')
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.customer = Customer.objects.create(name='List Customer')
+        self.other_customer = Customer.objects.create(name='Other Customer')
+        Sale.objects.bulk_create([
+            Sale(customer=self.customer, seller=self.user) for _ in range(SALE_PAGE_SIZE + 10)
+        ])
+
+    def test_first_page_is_limited_and_links_to_next(self):
+        response = self.client.get(reverse('sale_list'))
+        self.assertEqual(len(response.context['sales']), SALE_PAGE_SIZE)
+        self.assertIsNotNone(response.context['next_query'])
+
+    def test_cursor_walks_every_sale_once(self):
+        response = self.client.get(reverse('sale_list'))
+        first_page = [sale.pk for sale in response.context['sales']]
+
+        response = self.client.get(reverse('sale_list') + '?' + response.context['next_query'], HTTP_HX_REQUEST='true')
+        self.assertTemplateUsed(response, 'sales/partials/sale_list_rows.html')
+        second_page = [sale.pk for sale in response.context['sales']]
+
+        self.assertIsNone(response.context['next_query'])
+        self.assertEqual(len(second_page), 10)
+        self.assertEqual(
+            sorted(first_page + second_page, reverse=True),
+            list(Sale.objects.order_by('-id').values_list('pk', flat=True)),
+        )
+
+    def test_filters_are_applied_and_kept_in_cursor(self):
+        Sale.objects.create(customer=self.other_customer, seller=self.user, status='COMPLETED')
+        response = self.client.get(reverse('sale_list'), {'status': 'COMPLETED'})
+        self.assertEqual([sale.customer for sale in response.context['sales']], [self.other_customer])
+
+        response = self.client.get(reverse('sale_list'), {'customer': self.customer.pk})
+        self.assertIn(f'customer={self.customer.pk}', response.context['next_query'])
+
+
+class SaleListConditionalTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='etag@example.com', password='password')
+        self.client.force_login(self.user)
+        self.customer = Customer.objects.create(name='ETag Customer')
+        self.sale = Sale.objects.create(customer=self.customer, seller=self.user)
+
+    def test_unchanged_partial_is_not_rendered_again(self):
+        url = reverse('sale_list') + '?status=PENDING'
+        response = self.client.get(url, HTTP_HX_REQUEST='true')
+        etag = response['ETag']
+        self.assertIn('HX-Request', response['Vary'])
+
+        with self.assertNumQueries(2):  # session and user only
+            response = self.client.get(url, HTTP_HX_REQUEST='true', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Another filter, the full page and a changed sale are all rendered
+        self.assertEqual(self.client.get(reverse('sale_list'), HTTP_HX_REQUEST='true', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertFalse(self.client.get(url).has_header('ETag'))
+        apply_total_delta(self.sale, Decimal('5'))
+        response = self.client.get(url, HTTP_HX_REQUEST='true', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '5,00')
+
+    def test_writes_committed_by_other_processes_change_the_etag(self):
+        url = reverse('sale_list') + '?status=PENDING'
+        etag = self.client.get(url, HTTP_HX_REQUEST='true')['ETag']
+
+        # All another process' commit leaves behind: the row and the stored version
+        Sale.objects.filter(pk=self.sale.pk).update(total=Decimal('7'))
+        DataVersion.objects.filter(label='sales.sale').update(version=time.time_ns())
+        # This process reuses the versions it read for DATA_VERSIONS_TTL seconds
+        response = self.client.get(url, HTTP_HX_REQUEST='true', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        forget_data_versions()
+        response = self.client.get(url, HTTP_HX_REQUEST='true', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '7,00')
+
+        stored = DataVersion.objects.get(label='sales.sale').version
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_total_delta(self.sale, Decimal('1'))
+        self.assertGreater(DataVersion.objects.get(label='sales.sale').version, stored)
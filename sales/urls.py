@@ -4,15 +4,24 @@ from . import views
 urlpatterns = [
     path('customers/', views.customer_list, name='customer_list'),
     path('customers/create/', views.customer_create, name='customer_create'),
+    path('customers/export/', views.customer_export, name='customer_export'),
+    path('customers/search/', views.customer_search, name='customer_search'),
     path('customers/<int:pk>/update/', views.customer_update, name='customer_update'),
     path('customers/<int:pk>/delete/', views.customer_delete, name='customer_delete'),
     path('', views.sale_list, name='sale_list'),
     path('create/', views.sale_create, name='sale_create'),
+    path('export/', views.sale_export, name='sale_export'),
+    path('receipts/export/', views.sale_receipts_export, name='sale_receipts_export'),
+    path('cancel/', views.sale_bulk_cancel, name='sale_bulk_cancel'),
+    path('items/search/', views.sale_item_search, name='sale_item_search'),
     path('<int:pk>/', views.sale_detail, name='sale_detail'),
     path('<int:pk>/update/', views.sale_update, name='sale_update'),
     path('<int:pk>/delete/', views.sale_delete, name='sale_delete'),
+    path('<int:pk>/cancel/', views.sale_cancel, name='sale_cancel'),
     path('<int:pk>/add_item/', views.sale_add_item, name='sale_add_item'),
+    path('<int:pk>/add_items/', views.sale_add_items, name='sale_add_items'),
     path('<int:pk>/remove_item/<int:item_pk>/', views.sale_remove_item, name='sale_remove_item'),
     path('<int:pk>/finalize/', views.sale_finalize, name='sale_finalize'),
     path('<int:pk>/receipt/', views.sale_receipt_pdf, name='sale_receipt_pdf'),
+    path('<int:pk>/receipt/prepare/', views.sale_receipt_prepare, name='sale_receipt_prepare'),
 ]
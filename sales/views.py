@@ -1,33 +1,70 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse
-from django.template.loader import render_to_string
+from django.http import HttpResponse, FileResponse, JsonResponse, StreamingHttpResponse
+from django.core.exceptions import ValidationError
 
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.urls import reverse
 from django.db import transaction, models
+from django.db.models import Q
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.core.files.storage import default_storage
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.contrib import messages
 from .models import Sale, SaleItem, Customer
 from .forms import SaleForm, SaleItemForm, CustomerForm
-from finance.models import Transaction
+from .services import finalize_sale, cancel_sale, cancel_sales, delete_sale, apply_total_delta, filter_sales, add_items, search_customers, search_catalog
+from .receipt_export import ReceiptExport
+from .receipts import receipt_items, receipt_key, render_receipt_pdf, cached_receipt_path
+from dashboard.models import User, Organization
 from dashboard.views import is_admin
+from jobs.queue import enqueue
+from core.csv_export import EXPORT_CHUNK_SIZE, csv_response
+from core.htmx import partial_response, row_response
+from core.versions import conditional_on
+from .tasks import render_receipt
+import json
 # from inventory.models import Item
 
+SALE_PAGE_SIZE = 50
+SALE_FILTER_PARAMS = ('status', 'seller', 'customer', 'date_from', 'date_to')
+
 @login_required
 def customer_list(request):
     customers = Customer.objects.all()
     return render(request, 'sales/customer_list.html', {'customers': customers})
 
+@login_required
+@user_passes_test(is_admin)
+def customer_export(request):
+    """Download every customer as CSV."""
+    rows = Customer.objects.order_by('name', 'pk').values_list(
+        'name', 'email', 'phone', 'document', 'address', 'city', 'state',
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    return csv_response('clientes.csv', ['Nome', 'Email', 'Telefone', 'CPF/CNPJ', 'Endereço', 'Cidade', 'Estado'], rows)
+
+@login_required
+def customer_search(request):
+    """Typeahead for the customer field: HTML options for HTMX, JSON otherwise."""
+    customers = search_customers(request.GET.get('q'))
+    if request.htmx:
+        return render(request, 'sales/partials/customer_search_results.html', {'customers': customers, 'query': request.GET.get('q', '')})
+    return JsonResponse({'results': [
+        {'id': customer.pk, 'name': customer.name, 'document': customer.document, 'phone': customer.phone}
+        for customer in customers
+    ]})
+
 @login_required
 def customer_create(request):
     if request.method == 'POST':
         form = CustomerForm(request.POST)
         if form.is_valid():
-            form.save()
+            customer = form.save()
             if request.htmx:
-                customers = Customer.objects.all()
-                return render(request, 'sales/partials/customer_list_rows.html', {'customers': customers})
+                return row_response(request, 'sales/partials/customer_row.html', {'customer': customer},
+                                    insert_into='customer-table-body', close_modal=True)
             return redirect('customer_list')
     else:
         form = CustomerForm()
@@ -43,10 +80,9 @@ def customer_update(request, pk):
     if request.method == 'POST':
         form = CustomerForm(request.POST, instance=customer)
         if form.is_valid():
-            form.save()
+            customer = form.save()
             if request.htmx:
-                customers = Customer.objects.all()
-                return render(request, 'sales/partials/customer_list_rows.html', {'customers': customers})
+                return row_response(request, 'sales/partials/customer_row.html', {'customer': customer}, close_modal=True)
             return redirect('customer_list')
     else:
         form = CustomerForm(instance=customer)
@@ -61,29 +97,73 @@ def customer_update(request, pk):
 @require_http_methods(["DELETE", "POST"])
 def customer_delete(request, pk):
     customer = get_object_or_404(Customer, pk=pk)
+    deleted_row = None
     try:
         customer.delete()
+        deleted_row = f'customer-{pk}'
         messages.success(request, 'Cliente excluído com sucesso.')
     except models.ProtectedError:
         messages.error(request, 'Não é possível excluir este cliente pois existem vendas associadas a ele.')
     
     if request.htmx:
-        customers = Customer.objects.all()
-        rows_html = render_to_string('sales/partials/customer_list_rows.html', {'customers': customers}, request=request)
-        messages_html = render_to_string('partials/messages.html', {}, request=request)
-        
-        # SOLUÇÃO DEFINITIVA: 
-        # Envolvemos a mensagem numa <tr> oculta. Isso é HTML válido para um <tbody>.
-        # O HTMX vai encontrar a div "messages" lá dentro, movê-la para o topo e exibir o alerta.
-        final_html = rows_html + f'<tr style="display:none"><td>{messages_html}</td></tr>'
-        
-        return HttpResponse(final_html)
+        return row_response(request, delete_row=deleted_row)
     return redirect('customer_list')
 
+def _encode_sale_cursor(sale):
+    return f"{sale.created_at.isoformat()}_{sale.pk}"
+
+def _decode_sale_cursor(cursor):
+    created_at, _, pk = (cursor or '').rpartition('_')
+    try:
+        created_at = parse_datetime(created_at)
+    except ValueError:
+        return None
+    if created_at is None or not pk.isdigit():
+        return None
+    return created_at, int(pk)
+
+def _sale_page(params):
+    """
+    Return one page of sales ordered by (created_at, id) descending.
+
+    Uses keyset pagination: instead of OFFSET, the next page starts right
+    after the last row of the previous one, so the cost of a page does not
+    grow with the size of the Sale table.
+    """
+    sales = filter_sales(Sale.objects.select_related('customer', 'seller'), params)
+
+    cursor = _decode_sale_cursor(params.get('cursor'))
+    if cursor:
+        created_at, pk = cursor
+        sales = sales.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+
+    sales = list(sales.order_by('-created_at', '-id')[:SALE_PAGE_SIZE + 1])
+    next_query = None
+    if len(sales) > SALE_PAGE_SIZE:
+        sales = sales[:SALE_PAGE_SIZE]
+        query = params.copy()
+        for key in list(query.keys()):
+            if key not in SALE_FILTER_PARAMS:
+                del query[key]
+        query['cursor'] = _encode_sale_cursor(sales[-1])
+        next_query = query.urlencode()
+
+    return {'sales': sales, 'next_query': next_query}
+
 @login_required
+@conditional_on(Sale, Customer, User, when=lambda request: request.htmx)
 def sale_list(request):
-    sales = Sale.objects.select_related('customer', 'seller').all()
-    return render(request, 'sales/sale_list.html', {'sales': sales})
+    context = _sale_page(request.GET)
+    if request.htmx:
+        return render(request, 'sales/partials/sale_list_rows.html', context)
+
+    context.update({
+        'filters': {key: request.GET.get(key, '') for key in SALE_FILTER_PARAMS},
+        'filtered_customer': Customer.objects.filter(pk=request.GET['customer']).first() if request.GET.get('customer', '').isdigit() else None,
+        'status_choices': Sale.STATUS_CHOICES,
+        'sellers': User.objects.order_by('email'),
+    })
+    return render(request, 'sales/sale_list.html', context)
 
 @login_required
 def sale_create(request):
@@ -94,8 +174,9 @@ def sale_create(request):
             sale.seller = request.user
             sale.save()
             if request.htmx:
-                sales = Sale.objects.all()
-                return render(request, 'sales/partials/sale_list_rows.html', {'sales': sales})
+                # The list is ordered newest first
+                return row_response(request, 'sales/partials/sale_row.html', {'sale': sale},
+                                    insert_into='sale-table-body', position='afterbegin', close_modal=True)
             return redirect('sale_detail', pk=sale.pk)
     else:
         form = SaleForm()
@@ -110,10 +191,9 @@ def sale_update(request, pk):
     if request.method == 'POST':
         form = SaleForm(request.POST, instance=sale)
         if form.is_valid():
-            form.save()
+            sale = form.save()
             if request.htmx:
-                sales = Sale.objects.all()
-                return render(request, 'sales/partials/sale_list_rows.html', {'sales': sales})
+                return row_response(request, 'sales/partials/sale_row.html', {'sale': sale}, close_modal=True)
             return redirect('sale_list')
     else:
         form = SaleForm(instance=sale)
@@ -128,45 +208,77 @@ def sale_update(request, pk):
 def sale_delete(request, pk):
     sale = get_object_or_404(Sale, pk=pk)
     
-    if sale.status == 'COMPLETED':
-        with transaction.atomic():
-            # Restore stock
-            for item in sale.items.all():
-                if item.product:
-                    item.product.stock += item.quantity
-                    item.product.save()
-            
-            # Delete associated transactions
-            sale.transactions.all().delete()
-
-    sale.delete()
+    delete_sale(sale)
     messages.success(request, 'Venda excluída com sucesso.')
     if request.htmx:
-        sales = Sale.objects.all()
-        rows_html = render_to_string('sales/partials/sale_list_rows.html', {'sales': sales}, request=request)
-        messages_html = render_to_string('partials/messages.html', {}, request=request)
-        final_html = rows_html + f'<tr style="display:none"><td>{messages_html}</td></tr>'
-        return HttpResponse(final_html)
+        return row_response(request, delete_row=f'sale-{pk}')
     return redirect('sale_list')
 
 @login_required
-def sale_detail(request, pk):
+@user_passes_test(is_admin)
+@require_http_methods(["POST"])
+def sale_cancel(request, pk):
     sale = get_object_or_404(Sale, pk=pk)
-    items = sale.items.all()
+    try:
+        cancel_sale(sale)
+        messages.success(request, 'Venda cancelada com sucesso.')
+    except ValueError as e:
+        messages.error(request, str(e))
+
+    if request.htmx:
+        sale = Sale.objects.select_related('customer', 'seller').get(pk=pk)
+        return row_response(request, 'sales/partials/sale_row.html', {'sale': sale})
+    return redirect('sale_detail', pk=pk)
+
+@login_required
+@user_passes_test(is_admin)
+@require_http_methods(["POST"])
+def sale_bulk_cancel(request):
+    sale_ids = [pk for pk in request.POST.getlist('sale_ids') if pk.isdigit()]
+    canceled = cancel_sales(sale_ids)
+    if canceled:
+        messages.success(request, f'{len(canceled)} vendas canceladas com sucesso.')
+    else:
+        messages.warning(request, 'Nenhuma venda foi cancelada.')
+
+    if request.htmx:
+        sales = Sale.objects.select_related('customer', 'seller').filter(pk__in=canceled)
+        # sale_list_rows includes sale_row with oob=True, swapping every canceled row in place
+        return row_response(request, 'sales/partials/sale_list_rows.html', {'sales': sales})
+    return redirect('sale_list')
+
+def _sale_items_context(sale):
+    # Fetch product/service with the items so the rows don't query once per line
+    return {'sale': sale, 'items': sale.items.select_related('product', 'service').order_by('pk')}
+
+@login_required
+def sale_item_search(request):
+    """Item picker: exact SKU/barcode hit first, then ranked name search over products and services."""
+    query = request.GET.get('q', '')
+    exact, results = search_catalog(query)
+    if request.htmx:
+        return render(request, 'sales/partials/item_search_results.html', {'results': results, 'exact': exact, 'query': query})
+    return JsonResponse({'exact': exact, 'results': [
+        {key: value for key, value in result.items() if key != 'rank'} for result in results
+    ]})
+
+@login_required
+def sale_detail(request, pk):
+    sale = get_object_or_404(Sale.objects.select_related('customer', 'seller'), pk=pk)
     form = SaleItemForm()
 
-    return render(request, 'sales/sale_detail.html', {'sale': sale, 'items': items, 'form': form})
+    context = _sale_items_context(sale)
+    context['form'] = form
+    return render(request, 'sales/sale_detail.html', context)
 
 @login_required
 def sale_add_item(request, pk):
     sale = get_object_or_404(Sale, pk=pk)
 
-    if sale.status == 'COMPLETED':
-        messages.error(request, 'Não é possível adicionar itens a uma venda finalizada.')
+    if sale.status != 'PENDING':
+        messages.error(request, 'Não é possível adicionar itens a uma venda finalizada ou cancelada.')
         if request.htmx:
-            rows_html = render_to_string('sales/partials/sale_items.html', {'sale': sale}, request=request)
-            messages_html = render_to_string('partials/messages.html', {}, request=request)
-            return HttpResponse(rows_html + messages_html)
+            return partial_response(request, 'sales/partials/sale_items.html', _sale_items_context(sale))
         return redirect('sale_detail', pk=pk)
 
     if request.method == 'POST':
@@ -177,12 +289,11 @@ def sale_add_item(request, pk):
             
             # Check stock availability
             if sale_item.product:
-                if sale_item.product.stock < sale_item.quantity:
-                    messages.error(request, f'Estoque insuficiente para {sale_item.product.name}. Disponível: {sale_item.product.stock}')
+                available = sale_item.product.available_stock
+                if available < sale_item.quantity:
+                    messages.error(request, f'Estoque insuficiente para {sale_item.product.name}. Disponível: {available}')
                     if request.htmx:
-                        rows_html = render_to_string('sales/partials/sale_items.html', {'sale': sale}, request=request)
-                        messages_html = render_to_string('partials/messages.html', {}, request=request)
-                        return HttpResponse(rows_html + messages_html)
+                        return partial_response(request, 'sales/partials/sale_items.html', _sale_items_context(sale))
                     return redirect('sale_detail', pk=pk)
 
             if sale_item.product:
@@ -192,43 +303,100 @@ def sale_add_item(request, pk):
             else:
                 sale_item.price = 0
             
-            sale_item.save()
-            # Update sale total
-            sale.total = sum(item.quantity * item.price for item in sale.items.all())
-            sale.save()
+            try:
+                with transaction.atomic():
+                    # Lock the sale so it cannot be finalized while the item goes in
+                    if Sale.objects.select_for_update().get(pk=sale.pk).status != 'PENDING':
+                        raise ValidationError('Não é possível adicionar itens a uma venda finalizada ou cancelada.')
+                    sale_item.save()
+                    # Update sale total with an atomic delta instead of re-summing every item
+                    apply_total_delta(sale, sale_item.subtotal)
+            except ValidationError as e:
+                for error in e.messages:
+                    messages.error(request, error)
+                if request.htmx:
+                    return partial_response(request, 'sales/partials/sale_items.html', _sale_items_context(sale))
+                return redirect('sale_detail', pk=pk)
             
             messages.success(request, 'Item adicionado com sucesso.')
             if request.htmx:
-                rows_html = render_to_string('sales/partials/sale_items.html', {'sale': sale}, request=request)
-                messages_html = render_to_string('partials/messages.html', {}, request=request)
-                return HttpResponse(rows_html + messages_html)
+                return partial_response(request, 'sales/partials/sale_items.html', _sale_items_context(sale))
+        else:
+            for errors in form.errors.values():
+                for error in errors:
+                    messages.error(request, error)
+            if request.htmx:
+                return partial_response(request, 'sales/partials/sale_items.html', _sale_items_context(sale))
     return redirect('sale_detail', pk=pk)
+
+def _parse_cart(request):
+    if request.content_type == 'application/json':
+        data = json.loads(request.body or b'{}')
+    else:
+        data = json.loads(request.POST.get('cart') or '[]')
+    lines = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(lines, list):
+        raise ValueError
+    return lines
+
+@login_required
+@require_http_methods(["POST"])
+def sale_add_items(request, pk):
+    """Add a whole cart (JSON body or a `cart` form field with JSON) to a sale in one round trip."""
+    sale = get_object_or_404(Sale, pk=pk)
+    wants_json = request.content_type == 'application/json'
+
+    try:
+        items = add_items(sale, _parse_cart(request))
+    except ValueError:
+        errors = ['Carrinho inválido.']
+    except ValidationError as e:
+        errors = e.messages
+    else:
+        errors = []
+
+    if wants_json:
+        if errors:
+            return JsonResponse({'errors': errors}, status=400)
+        return JsonResponse({'added': len(items), 'total': sale.total})
+
+    if errors:
+        for error in errors:
+            messages.error(request, error)
+    else:
+        messages.success(request, f'{len(items)} itens adicionados com sucesso.')
+    if request.htmx:
+        return partial_response(request, 'sales/partials/sale_items.html', _sale_items_context(sale))
     return redirect('sale_detail', pk=pk)
 
 @require_http_methods(["DELETE", "POST"])
 def sale_remove_item(request, pk, item_pk):
     sale = get_object_or_404(Sale, pk=pk)
 
-    if sale.status == 'COMPLETED':
-        messages.error(request, 'Não é possível remover itens de uma venda finalizada.')
+    if sale.status != 'PENDING':
+        messages.error(request, 'Não é possível remover itens de uma venda finalizada ou cancelada.')
         if request.htmx:
-            rows_html = render_to_string('sales/partials/sale_items.html', {'sale': sale}, request=request)
-            messages_html = render_to_string('partials/messages.html', {}, request=request)
-            return HttpResponse(rows_html + messages_html)
+            return partial_response(request, 'sales/partials/sale_items.html', _sale_items_context(sale))
         return redirect('sale_detail', pk=pk)
 
     item = get_object_or_404(SaleItem, pk=item_pk, sale=sale)
-    item.delete()
-    
-    # Update sale total
-    sale.total = sum(item.quantity * item.price for item in sale.items.all())
-    sale.save()
+    with transaction.atomic():
+        # Lock the sale: concurrent removals of the same item and finalize_sale wait here
+        locked = Sale.objects.select_for_update().get(pk=sale.pk)
+        if locked.status != 'PENDING':
+            messages.error(request, 'Não é possível remover itens de uma venda finalizada ou cancelada.')
+            removed = False
+        else:
+            deleted, _ = item.delete()
+            # Only the request that actually deleted the row takes its subtotal off
+            removed = deleted > 0
+            if removed:
+                apply_total_delta(sale, -item.subtotal)
     
-    messages.success(request, 'Item removido com sucesso.')
+    if removed:
+        messages.success(request, 'Item removido com sucesso.')
     if request.htmx:
-        rows_html = render_to_string('sales/partials/sale_items.html', {'sale': sale}, request=request)
-        messages_html = render_to_string('partials/messages.html', {}, request=request)
-        return HttpResponse(rows_html + messages_html)
+        return partial_response(request, 'sales/partials/sale_items.html', _sale_items_context(sale))
     return redirect('sale_detail', pk=pk)
 
 @login_required
@@ -236,8 +404,8 @@ def sale_remove_item(request, pk, item_pk):
 def sale_finalize(request, pk):
     sale = get_object_or_404(Sale, pk=pk)
     
-    if sale.status == 'COMPLETED':
-        messages.warning(request, 'Esta venda já foi finalizada.')
+    if sale.status != 'PENDING':
+        messages.warning(request, 'Esta venda já foi finalizada ou cancelada.')
         return redirect('sale_detail', pk=pk)
         
     if not sale.items.exists():
@@ -245,34 +413,8 @@ def sale_finalize(request, pk):
         return redirect('sale_detail', pk=pk)
 
     try:
-        with transaction.atomic():
-            # 1. Deduct stock from Inventory (for Products)
-            for item in sale.items.all():
-                if item.product:
-                    # Refresh product from db to ensure stock is up to date
-                    item.product.refresh_from_db()
-                    if item.product.stock < item.quantity:
-                        raise ValueError(f'Estoque insuficiente para o produto {item.product.name}. Estoque atual: {item.product.stock}')
-                    item.product.stock -= item.quantity
-                    item.product.save()
-            
-            # 2. Generate a "Receivable" (Transaction type=INCOME) in Finance
-            Transaction.objects.create(
-                description=f"Venda #{sale.id} - {sale.customer.name}",
-                amount=sale.total,
-                type='INCOME',
-                status='PAID',
-                due_date=timezone.now().date(),
-                paid_date=timezone.now().date(),
-                sale=sale
-            )
-            
-            # 3. Update sale status
-            sale.status = 'COMPLETED'
-            sale.save()
-            
-            messages.success(request, 'Venda finalizada com sucesso!')
-            
+        finalize_sale(sale)
+        messages.success(request, 'Venda finalizada com sucesso!')
     except ValueError as e:
         messages.error(request, str(e))
     except Exception as e:
@@ -282,16 +424,30 @@ def sale_finalize(request, pk):
 
 @login_required
 def sale_receipt_pdf(request, pk):
-    sale = get_object_or_404(Sale, pk=pk)
-    # Pass request to enable context processors (like organization)
-    html_string = render_to_string('sales/pdf/receipt.html', {'sale': sale}, request=request)
-    
+    sale = get_object_or_404(Sale.objects.select_related('customer', 'seller'), pk=pk)
+    organization = Organization.load()
+    items = receipt_items(sale)
+    etag, path = receipt_key(sale, organization, items)
+    filename = f"comprovante_venda_{sale.id}.pdf"
+
+    last_modified = None
+    if sale.status == 'COMPLETED' and default_storage.exists(path):
+        last_modified = int(default_storage.get_modified_time(path).timestamp())
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified:
+        return not_modified
+
     try:
-        import weasyprint
-        pdf_file = weasyprint.HTML(string=html_string, base_url=request.build_absolute_uri()).write_pdf()
-        
-        response = HttpResponse(pdf_file, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="comprovante_venda_{sale.id}.pdf"'
+        if sale.status == 'COMPLETED':
+            # Finalized receipts never change: render once and serve the stored file
+            cached_receipt_path(sale, organization, items, path, base_url=request.build_absolute_uri())
+            response = FileResponse(default_storage.open(path), as_attachment=True, filename=filename, content_type='application/pdf')
+            response['Last-Modified'] = http_date(int(default_storage.get_modified_time(path).timestamp()))
+        else:
+            pdf_file = render_receipt_pdf(sale, organization, items, base_url=request.build_absolute_uri())
+            response = HttpResponse(pdf_file, content_type='application/pdf')
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['ETag'] = etag
         return response
     except OSError:
         messages.error(request, "A geração de PDF não está disponível no ambiente local (bibliotecas GTK ausentes).")
@@ -299,3 +455,41 @@ def sale_receipt_pdf(request, pk):
     except Exception as e:
         messages.error(request, f"Erro ao gerar PDF: {str(e)}")
         return redirect('sale_detail', pk=pk)
+
+@login_required
+@require_http_methods(["POST"])
+def sale_receipt_prepare(request, pk):
+    """Render the receipt in a background job; the returned partial polls until it is ready."""
+    sale = get_object_or_404(Sale, pk=pk)
+    job = enqueue(render_receipt, sale.pk, created_by=request.user)
+    return render(request, 'jobs/partials/job_status.html', {'job': job})
+
+@login_required
+@user_passes_test(is_admin)
+def sale_export(request):
+    """
+    Download the sales matching the sale list filters as CSV, one line per
+    item (a sale without items gets one line with the item columns empty).
+    """
+    status = dict(Sale.STATUS_CHOICES)
+    rows = filter_sales(Sale.objects.all(), request.GET).order_by('-created_at', '-id', 'items__id').values_list(
+        'pk', 'created_at', 'customer__name', 'seller__email', 'status', 'total',
+        'items__product__sku', 'items__product__name', 'items__service__name', 'items__quantity', 'items__price',
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    header = ['Venda', 'Data', 'Cliente', 'Vendedor', 'Status', 'Total da Venda',
+              'SKU', 'Item', 'Quantidade', 'Preço Unitário', 'Subtotal']
+    return csv_response('vendas.csv', header, (
+        [pk, timezone.localtime(created_at).strftime('%Y-%m-%d %H:%M'), customer, seller, status[sale_status], total,
+         sku, product or service, quantity, price, price * quantity if quantity else None]
+        for pk, created_at, customer, seller, sale_status, total, sku, product, service, quantity, price in rows
+    ))
+
+@login_required
+@user_passes_test(is_admin)
+def sale_receipts_export(request):
+    """Download the receipts of every sale matching the sale list filters as one ZIP."""
+    sales = filter_sales(Sale.objects.all(), request.GET)
+    export = ReceiptExport(sales, Organization.load(), base_url=request.build_absolute_uri())
+    response = StreamingHttpResponse(export, content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="comprovantes.zip"'
+    return response